@@ -1,13 +1,193 @@
 
 
+import numpy as np
+
+
+# Rx gearbox buffer load table - for each sequence count, the input bit loaded into
+# each of the lower 66 buffer bits (-1 where the buffer bit holds its value).
+# Mirrors the bit select method in RxGearboxModel.next
+RX_DATA_IDXS = [00,32,64,30,62,28,60,26,58,24,56,22,54,20,52,18,50,16,48,14,46,12,44,10,42,8,40,6,38,4,36,2,34]
+
+def _make_rx_load_table():
+    table = np.full((33, 66), -1, dtype=np.int8)
+    for count in range(33):
+        idata_idx = RX_DATA_IDXS[count]
+        for bit in range(66):
+            if count % 2 == 0:
+                if idata_idx != 0 and bit >= idata_idx:
+                    table[count, bit] = bit - idata_idx
+                elif bit < 32 - count:
+                    table[count, bit] = count + bit
+            else:
+                if bit >= idata_idx and bit < idata_idx + 32:
+                    table[count, bit] = bit - idata_idx
+    return table
+
+RX_LOAD_TABLE = _make_rx_load_table()
+
+def _make_rx_load_masks():
+    # Packed form of the load table - for each count, (load mask, left shift, left mask, right shift, right mask)
+    masks = []
+    for count in range(33):
+        lshift, lmask, rshift, rmask = 0, 0, 0, 0
+        for bit, src in enumerate(RX_LOAD_TABLE[count].tolist()):
+            if src < 0:
+                continue
+            if bit >= src:
+                lshift = bit - src
+                lmask |= 1 << bit
+            else:
+                rshift = src - bit
+                rmask |= 1 << bit
+        masks.append((lmask | rmask, lshift, lmask, rshift, rmask))
+    return masks
+
+RX_LOAD_MASKS = _make_rx_load_masks()
+
+MASK_32 = (1 << 32) - 1
+MASK_66 = (1 << 66) - 1
+
+# Tx gearbox phase table - for each sequence count, the buffer load positions as per gearbox_seq.sv
+# (33 cycle sequence, 16 66-bit blocks, pause on the last cycle)
+TX_SEQ_LENGTH = 33
+TX_BLOCKS_PER_SEQ = 16
+
+def _make_tx_phase_table():
+    table = []
+    for count in range(TX_SEQ_LENGTH):
+        load_header = int(count % 2 == 0)
+        table.append({
+            'count' : count,
+            'pause' : count == TX_SEQ_LENGTH - 1,
+            'frame_word' : int(count % 2 == 1),
+            'load_header' : load_header,
+            'header_idx' : count if load_header else -1,
+            'data_idx' : count + 2 if load_header else count + 1
+        })
+    return table
+
+TX_PHASE_TABLE = _make_tx_phase_table()
+
+# Tx gearbox buffer load table - for each sequence count, the input bit loaded into each of the
+# 66 buffer bits (-1 where it is not loaded), with the input as a 34-bit word of the header then
+# the data. Bits not loaded hold their value, except the lower 32 which shift down from the top.
+TX_INPUT_WIDTH = 34
+
+def _make_tx_load_table():
+    table = np.full((TX_SEQ_LENGTH, 66), -1, dtype=np.int8)
+    for phase in TX_PHASE_TABLE:
+        if phase['pause']:
+            continue
+        if phase['load_header']:
+            table[phase['count'], phase['header_idx'] : phase['header_idx'] + 2] = [0, 1]
+        table[phase['count'], phase['data_idx'] : phase['data_idx'] + 32] = np.arange(2, 34)
+    return table
+
+TX_LOAD_TABLE = _make_tx_load_table()
+
+RUN_CHUNK_CYCLES = 4096 # cycles per vectorised step of the model run() methods
+
+
+def unpack_words(words, width=32):
+    """Unpack an array of integer words into an N x width array of bits, bit 0 first"""
+    words = np.asarray(words, dtype=np.uint64)
+    return ((words[:, None] >> np.arange(width, dtype=np.uint64)) & 1).astype(np.uint8)
+
+def pack_words(bits):
+    """Pack an N x width array of bits (bit 0 first) into an array of integer words"""
+    bits = np.asarray(bits, dtype=np.uint64)
+    return (bits << np.arange(bits.shape[1], dtype=np.uint64)).sum(axis=1, dtype=np.uint64)
+
+
+# Serial stream helpers - the gearboxes convert between 66-bit blocks (header first, lsb first)
+#   and the 32-bit words of the serial stream, see TxGearboxModel.word_at.
+# Every 16 blocks are exactly 33 words, so the word/block bit positions repeat each sequence and
+#   a whole stream is converted with one set of fixed shifts per position in the sequence.
+
+_U64 = np.uint64
+_M32 = _U64(MASK_32)
+
+def blocks_to_words(header, data):
+    """Serialise arrays of 2-bit headers and 64-bit data (a multiple of 16 blocks) into 32-bit words"""
+    # One row per block position in the sequence
+    header = np.asarray(header, dtype=np.uint64).reshape(-1, TX_BLOCKS_PER_SEQ).T
+    data = np.asarray(data, dtype=np.uint64).reshape(-1, TX_BLOCKS_PER_SEQ).T
+
+    # Low 64 bits and top 2 bits of each 66-bit block
+    lo = np.ascontiguousarray((header & _U64(0x3)) | (data << _U64(2)))
+    hi = np.ascontiguousarray(data >> _U64(62))
+
+    words = np.empty((TX_SEQ_LENGTH, lo.shape[1]), dtype=np.uint32)
+    for word in range(TX_SEQ_LENGTH):
+        block, r = divmod(32 * word, 66)
+        if r <= 32:
+            w = lo[block] >> _U64(r)
+        elif r <= 34:
+            w = (lo[block] >> _U64(r)) | (hi[block] << _U64(64 - r))
+        elif r < 64:
+            w = (lo[block] >> _U64(r)) | (hi[block] << _U64(64 - r)) | (lo[block + 1] << _U64(66 - r))
+        else:
+            w = (hi[block] >> _U64(r - 64)) | (lo[block + 1] << _U64(66 - r))
+        words[word] = w # truncates to 32 bits
+
+    return words.T.reshape(-1)
+
+def words_to_blocks(words, offset=0):
+    """Deserialise 32-bit words into (header, data) arrays, with the first block starting at bit
+    offset. Only whole 16 block sequences are converted, also returns the number of words used."""
+    words = np.asarray(words, dtype=np.uint64)
+
+    # Last word read by the last block of a sequence
+    last_word = (offset + 66 * (TX_BLOCKS_PER_SEQ - 1)) // 32 + 3
+    n_seqs = max(0, (len(words) - last_word - 1) // TX_SEQ_LENGTH + 1)
+
+    # One row per word position in the sequence, with the extra words read past the end
+    n_cols = last_word + 1
+    seq_words = np.empty((n_cols, n_seqs), dtype=np.uint64)
+    for col in range(n_cols):
+        seq_words[col] = words[col : col + TX_SEQ_LENGTH * n_seqs : TX_SEQ_LENGTH]
+
+    header = np.empty((TX_BLOCKS_PER_SEQ, n_seqs), dtype=np.uint8)
+    data = np.empty((TX_BLOCKS_PER_SEQ, n_seqs), dtype=np.uint64)
+    for block in range(TX_BLOCKS_PER_SEQ):
+        word, r = divmod(offset + 66 * block, 32)
+        a = seq_words[word] | (seq_words[word + 1] << _U64(32))
+        b = seq_words[word + 2] | (seq_words[word + 3] << _U64(32))
+        lo = (a >> _U64(r)) | (b << _U64(64 - r)) if r else a
+        hi = (b >> _U64(r)) & _U64(0x3)
+        header[block] = lo & _U64(0x3)
+        data[block] = (lo >> _U64(2)) | (hi << _U64(62))
+
+    return header.T.reshape(-1), data.T.reshape(-1), TX_SEQ_LENGTH * n_seqs
+
+def find_block_lock(words, n_blocks=64):
+    """Find the bit offset (0-65) where the next n_blocks sync headers are all valid, as the
+    lock state machine requires before GOOD_64. Returns None if there is no lock yet."""
+    n_seqs = -(-n_blocks // TX_BLOCKS_PER_SEQ)
+    words = np.asarray(words, dtype=np.uint32)[:TX_SEQ_LENGTH * (n_seqs + 1)]
+
+    for offset in range(66):
+        header, _, _ = words_to_blocks(words, offset)
+        if len(header) < n_blocks:
+            return None
+        if np.all((header[:n_blocks] == 1) | (header[:n_blocks] == 2)):
+            return offset
+
+    return None
+
+
 class RxGearboxModel:
     def __init__(self, type='int'):
+        self.type = type
         if type == 'str':
             self.obuf = ['XXX' for _ in range(67)] # Extra bit for half slip
+        elif type == 'packed':
+            self.obuf = 0 # 67-bit buffer as an integer, data and header I/O as integers
         else:
             self.obuf = [0 for _ in range(67)]
         self.cycle = 0
         self.half_slip = 0
+        self.trace = [] # next_batch output of each stream batch, with stream debug
 
 
     def next(self, idata, slip=False):
@@ -25,8 +205,6 @@ class RxGearboxModel:
             self.frame_word = int(self.count % 2 == 0) and self.count != 32
             self.output_header = (int(self.count % 2 == 1) or self.count == 32) and self.valid
         
-        data_idxs = [00,32,64,30,62,28,60,26,58,24,56,22,54,20,52,18,50,16,48,14,46,12,44,10,42,8,40,6,38,4,36,2,34]
-
         # if self.count % 2 == 0:
         #     idata_idx = (66 - self.count) % 66
         #     obuf[idata_idx:66] = idata[0 : self.count]
@@ -36,11 +214,14 @@ class RxGearboxModel:
         #     idata_idx = ((66 - self.count - 32) - 1) % 66
         #     obuf[idata_idx : self.idata_idx + 32] = idata
 
+        if self.type == 'packed':
+            return self._next_packed(idata, slip)
+
         # bit select method
 
         for bit in range(len(self.obuf)):
 
-            self.idata_idx = data_idxs[self.count]
+            self.idata_idx = RX_DATA_IDXS[self.count]
 
             if self.count % 2 == 0:
                 if self.idata_idx != 0 and bit >= self.idata_idx and bit < 66:
@@ -79,8 +260,171 @@ class RxGearboxModel:
 
         return ret
 
-        
+    def _next_packed(self, idata, slip):
+
+        self.idata_idx = RX_DATA_IDXS[self.count]
+
+        # shift/mask method
+        load_mask, lshift, lmask, rshift, rmask = RX_LOAD_MASKS[self.count]
 
+        obuf = (self.obuf & ~load_mask) | ((idata << lshift) & lmask) | ((idata >> rshift) & rmask)
+        self.obuf = (obuf & MASK_66) | ((obuf & 1) << 66)
+
+        data_idx = 2 + self.half_slip + 32 * self.frame_word
+        self.odata = (self.obuf >> data_idx) & MASK_32
+        self.oheader = (self.obuf >> self.half_slip) & 0x3
+
+        ret = {
+            'data' : self.odata,
+            'header' : self.oheader,
+            'data_valid' : self.valid,
+            'header_valid' : self.output_header,
+            'obuf' : self.obuf,
+            'cycle' : self.cycle,
+            'count' : self.count,
+            'frame_word' : self.frame_word
+        }
+
+        if not self.slip:
+            self.cycle = self.cycle + 1
+
+        if slip:
+            self.half_slip = (self.half_slip + 1) % 2
+
+        return ret
+
+
+    def next_batch(self, idata, slip=None):
+        """
+        Run the model for N cycles in one call, giving the same result as N calls to next().
+
+        idata is either an N x 32 array of bits or an array of N packed 32-bit words. slip is an
+        optional length N array of slip inputs. Returns a dict of arrays with the same keys as
+        next(), data and header are packed to integers if idata was packed.
+        """
+
+        idata = np.asarray(idata)
+        packed = idata.ndim == 1
+        ibits = unpack_words(idata) if packed else idata.astype(np.uint8)
+        n = len(ibits)
+
+        slip = np.zeros(n, dtype=bool) if slip is None else np.asarray(slip, dtype=bool)
+
+        if not n:
+            # Nothing to run, the state is unchanged
+            return {
+                'data' : np.zeros(0, dtype=np.uint32) if packed else np.zeros((0, 32), dtype=np.uint8),
+                'header' : np.zeros(0, dtype=np.uint8) if packed else np.zeros((0, 2), dtype=np.uint8),
+                'data_valid' : np.zeros(0, dtype=bool),
+                'header_valid' : np.zeros(0, dtype=bool),
+                'obuf' : np.zeros((0, 67), dtype=np.uint8),
+                'cycle' : np.zeros(0, dtype=np.int64),
+                'count' : np.zeros(0, dtype=np.int64),
+                'frame_word' : np.zeros(0, dtype=np.uint8)
+            }
+
+        if self.type == 'packed':
+            obuf_init = np.array([(self.obuf >> i) & 1 for i in range(67)], dtype=np.uint8)
+        else:
+            try:
+                obuf_init = np.array(self.obuf, dtype=np.uint8)
+            except ValueError:
+                raise ValueError('next_batch requires an integer model buffer') from None
+
+        # Sequence count and half slip state seen by each cycle
+        not_slip_before = np.concatenate(([0], np.cumsum(~slip)[:-1]))
+        slip_before = np.arange(n) - not_slip_before
+        cycle = self.cycle + not_slip_before
+        count = cycle % 33
+        half_slip = (self.half_slip + slip_before) % 2
+
+        # Find the last cycle at or before each cycle which loaded each buffer bit
+        load_src = RX_LOAD_TABLE[count]
+        loaded = load_src >= 0
+        last_load = np.maximum.accumulate(np.where(loaded, np.arange(n)[:, None], -1), axis=0)
+        have_load = last_load >= 0
+        last_load_c = np.maximum(last_load, 0)
+
+        src_bit = RX_LOAD_TABLE[count[last_load_c], np.arange(66)]
+        obuf = np.where(have_load, ibits[last_load_c, np.maximum(src_bit, 0)], obuf_init[None, :66])
+        obuf = np.concatenate((obuf, obuf[:, :1]), axis=1)
+
+        # Output selection
+        odd = count % 2 == 1
+        valid = np.where(half_slip, count != 31, count != 0)
+        frame_word = np.where(half_slip, ~odd & (count != 32), ~odd)
+        output_header = np.where(half_slip, (odd | (count == 32)) & valid, odd)
+
+        data_start = 2 + half_slip + 32 * frame_word
+        data_sel = data_start[:, None] + np.arange(32)
+        header_sel = half_slip[:, None] + np.arange(2)
+
+        odata = np.take_along_axis(obuf, data_sel, axis=1)
+        oheader = np.take_along_axis(obuf, header_sel, axis=1)
+
+        # Save the final state
+        if self.type == 'packed':
+            self.obuf = sum(int(x) << i for i, x in enumerate(obuf[-1]))
+        else:
+            self.obuf = [int(x) for x in obuf[-1]]
+        self.count = int(count[-1])
+        self.valid = bool(valid[-1])
+        self.frame_word = int(frame_word[-1])
+        self.output_header = bool(output_header[-1])
+        self.idata_idx = RX_DATA_IDXS[self.count]
+        self.slip = bool(slip[-1])
+        if self.type == 'packed':
+            self.odata = int(pack_words(odata[-1:])[0])
+            self.oheader = int(pack_words(oheader[-1:])[0])
+        else:
+            self.odata = [int(x) for x in odata[-1]]
+            self.oheader = [int(x) for x in oheader[-1]]
+        self.cycle = int(cycle[-1]) + int(not slip[-1])
+        self.half_slip = int(half_slip[-1] + slip[-1]) % 2
+
+        return {
+            'data' : pack_words(odata).astype(np.uint32) if packed else odata,
+            'header' : pack_words(oheader).astype(np.uint8) if packed else oheader,
+            'data_valid' : valid,
+            'header_valid' : output_header,
+            'obuf' : obuf,
+            'cycle' : cycle,
+            'count' : count,
+            'frame_word' : frame_word.astype(np.uint8)
+        }
+
+    def run(self, n_cycles, idata, slip=None):
+        """
+        Fast forward the model n_cycles cycles on packed 32-bit input words (one per cycle) and an
+        optional array of slip inputs. Returns a dict of the packed data and header, data_valid
+        and header_valid of each cycle, as arrays - compare against the DUT as integers.
+        Runs in chunks of next_batch, so memory does not grow with n_cycles.
+        """
+        idata = np.asarray(idata, dtype=np.uint32)[:n_cycles]
+        slip = np.zeros(len(idata), dtype=bool) if slip is None else np.asarray(slip, dtype=bool)[:n_cycles]
+
+        keys = ['data', 'header', 'data_valid', 'header_valid']
+        chunks = {key : [] for key in keys}
+        for start in range(0, len(idata), RUN_CHUNK_CYCLES):
+            ret = self.next_batch(idata[start : start + RUN_CHUNK_CYCLES], slip[start : start + RUN_CHUNK_CYCLES])
+            for key in keys:
+                chunks[key].append(ret[key])
+
+        return {key : np.concatenate(chunks[key]) for key in keys}
+
+    def stream(self, batches, debug=False):
+        """
+        Generator - run the model on batches of packed 32-bit input words (one per cycle), or
+        (words, slip) tuples. Yields a dict of arrays per batch with the data, header, data_valid,
+        header_valid and frame_word of each cycle. With debug, the full next_batch output
+        (including obuf) of each batch is also appended to self.trace.
+        """
+        for batch in batches:
+            words, slip = batch if isinstance(batch, tuple) else (batch, None)
+            ret = self.next_batch(np.asarray(words, dtype=np.uint32), slip)
+            if debug:
+                self.trace.append(ret)
+            yield {key : ret[key] for key in ['data', 'header', 'data_valid', 'header_valid', 'frame_word']}
 
     def get_state(self):
 
@@ -89,27 +433,33 @@ class RxGearboxModel:
 
 class TxGearboxModel:
     def __init__(self, type='int'):
+        self.type = type
         if type == 'str':
             self.obuf = ['XXX' for _ in range(66)]
+        elif type == 'packed':
+            self.obuf = 0 # 66-bit buffer as an integer, data and header I/O as integers
         else:
             self.obuf = [0 for _ in range(66)]
         self.cycle = 0
         self.half_slip = 0
-        self.count = int(self.cycle % 33)
-        self.pause = self.count == 32
-        
-
+        self.odata = None
+        self.trace = [] # next() output of each cycle, with stream debug
+        self._set_phase(0)
+
+    def _set_phase(self, count):
+        # The phase attributes (count, pause, ...) are those of the cycle last run by next(), as
+        # get_state() shows, the get_* methods give the phase of the next cycle
+        phase = TX_PHASE_TABLE[count]
+        self.count = count
+        self.pause = phase['pause']
+        self.frame_word = phase['frame_word']
+        self.load_header = phase['load_header']
+        self.header_idx = phase['header_idx']
+        self.data_idx = phase['data_idx']
 
     def next(self, iheader, idata):
 
-        self.count = int(self.cycle % 33)
-        self.pause = self.count == 32
-        self.frame_word = int(self.count % 2 == 1)
-        self.load_header = int(self.count % 2 == 0)
-        self.header_idx = self.count if self.load_header else -1
-        self.data_idx = self.count + 2 if self.load_header else self.count + 1
-
-
+        self._set_phase(self.cycle % TX_SEQ_LENGTH)
         
         # obuf[0:32] = obuf[32:64]
         # if not self.pause:
@@ -119,6 +469,9 @@ class TxGearboxModel:
 
         # odata.append(obuf[0:32])
 
+        if self.type == 'packed':
+            return self._next_packed(iheader, idata)
+
         # bit select method
         for bit in range(len(self.obuf)):
             if bit < 32:
@@ -136,26 +489,171 @@ class TxGearboxModel:
 
         self.cycle = self.cycle + 1
 
-        return {
+        ret = {
+            'data' : self.odata,
+            'pause' : self.pause,
+            'obuf' : self.obuf,
+            'cycle' : self.cycle
+        }
+
+        return ret
+
+    def _next_packed(self, iheader, idata):
+
+        # shift/mask method
+        obuf = (self.obuf & ~MASK_32) | ((self.obuf >> 32) & MASK_32)
+
+        if not self.pause:
+            if self.load_header:
+                obuf = (obuf & ~(0x3 << self.header_idx)) | ((iheader & 0x3) << self.header_idx)
+
+            obuf = (obuf & ~(MASK_32 << self.data_idx)) | ((idata & MASK_32) << self.data_idx)
+
+        self.obuf = obuf & MASK_66
+        self.odata = self.obuf & MASK_32
+
+        self.cycle = self.cycle + 1
+
+        ret = {
             'data' : self.odata,
             'pause' : self.pause,
             'obuf' : self.obuf,
             'cycle' : self.cycle
         }
+
+        return ret
        
+    def run(self, n_cycles, iheader, idata):
+        """
+        Fast forward the model n_cycles cycles on arrays of the 2-bit header and packed 32-bit data
+        inputs of each cycle, as driven to the DUT (pause cycles included). Returns an array of the
+        packed output word of each cycle, the same as n_cycles calls to next().
+        """
+        iheader = np.asarray(iheader, dtype=np.uint64)[:n_cycles]
+        idata = np.asarray(idata, dtype=np.uint64)[:n_cycles]
+        if self.type == 'str':
+            raise ValueError('run requires an integer model buffer')
+
+        odata = [self._run_chunk(iheader[start : start + RUN_CHUNK_CYCLES], idata[start : start + RUN_CHUNK_CYCLES])
+                    for start in range(0, len(idata), RUN_CHUNK_CYCLES)]
+        return np.concatenate(odata) if odata else np.zeros(0, dtype=np.uint32)
+
+    def _run_chunk(self, iheader, idata):
+        n = len(idata)
+        ibits = unpack_words((iheader & _U64(0x3)) | (idata << _U64(2)), TX_INPUT_WIDTH)
+        load_src = TX_LOAD_TABLE[(self.cycle + np.arange(n)) % TX_SEQ_LENGTH]
+
+        if self.type == 'packed':
+            obuf_init = unpack_words([self.obuf], 66)[0]
+        else:
+            obuf_init = np.array(self.obuf, dtype=np.uint8)
+
+        # Upper 34 bits hold until loaded - the last cycle at or before each cycle that loaded each bit
+        upper_src = load_src[:, 32:]
+        last_load = np.maximum.accumulate(np.where(upper_src >= 0, np.arange(n)[:, None], -1), axis=0)
+        last_load_c = np.maximum(last_load, 0)
+        src_bit = np.maximum(upper_src[last_load_c, np.arange(34)], 0)
+        upper = np.where(last_load >= 0, ibits[last_load_c, src_bit], obuf_init[None, 32:])
+
+        # Lower 32 bits are loaded or shifted down from the upper bits of the previous cycle
+        prev_upper = np.concatenate((obuf_init[None, 32:64], upper[:-1, :32]))
+        lower_src = load_src[:, :32]
+        lower = np.where(lower_src >= 0, ibits[np.arange(n)[:, None], np.maximum(lower_src, 0)], prev_upper)
+
+        # Save the final state
+        obuf = np.concatenate((lower[-1], upper[-1]))
+        if self.type == 'packed':
+            self.obuf = sum(int(x) << i for i, x in enumerate(obuf))
+            self.odata = self.obuf & MASK_32
+        else:
+            self.obuf = [int(x) for x in obuf]
+            self.odata = self.obuf[:32]
+        self.cycle += n
+        self._set_phase((self.cycle - 1) % TX_SEQ_LENGTH)
+
+        return pack_words(lower).astype(np.uint32)
+
+    def stream(self, batches, debug=False):
+        """
+        Generator - serialise batches of (header, data) block arrays, yields arrays of the 32-bit
+        output word of each cycle, including pause cycles. Blocks are carried into the next batch
+        until a whole 16 block sequence is available, so the model must start at count 0.
+
+        By default whole sequences are converted with blocks_to_words. With debug the cycle model
+        is run instead and each cycle's next() output, with a copy of obuf, appended to self.trace.
+        """
+        carry = (np.zeros(0, dtype=np.uint8), np.zeros(0, dtype=np.uint64))
+        for header, data in batches:
+            header = np.concatenate([carry[0], np.asarray(header, dtype=np.uint8)])
+            data = np.concatenate([carry[1], np.asarray(data, dtype=np.uint64)])
+            n = len(data) // TX_BLOCKS_PER_SEQ * TX_BLOCKS_PER_SEQ
+            carry = (header[n:], data[n:])
+
+            if not debug:
+                if n:
+                    self.cycle += TX_SEQ_LENGTH * n // TX_BLOCKS_PER_SEQ
+                    self._set_phase((self.cycle - 1) % TX_SEQ_LENGTH)
+                yield blocks_to_words(header[:n], data[:n])
+                continue
+
+            words = []
+            for iheader, idata in zip(header[:n].tolist(), data[:n].tolist()):
+                for frame_word in range(2):
+                    words.append(self._debug_next(iheader, (idata >> (32 * frame_word)) & MASK_32))
+                    if self.get_pause():
+                        words.append(self._debug_next(0, 0))
+            yield np.array(words, dtype=np.uint32)
+
+    def _debug_next(self, iheader, idata):
+        if self.type == 'packed':
+            ret = self.next(iheader, idata)
+        else:
+            ret = self.next(unpack_words([iheader], 2)[0].tolist(), unpack_words([idata])[0].tolist())
+            ret['data'] = int(pack_words([ret['data']])[0])
+        self.trace.append(dict(ret, obuf=ret['obuf'] if self.type == 'packed' else list(ret['obuf'])))
+        return ret['data']
+
     def get_frame_word(self):
-        self.count = int(self.cycle % 33)
-        self.frame_word = int(self.count % 2 == 1)
-        return self.frame_word
+        return self.phase(self.cycle)['frame_word']
 
     def get_pause(self):
-        self.count = int(self.cycle % 33)
-        self.pause = self.count == 32
-        return self.pause
+        return self.phase(self.cycle)['pause']
 
     def get_count(self):
-        self.count = int(self.cycle % 33)
-        return self.count
+        return self.phase(self.cycle)['count']
+
+    @staticmethod
+    def phase(cycle):
+        """Sequence phase (see TX_PHASE_TABLE) of any absolute cycle"""
+        return TX_PHASE_TABLE[cycle % TX_SEQ_LENGTH]
+
+    @staticmethod
+    def blocks_for_cycle(cycle):
+        """Range of input block indexes that make up the output word of any absolute cycle.
+
+        The output is the serialised stream of 66-bit blocks (header first), so the word
+        output on cycle c is stream bits [32c, 32c + 32).
+        """
+        first_bit = 32 * cycle
+        return range(first_bit // 66, (first_bit + 31) // 66 + 1)
+
+    @staticmethod
+    def word_at(cycle, blocks, first_block=0):
+        """Predict the 32-bit output word of any absolute cycle without replaying the sequence.
+
+        blocks is a window of (header, data) integer pairs starting at block index first_block,
+        which must cover blocks_for_cycle(cycle). Returns the word as an integer, bit 0 first.
+        """
+        block_idxs = TxGearboxModel.blocks_for_cycle(cycle)
+        if block_idxs.start < first_block or block_idxs.stop > first_block + len(blocks):
+            raise ValueError(f'Blocks {block_idxs.start}-{block_idxs.stop - 1} required for cycle {cycle}')
+
+        stream = 0
+        for i, block_idx in enumerate(block_idxs):
+            header, data = blocks[block_idx - first_block]
+            stream |= ((int(header) & 0x3) | ((int(data) & ((1 << 64) - 1)) << 2)) << (66 * i)
+
+        return (stream >> (32 * cycle - 66 * block_idxs.start)) & MASK_32
 
     def get_state(self):
 
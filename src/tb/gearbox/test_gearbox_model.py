@@ -0,0 +1,229 @@
+import numpy as np
+import pytest
+
+from gearbox_model import RxGearboxModel, TxGearboxModel, TX_SEQ_LENGTH, TX_BLOCKS_PER_SEQ, MASK_32, \
+                            unpack_words, pack_words
+
+# Checks of the gearbox models themselves, without a simulator
+
+
+@pytest.mark.parametrize("type", ['int', 'packed'])
+@pytest.mark.parametrize("packed_input", [True, False])
+def test_rx_next_batch_empty(type, packed_input):
+    rng = np.random.default_rng(0)
+    model = RxGearboxModel(type)
+    words = rng.integers(0, 1 << 32, 50, dtype=np.uint64).astype(np.uint32)
+    model.next_batch(words)
+    state = (model.cycle, model.half_slip, model.obuf)
+
+    empty = np.zeros(0, dtype=np.uint32) if packed_input else np.zeros((0, 32), dtype=np.uint8)
+    ret = model.next_batch(empty)
+    assert all(len(value) == 0 for value in ret.values())
+    assert ret['data'].shape == ((0,) if packed_input else (0, 32))
+    assert (model.cycle, model.half_slip, model.obuf) == state
+
+    # Carries on as if the empty batch never happened
+    reference = RxGearboxModel(type)
+    more = rng.integers(0, 1 << 32, 40, dtype=np.uint64).astype(np.uint32)
+    reference.next_batch(words)
+    assert np.array_equal(model.next_batch(more)['data'], reference.next_batch(more)['data'])
+
+
+RX_STATE = ['cycle', 'half_slip', 'count', 'valid', 'frame_word', 'output_header', 'slip', 'idata_idx']
+
+
+def rx_state(model):
+    state = {key : getattr(model, key) for key in RX_STATE}
+    to_int = lambda value: value if model.type == 'packed' else int(pack_words([value])[0])
+    return {**state, 'obuf' : to_int(model.obuf), 'odata' : to_int(model.odata), 'oheader' : to_int(model.oheader)}
+
+
+@pytest.mark.parametrize("type", ['int', 'packed'])
+@pytest.mark.parametrize("packed_input", [True, False])
+@pytest.mark.parametrize("batch_size", [1, 7, 33, 50, 200])
+def test_rx_next_batch_equals_next(type, packed_input, batch_size):
+    # A block stream, so headers are valid once aligned, with a slip every few cycles
+    rng = np.random.default_rng(batch_size)
+    n_cycles = 5 * TX_SEQ_LENGTH + 3
+    words = TxGearboxModel('packed').run(n_cycles, *tx_inputs(*random_blocks(rng, 6 * TX_BLOCKS_PER_SEQ)))
+    slip = rng.random(n_cycles) < 0.05
+
+    reference = RxGearboxModel(type)
+    model = RxGearboxModel(type)
+    for start in range(0, n_cycles, batch_size):
+        batch = words[start : start + batch_size]
+        ret = model.next_batch(batch if packed_input else unpack_words(batch), slip[start : start + batch_size])
+
+        for i, word in enumerate(batch.tolist()):
+            expected = reference.next(word if type == 'packed' else unpack_words([word])[0].tolist(), bool(slip[start + i]))
+            data, header = ret['data'][i], ret['header'][i]
+            if not packed_input:
+                data, header = pack_words([data])[0], pack_words([header])[0]
+            if type != 'packed':
+                expected['data'], expected['header'] = pack_words([expected['data']])[0], pack_words([expected['header']])[0]
+            assert (int(data), int(header)) == (int(expected['data']), int(expected['header']))
+            assert (bool(ret['data_valid'][i]), bool(ret['header_valid'][i]), int(ret['frame_word'][i])) == \
+                    (bool(expected['data_valid']), bool(expected['header_valid']), int(expected['frame_word']))
+            assert (int(ret['cycle'][i]), int(ret['count'][i])) == (expected['cycle'], expected['count'])
+
+        assert rx_state(model) == rx_state(reference)
+
+
+@pytest.mark.parametrize("type", ['int', 'packed'])
+def test_rx_run_equals_next(type):
+    rng = np.random.default_rng(4)
+    n_cycles = 3 * TX_SEQ_LENGTH
+    words = rng.integers(0, 1 << 32, n_cycles, dtype=np.uint64).astype(np.uint32)
+    slip = rng.random(n_cycles) < 0.1
+
+    model = RxGearboxModel(type)
+    ret = model.run(n_cycles, words, slip)
+    reference = RxGearboxModel('packed')
+    expected = [reference.next(word, bool(s)) for word, s in zip(words.tolist(), slip)]
+    assert ret['data'].tolist() == [e['data'] for e in expected]
+    assert ret['header'].tolist() == [e['header'] for e in expected]
+    assert ret['data_valid'].tolist() == [bool(e['data_valid']) for e in expected]
+    assert ret['header_valid'].tolist() == [bool(e['header_valid']) for e in expected]
+    assert (model.cycle, model.half_slip) == (reference.cycle, reference.half_slip)
+
+
+def tx_inputs(header, data):
+    """Per cycle header and data inputs of the TX gearbox for whole sequences of blocks, zeros on
+    the pause cycles"""
+    n_cycles = len(data) // TX_BLOCKS_PER_SEQ * TX_SEQ_LENGTH
+    cycle = np.arange(n_cycles)
+    count = cycle % TX_SEQ_LENGTH
+    block = cycle // TX_SEQ_LENGTH * TX_BLOCKS_PER_SEQ + np.minimum(count // 2, TX_BLOCKS_PER_SEQ - 1)
+    pause = count == TX_SEQ_LENGTH - 1
+
+    iheader = np.where(pause, 0, header[block]).astype(np.uint64)
+    idata = np.where(pause, 0, (data[block] >> (np.uint64(32) * (count % 2).astype(np.uint64))) & np.uint64(MASK_32))
+    return iheader, idata
+
+
+def random_blocks(rng, n_blocks):
+    return rng.integers(1, 3, n_blocks).astype(np.uint8), rng.integers(0, 1 << 64, n_blocks, dtype=np.uint64)
+
+
+@pytest.mark.parametrize("type", ['int', 'packed'])
+def test_tx_word_at(type):
+    rng = np.random.default_rng(1)
+    n_seqs = 7
+    header, data = random_blocks(rng, n_seqs * TX_BLOCKS_PER_SEQ)
+    blocks = list(zip(header.tolist(), data.tolist()))
+
+    model = TxGearboxModel(type)
+    words = model.run(n_seqs * TX_SEQ_LENGTH, *tx_inputs(header, data))
+    assert model.count == TxGearboxModel.phase(model.cycle - 1)['count']
+
+    for cycle, word in enumerate(words.tolist()):
+        assert TxGearboxModel.word_at(cycle, blocks) == word
+
+        # Just the blocks needed, from a nonzero first block
+        block_idxs = TxGearboxModel.blocks_for_cycle(cycle)
+        window = blocks[block_idxs.start : block_idxs.stop]
+        assert TxGearboxModel.word_at(cycle, window, block_idxs.start) == word
+        assert TxGearboxModel.phase(cycle)['pause'] == (cycle % TX_SEQ_LENGTH == TX_SEQ_LENGTH - 1)
+
+
+def tx_next(type, iheader, idata):
+    """Per-cycle next() reference - the output words and pause flags, and the model"""
+    model = TxGearboxModel(type)
+    words, pauses = [], []
+    for header, data in zip(iheader.tolist(), idata.tolist()):
+        if type == 'packed':
+            ret = model.next(header, data)
+        else:
+            ret = model.next(unpack_words([header], 2)[0].tolist(), unpack_words([data])[0].tolist())
+            ret['data'] = int(pack_words([ret['data']])[0])
+        words.append(ret['data'])
+        pauses.append(ret['pause'])
+    return words, pauses, model
+
+
+def tx_state(model):
+    obuf = model.obuf if model.type == 'packed' else int(pack_words([model.obuf])[0])
+    return (model.cycle, obuf, model.count, model.pause, model.frame_word, model.load_header)
+
+
+@pytest.mark.parametrize("type", ['int', 'packed'])
+@pytest.mark.parametrize("batch_size", [1, 7, 33, 50, 200])
+def test_tx_run_equals_next(type, batch_size):
+    rng = np.random.default_rng(batch_size)
+    iheader, idata = tx_inputs(*random_blocks(rng, 8 * TX_BLOCKS_PER_SEQ))
+    n_cycles = len(idata) - 5 # ends mid sequence
+
+    model = TxGearboxModel(type)
+    for start in range(0, n_cycles, batch_size):
+        stop = min(start + batch_size, n_cycles)
+        words = model.run(stop - start, iheader[start:stop], idata[start:stop])
+        expected, pauses, reference = tx_next(type, iheader[:stop], idata[:stop])
+        assert words.tolist() == expected[start:]
+        assert pauses[start:] == [TxGearboxModel.phase(cycle)['pause'] for cycle in range(start, stop)]
+        assert tx_state(model) == tx_state(reference)
+
+
+@pytest.mark.parametrize("debug", [False, True])
+@pytest.mark.parametrize("batch_size", [1, 7, 16, 40])
+def test_tx_stream_equals_next(debug, batch_size):
+    rng = np.random.default_rng(batch_size)
+    header, data = random_blocks(rng, 5 * TX_BLOCKS_PER_SEQ)
+    expected, pauses, reference = tx_next('packed', *tx_inputs(header, data))
+
+    # Blocks are held until a whole sequence is available, so words come out in whole sequences
+    model = TxGearboxModel('packed')
+    batches = [(header[i : i + batch_size], data[i : i + batch_size]) for i in range(0, len(data), batch_size)]
+    words = [word for batch_words in model.stream(batches, debug) for word in batch_words.tolist()]
+    assert words == expected
+    assert (model.cycle, model.count, model.pause) == (reference.cycle, reference.count, reference.pause)
+    if debug:
+        assert [ret['pause'] for ret in model.trace] == pauses
+        assert model.obuf == reference.obuf
+
+
+@pytest.mark.parametrize("type", ['int', 'packed'])
+def test_tx_state_after_next(type):
+    # After next(), the phase attributes and get_state() are those of the cycle just run, and the
+    # get_* methods give the next cycle's - as driven to the DUT before the next call
+    model = TxGearboxModel(type)
+    iheader, idata = (0, 0) if type == 'packed' else ([0] * 2, [0] * 32)
+    for cycle in range(2 * TX_SEQ_LENGTH + 5):
+        assert model.get_count() == cycle % TX_SEQ_LENGTH
+        assert model.get_pause() == (cycle % TX_SEQ_LENGTH == TX_SEQ_LENGTH - 1)
+        assert model.get_frame_word() == cycle % TX_SEQ_LENGTH % 2
+        ret = model.next(iheader, idata)
+
+        phase = TxGearboxModel.phase(cycle)
+        assert ret['pause'] == phase['pause']
+        assert (model.count, model.pause, model.frame_word) == (phase['count'], phase['pause'], phase['frame_word'])
+        assert model.get_state().split('\t')[:2] == [f"{phase['count']:03d}", str(phase['pause'])]
+
+
+def test_tx_word_at_large_cycle():
+    # The same 16 blocks every sequence give the same 33 words every sequence, so run() over a few
+    # sequences predicts any cycle
+    rng = np.random.default_rng(2)
+    header, data = random_blocks(rng, TX_BLOCKS_PER_SEQ)
+    words = TxGearboxModel('packed').run(3 * TX_SEQ_LENGTH, *tx_inputs(np.tile(header, 3), np.tile(data, 3)))
+
+    for cycle in rng.integers(10**6, 10**12, 200).tolist() + [2**40 * TX_SEQ_LENGTH - 1]:
+        block_idxs = TxGearboxModel.blocks_for_cycle(cycle)
+        window = [(int(header[i % TX_BLOCKS_PER_SEQ]), int(data[i % TX_BLOCKS_PER_SEQ])) for i in block_idxs]
+        assert TxGearboxModel.word_at(cycle, window, block_idxs.start) == \
+                words[TX_SEQ_LENGTH + cycle % TX_SEQ_LENGTH]
+
+
+def test_tx_word_at_missing_blocks():
+    rng = np.random.default_rng(3)
+    header, data = random_blocks(rng, 4)
+    blocks = list(zip(header.tolist(), data.tolist()))
+
+    cycle = 35 # stream bits 1120-1151, blocks 16 (1056-1121) and 17
+    assert list(TxGearboxModel.blocks_for_cycle(cycle)) == [16, 17]
+    with pytest.raises(ValueError):
+        TxGearboxModel.word_at(cycle, blocks) # blocks 0-3
+    with pytest.raises(ValueError):
+        TxGearboxModel.word_at(cycle, blocks, 17) # starts after block 16
+    with pytest.raises(ValueError):
+        TxGearboxModel.word_at(cycle, blocks[:1], 16) # ends before block 17
+    TxGearboxModel.word_at(cycle, blocks[:2], 16)
@@ -1,7 +1,9 @@
 import pytest
 import os
+import sys
 
-from cocotb_test.simulator import run
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from sim_run import run_cached
 
 @pytest.mark.parametrize(
     "parameters", [
@@ -9,16 +11,14 @@ from cocotb_test.simulator import run
         ])
 def test_rx_gearbox(parameters):
 
-    sim_build = "./sim_build/rx_gearbox"
+    sim_build = "./sim_build/rx_gearbox/" + ",".join((f"{key}={str(value)}" for key, value in parameters.items()))
     os.makedirs(sim_build, exist_ok=True)
 
-    run(
+    run_cached(
         verilog_sources=['../../hdl/pcs/rx_gearbox.sv'],
         toplevel="rx_gearbox",
 
         module="test_rx_gearbox",
-        simulator="icarus",
-        verilog_compile_args=["-g2012"],
         includes=["../hdl", "../../", "../../../"],
         parameters=parameters,
         extra_env=parameters,
@@ -31,16 +31,14 @@ def test_rx_gearbox(parameters):
         ])
 def test_tx_gearbox(parameters):
 
-    sim_build = "./sim_build/tx_gearbox"
+    sim_build = "./sim_build/tx_gearbox/" + ",".join((f"{key}={str(value)}" for key, value in parameters.items()))
     os.makedirs(sim_build, exist_ok=True)
 
-    run(
+    run_cached(
         verilog_sources=['../../hdl/pcs/tx_gearbox.sv'],
         toplevel="tx_gearbox",
 
         module="test_tx_gearbox",
-        simulator="icarus",
-        verilog_compile_args=["-g2012"],
         includes=["../hdl", "../../", "../../../"],
         parameters=parameters,
         extra_env=parameters,
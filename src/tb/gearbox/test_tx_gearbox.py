@@ -3,7 +3,7 @@ import asyncio
 import enum
 import cocotb
 import numpy as np
-from gearbox_model import TxGearboxModel
+from gearbox_model import TxGearboxModel, TX_SEQ_LENGTH, TX_BLOCKS_PER_SEQ
 
 from cocotb.triggers import Timer, RisingEdge, FallingEdge, Edge, NextTimeStep
 from cocotb.clock import Clock
@@ -42,71 +42,49 @@ async def tx_gearbox_test(dut):
    
     await tb.reset()
 
-    # Generate random data
+    # Generate random blocks
     np.random.seed(0)
-    gen_idata = [np.random.randint(0,2,64) for _ in range(200)]
-    gen_iheader = [np.random.randint(0,2,2) for _ in range(200)]
+    n_blocks = 2000
+    gen_iheader = np.random.randint(0, 4, n_blocks)
+    gen_idata = np.random.randint(0, 1 << 32, (n_blocks, 2), dtype=np.uint64)
 
     # gen_iheader = [[f'{y:02d}-H0{x}' for x in range(2)] for y in range(20)]
     # gen_idata = [[f'{y:02d}-D{x:02d}' for x in range(64)] for y in range(20)]
 
-    # Create ref model
-    model = TxGearboxModel('str')
-
-
-    async def run_cycle(iheader, idata):
-        
-        for i in range(len(iheader)):
-            tb.dut.i_header[i].value = int(iheader[i])
-
-        for i in range(len(idata)):
-            tb.dut.i_data[i].value = int(idata[i])
-
-        tb.dut.i_gearbox_seq.value = model.get_count()
-        tb.dut.i_pause.value = model.get_pause()
+    # Input of each cycle - the next word of each block, with the input held on the pause cycle
+    n_cycles = n_blocks // TX_BLOCKS_PER_SEQ * TX_SEQ_LENGTH
+    cycle = np.arange(n_cycles)
+    count = cycle % TX_SEQ_LENGTH
+    pause = count == TX_SEQ_LENGTH - 1
+    block = np.minimum(np.where(pause, cycle // TX_SEQ_LENGTH + 1, cycle // TX_SEQ_LENGTH) * TX_BLOCKS_PER_SEQ +
+                        np.where(pause, 0, count // 2), n_blocks - 1)
+    frame_word = np.where(pause, 0, count % 2)
+    iheader = gen_iheader[block]
+    idata = gen_idata[block, frame_word]
+
+    # Create ref model and run for all cycles
+    model = TxGearboxModel('packed')
+    expected = model.run(n_cycles, iheader, idata).tolist()
+
+    for c, (ih, id, seq, p) in enumerate(zip(iheader.tolist(), idata.tolist(), count.tolist(), pause.tolist())):
+        tb.dut.i_header.value = ih
+        tb.dut.i_data.value = id
+        tb.dut.i_gearbox_seq.value = seq
+        tb.dut.i_pause.value = p
 
         await FallingEdge(tb.dut.i_clk) # Give the sim a tick to update the comb outputs
-        
-        dut_odata = str(tb.dut.o_data.value)[::-1]
-        dut_obuf = str(tb.dut.next_obuf.value)[::-1]
 
-        await RisingEdge(tb.dut.i_clk)
-
-        ret = model.next(iheader, idata)
-
-        model_odata = ''.join([str(x) for x in ret['data']])
-        model_obuf = ''.join([str(x) for x in ret['obuf']])
+        dut_odata = tb.dut.o_data.value.integer
 
-        all_eq = model_odata == dut_odata
-
-        if not all_eq:
-            print('OK' if all_eq else 'FAIL')
-            print('seq: ', int(tb.dut.i_gearbox_seq.value))
-            print('pause: ', tb.dut.i_pause.value)
-            print('dut data:    ', dut_odata)
-            print('model data:  ', model_odata)
-            print('input data:  ', str(tb.dut.i_data.value)[::-1])
-            print('input header:  ', str(tb.dut.i_header.value)[::-1])
-        
-        assert all_eq
-
-        return ret
-
-
-
-    tb.dut.i_data.value = 0
-
-    for ih, id in zip(gen_iheader, gen_idata):
-        for _ in range(2):
-
-            idata = id[32:] if model.get_frame_word() else id[:32]
-            
-            ret = await run_cycle(ih, idata)
-
-            if (ret['pause']): # do another cycle with same data
-                ret = await run_cycle(ih, idata)
+        await RisingEdge(tb.dut.i_clk)
 
-   
+        if dut_odata != expected[c]:
+            print('FAIL cycle: ', c)
+            print('seq: ', seq)
+            print('pause: ', p)
+            print(f'dut data:     {dut_odata:032b}')
+            print(f'model data:   {expected[c]:032b}')
+            print(f'input data:   {id:032b}')
+            print(f'input header: {ih:02b}')
         
-
-  
\ No newline at end of file
+        assert dut_odata == expected[c]
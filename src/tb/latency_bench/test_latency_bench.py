@@ -0,0 +1,133 @@
+"""test_latency_bench.py
+
+    Latency regression benchmark for the mac_pcs loopback.
+
+    Frames of each length in LATENCY_PACKET_LENGTHS (as example/scripts/sweep_packet_latency.tcl)
+    are sent one at a time through the mac_pcs testbench, and the TX to RX latency in cycles is
+    measured by its scoreboard. The min and max latency per length are compared against
+    latency_baseline.json, and the test fails if any is more than its baseline.
+
+    A case without a baseline fails, before it is run, so the benchmark can't pass by checking
+    nothing. To record or update the baseline (e.g. for a new case, after an intended latency
+    change, or an improvement), run with LATENCY_BENCH_UPDATE=1 and commit latency_baseline.json.
+
+    CI only runs the benchmark once latency_baseline.json has baselines, so recording the first
+    ones, on a machine with a simulator, adds it to CI.
+
+"""
+
+import os
+import sys
+import json
+import pytest
+
+import cocotb
+from pyuvm import *
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../mac_pcs'))
+from mac_pcs_bfm import MacPcsBfm
+from test_mac_pcs import MacPcsTest, EthTxSeqItem, run_mac_pcs
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(BENCH_DIR, 'latency_baseline.json')
+
+LATENCY_PACKET_LENGTHS = [64, 128, 256, 512, 1024, 2048, 4096, 8192, 16364]
+LATENCY_REPEATS = 3 # frames of each length
+LATENCY_FRAME_GAP = 32 # idle cycles after each frame is received, before the next is sent
+
+class EthTxSeqLatency(uvm_sequence):
+    """Frames of each latency_packet_lengths, each sent once the previous has been received"""
+    async def body(self):
+        config = ConfigDB().get(None, "", 'run_config')
+        bfm = MacPcsBfm()
+        n_frames = 0
+        for length in config['latency_packet_lengths']:
+            for i in range(config['latency_repeats']):
+                seq_item = EthTxSeqItem(f'l{length}_{i}', length)
+                await self.start_item(seq_item)
+                await self.finish_item(seq_item)
+                n_frames += 1
+                await bfm.wait_rx_frames(n_frames)
+                await bfm.pause(config['latency_frame_gap'])
+
+class LatencyBenchTest(MacPcsTest):
+    def end_of_elaboration_phase(self):
+        self.test_latency = EthTxSeqLatency.create("test_latency")
+
+    async def run_phase(self):
+        self.raise_objection()
+        await self.test_latency.start(ConfigDB().get(None, "", "SEQR"))
+        self.drop_objection()
+
+
+@cocotb.test()
+async def run_LatencyBenchTest(pytestconfig):
+    await uvm_root().run_test(LatencyBenchTest)
+
+
+def load_baseline():
+    if not os.path.exists(BASELINE_FILE):
+        return {}
+    with open(BASELINE_FILE, 'r') as f:
+        return json.load(f)
+
+def save_baseline(baseline):
+    with open(BASELINE_FILE, 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+def compare_latency(case, summary, baseline):
+    """Regressions of a case's latency summary rows against its baseline, as a list of messages"""
+    regressions = []
+    for row in summary:
+        expected = baseline.get(str(row['packet_length']))
+        if expected is None:
+            regressions.append(f"{case}: no baseline for packet length {row['packet_length']}")
+            continue
+        for key in ['min', 'max']:
+            if row[key] > expected[key]:
+                regressions.append(f"{case}: packet length {row['packet_length']} {key} latency "
+                                    f"{row[key]} cycles, baseline {expected[key]}")
+    return regressions
+
+@pytest.mark.parametrize(
+    "parameters,config", [
+        ({"EXTERNAL_GEARBOX": "0", "SCRAMBLER_BYPASS": "0"}, {"loopback_bit_slip": 0}),
+        ({"EXTERNAL_GEARBOX": "0", "SCRAMBLER_BYPASS": "0"}, {"loopback_bit_slip": 3}),
+        ({"EXTERNAL_GEARBOX": "0", "SCRAMBLER_BYPASS": "0"}, {"loopback_bit_slip": 16}),
+        ({"EXTERNAL_GEARBOX": "0", "SCRAMBLER_BYPASS": "0"}, {"loopback_bit_slip": 47}),
+        ({"EXTERNAL_GEARBOX": "1", "SCRAMBLER_BYPASS": "0"}, {"loopback_bit_slip": 0}),
+        ])
+def test_latency_bench(parameters, config):
+    case = ",".join((f"{key}={str(value)}" for key, value in {**parameters, **config}.items()))
+    sim_build = os.path.join(BENCH_DIR, "sim_build", case)
+
+    update = os.getenv('LATENCY_BENCH_UPDATE', '0') == '1'
+    if not update and case not in load_baseline():
+        pytest.fail(f"No latency baseline for {case}, run with LATENCY_BENCH_UPDATE=1 to record one")
+
+    run_mac_pcs(parameters, {**config,
+                                "latency_packet_lengths": LATENCY_PACKET_LENGTHS,
+                                "latency_repeats": LATENCY_REPEATS,
+                                "latency_frame_gap": LATENCY_FRAME_GAP,
+                                "latency_report": "latency"},
+                sim_build=sim_build, module="test_latency_bench")
+
+    with open(os.path.join(sim_build, "latency.json"), 'r') as f:
+        summary = json.load(f)['summary']
+
+    baseline = load_baseline()
+    latency = {str(row['packet_length']) : {'min' : row['min'], 'max' : row['max']} for row in summary}
+
+    if update:
+        baseline[case] = latency
+        save_baseline(baseline)
+        return
+
+    for length, row in latency.items():
+        expected = baseline[case].get(length)
+        if expected is not None and (row['min'] < expected['min'] or row['max'] < expected['max']):
+            print(f"{case}: packet length {length} latency improved to {row}, baseline {expected}")
+
+    regressions = compare_latency(case, summary, baseline[case])
+    assert not regressions, "\n".join(regressions)
@@ -0,0 +1,124 @@
+import numpy as np
+
+# Ethernet CRC32/FCS reference model, slicing-by-8 as lib/slicing_crc
+#
+# Reflected CRC32 (polynomial 0x04c11db7), initial value 0xffffffff and inverted output, as the
+# tx_mac/rx_mac slicing_crc instances. Table k gives the CRC contribution of a byte followed
+# by k zero bytes, so 8 bytes are folded in with 8 table lookups.
+
+CRC32_POLY = 0xedb88320 # reflected
+CRC32_INIT = 0xffffffff
+SLICE_LENGTH = 8
+
+
+def make_crc_tables(n_tables=SLICE_LENGTH):
+    tables = np.zeros((n_tables, 256), dtype=np.uint32)
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ (CRC32_POLY if crc & 1 else 0)
+        tables[0, i] = crc
+    for k in range(1, n_tables):
+        prev = tables[k - 1]
+        tables[k] = (prev >> 8) ^ tables[0, prev & 0xff]
+    return tables
+
+
+def load_crc_tables(filename):
+    """Load a $readmemh table file (as the HDL crc_tables.mem), returns an N x 256 array"""
+    values = []
+    with open(filename, 'r') as f:
+        for line in f:
+            line = line.split('//')[0]
+            for token in line.split():
+                if token.startswith('@'):
+                    raise ValueError(f'{filename}: address markers are not supported')
+                values.append(int(token.replace('_', ''), 16))
+
+    if len(values) == 0 or len(values) % 256 != 0:
+        raise ValueError(f'{filename}: expected a multiple of 256 table entries, found {len(values)}')
+
+    return np.array(values, dtype=np.uint32).reshape(-1, 256)
+
+
+class CrcModel:
+    def __init__(self, tables=None):
+        self.tables = make_crc_tables() if tables is None else np.asarray(tables, dtype=np.uint32)
+
+        if len(self.tables) < SLICE_LENGTH:
+            raise ValueError(f'Slicing by {SLICE_LENGTH} needs {SLICE_LENGTH} tables, found {len(self.tables)}')
+
+    @classmethod
+    def from_mem_file(cls, filename, check=True):
+        """Create a model with the tables used by the HDL. With check, the file is cross checked
+        against generated tables and a ValueError raised on mismatch."""
+        tables = load_crc_tables(filename)
+
+        if check:
+            expected = make_crc_tables(len(tables))
+            for k, (table, expected_table) in enumerate(zip(tables, expected)):
+                bad_idxs = np.nonzero(table != expected_table)[0]
+                if len(bad_idxs):
+                    raise ValueError(f'{filename}: table {k} entry {bad_idxs[0]} is {table[bad_idxs[0]]:08x}, ' +
+                                        f'expected {expected_table[bad_idxs[0]]:08x}')
+
+        return cls(tables)
+
+    def crc32_batch(self, frames):
+        """CRC32 of a list of byte frames (bytes, bytearray or uint8 arrays), returns a uint32 array.
+
+        Frames are processed together, 8 bytes per step, with shorter frames masked off once complete.
+        """
+        frames = [np.frombuffer(frame, dtype=np.uint8) if isinstance(frame, (bytes, bytearray, memoryview))
+                    else np.asarray(frame, dtype=np.uint8) for frame in frames]
+        lengths = np.array([len(frame) for frame in frames], dtype=np.int64)
+        n_frames = len(frames)
+
+        if n_frames == 0:
+            return np.zeros(0, dtype=np.uint32)
+
+        n_chunks = -(-int(lengths.max()) // SLICE_LENGTH)
+        data = np.zeros((n_frames, n_chunks * SLICE_LENGTH), dtype=np.uint8)
+        for i, frame in enumerate(frames):
+            data[i, :len(frame)] = frame
+
+        tables = self.tables
+        crc = np.full(n_frames, CRC32_INIT, dtype=np.uint32)
+
+        # Whole 8 byte chunks
+        n_full_chunks = lengths // SLICE_LENGTH
+        for chunk in range(int(n_full_chunks.max())):
+            active = n_full_chunks > chunk
+            b = data[:, SLICE_LENGTH * chunk : SLICE_LENGTH * (chunk + 1)].astype(np.uint32)
+            lo = crc ^ (b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16) | (b[:, 3] << 24))
+            next_crc = tables[7, lo & 0xff] ^ tables[6, (lo >> 8) & 0xff] ^ \
+                        tables[5, (lo >> 16) & 0xff] ^ tables[4, lo >> 24] ^ \
+                        tables[3, b[:, 4]] ^ tables[2, b[:, 5]] ^ tables[1, b[:, 6]] ^ tables[0, b[:, 7]]
+            crc = np.where(active, next_crc, crc)
+
+        # Remaining bytes, one at a time
+        rows = np.arange(n_frames)
+        for i in range(SLICE_LENGTH - 1):
+            idxs = n_full_chunks * SLICE_LENGTH + i
+            active = idxs < lengths
+            b = data[rows, np.minimum(idxs, data.shape[1] - 1)].astype(np.uint32)
+            next_crc = (crc >> 8) ^ tables[0, (crc ^ b) & 0xff]
+            crc = np.where(active, next_crc, crc)
+
+        return crc ^ np.uint32(0xffffffff)
+
+    def crc32(self, frame):
+        return int(self.crc32_batch([frame])[0])
+
+    def fcs(self, frame):
+        """Ethernet FCS bytes of a frame, as transmitted"""
+        return self.crc32(frame).to_bytes(4, 'little')
+
+    def fcs_batch(self, frames):
+        """FCS of each frame as an N x 4 array of bytes, as transmitted"""
+        return self.crc32_batch(frames).astype('<u4').view(np.uint8).reshape(-1, 4)
+
+    def check_fcs(self, frame_with_fcs):
+        """True if the last 4 bytes of a frame are its FCS"""
+        frame_with_fcs = bytes(frame_with_fcs)
+        return len(frame_with_fcs) >= 4 and self.fcs(frame_with_fcs[:-4]) == frame_with_fcs[-4:]
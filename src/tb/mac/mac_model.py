@@ -0,0 +1,156 @@
+import os
+import sys
+import bisect
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../pcs'))
+
+from code_defs import *
+from crc_model import CrcModel
+
+# TX/RX MAC reference models on the 32-bit XGMII interface, mirror tx_mac.sv and rx_mac.sv
+#
+# Words are (ctl, data) arrays as code_defs - ctl a 4-bit lane mask, data the 32-bit word with
+#   the first byte in the lowest lane. Models work on whole streams, not clock cycles: the TX
+#   model gives the words for each tready cycle of back-to-back frames.
+
+MIN_FRAME_SIZE = 60
+PREAMBLE = bytes([RS_START] + [MAC_PRE] * 6 + [MAC_SFD])
+TERM_WINDOW = 16 # Bytes from the start of the last data word to the end of the term idles
+
+
+def bytes_to_words(data_bytes, ctl_bytes):
+    """Pack byte and per-byte ctl flag buffers (a multiple of 4 long) into XGMII word arrays"""
+    data = np.frombuffer(data_bytes, dtype='<u4').astype(np.uint64)
+    ctl = np.frombuffer(ctl_bytes, dtype=np.uint8).reshape(-1, 4)
+    return (ctl[:, 0] | (ctl[:, 1] << 1) | (ctl[:, 2] << 2) | (ctl[:, 3] << 3)).astype(np.uint8), data
+
+
+class TxMacModel:
+    def __init__(self, crc_model=None):
+        self.crc_model = CrcModel() if crc_model is None else crc_model
+
+    @staticmethod
+    def n_words(frame_len):
+        """Words taken by a frame of frame_len bytes, from start to the end of the IPG"""
+        frame_len = max(frame_len, MIN_FRAME_SIZE)
+        last_bytes = (frame_len - 1) % 4 + 1
+        ipg_words = 3 if last_bytes == 4 else 2
+        return (len(PREAMBLE) + frame_len - last_bytes + TERM_WINDOW) // 4 + ipg_words
+
+    def next(self, frames, gap=0):
+        """XGMII (ctl, data) word arrays for frames sent back to back, with gap extra idle words after each"""
+        padded = [bytes(frame) + bytes(max(0, MIN_FRAME_SIZE - len(frame))) for frame in frames]
+        fcs = self.crc_model.fcs_batch(padded)
+
+        # Lay out every frame in one byte buffer, initially all idle
+        lengths = np.array([len(frame) for frame in padded], dtype=np.int64)
+        last_bytes = (lengths - 1) % 4 + 1
+        n_bytes = len(PREAMBLE) + lengths - last_bytes + TERM_WINDOW + 4 * (np.where(last_bytes == 4, 3, 2) + gap)
+        starts = np.cumsum(n_bytes) - n_bytes
+        data_bytes = np.full(int(n_bytes.sum()), RS_IDLE, dtype=np.uint8)
+        ctl_bytes = np.ones(len(data_bytes), dtype=np.uint8)
+
+        # Preamble, then frame bytes and FCS - data lanes
+        for i, b in enumerate(PREAMBLE):
+            data_bytes[starts + i] = b
+        payload_starts = starts + len(PREAMBLE)
+        payload_idxs = np.repeat(payload_starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())
+        data_bytes[payload_idxs] = np.frombuffer(b''.join(padded), dtype=np.uint8)
+        ctl_bytes[payload_idxs] = 0
+        fcs_starts = payload_starts + lengths
+        for i in range(4):
+            data_bytes[fcs_starts + i] = fcs[:, i]
+            ctl_bytes[fcs_starts + i] = 0
+        for i in range(1, len(PREAMBLE)):
+            ctl_bytes[starts + i] = 0
+        data_bytes[fcs_starts + 4] = RS_TERM
+
+        return bytes_to_words(data_bytes.tobytes(), ctl_bytes.tobytes())
+
+    def idle(self, n_words):
+        return np.full(n_words, 0xf, dtype=np.uint8), np.full(n_words, int.from_bytes(bytes([RS_IDLE] * 4), 'little'),
+                                                                dtype=np.uint64)
+
+
+class RxMacModel:
+    """Streaming RX MAC, state is kept between calls to next()
+
+    Received frames are dicts of tdata (bytes, including the FCS) and tuser (CRC match), as seen by
+    an AXI stream sink: a word dropped on an RS_ERROR has no tlast, so its frame runs into the next.
+    """
+    def __init__(self, crc_model=None):
+        self.crc_model = CrcModel() if crc_model is None else crc_model
+        self.reset()
+
+    def reset(self):
+        self.in_frame = False
+        self.sfd_word = False
+        self.frame_bytes = bytearray() # Since start, for the CRC
+        self.sink_bytes = bytearray() # Since the last tlast
+
+    def next(self, ctl, data):
+        ctl = np.asarray(ctl, dtype=np.uint8)
+        data = np.asarray(data, dtype=np.uint64)
+        word_bytes = data.astype('<u4').tobytes()
+
+        start_idxs = np.flatnonzero((ctl == 0x1) & (data == np.uint64(0x555555fb))).tolist()
+        ctl_idxs = np.flatnonzero(ctl).tolist()
+
+        frames, crc_frames = [], [] # CRCs are checked together at the end
+        pos, n = 0, len(data)
+        while pos < n:
+            if not self.in_frame:
+                i = bisect.bisect_left(start_idxs, pos)
+                if i == len(start_idxs):
+                    break
+                self.in_frame, self.sfd_word = True, True
+                pos = start_idxs[i] + 1
+                continue
+
+            i = bisect.bisect_left(ctl_idxs, pos)
+            end = ctl_idxs[i] if i < len(ctl_idxs) else n
+
+            # The SFD word has no valid lanes
+            first = pos + 1 if self.sfd_word and end > pos else pos
+            self.sfd_word = self.sfd_word and end == pos
+            self._append(word_bytes[4 * first : 4 * end])
+
+            if end == n:
+                break
+
+            self.in_frame = False
+            pos = end + 1
+            if self.sfd_word:
+                self.sfd_word = False
+                continue
+
+            lane_bytes = word_bytes[4 * end : 4 * end + 4]
+            lanes = [lane for lane in range(4) if (ctl[end] >> lane) & 1]
+            term_lanes = [lane for lane in lanes if lane_bytes[lane] == RS_TERM]
+            if any(lane_bytes[lane] == RS_ERROR for lane in lanes):
+                self.frame_bytes = bytearray()
+            elif term_lanes:
+                self._append(lane_bytes[:term_lanes[-1]])
+                crc_frames.append((len(frames), bytes(self.frame_bytes)))
+                frames.append(self._end_frame(False))
+            else:
+                self._append(lane_bytes)
+                frames.append(self._end_frame(False))
+
+        if crc_frames:
+            idxs, crc_frames = zip(*crc_frames)
+            fcs = self.crc_model.fcs_batch([frame[:-4] for frame in crc_frames])
+            for i, frame, frame_fcs in zip(idxs, crc_frames, fcs):
+                frames[i]['tuser'] = len(frame) >= 4 and frame[-4:] == frame_fcs.tobytes()
+
+        return frames
+
+    def _append(self, b):
+        self.frame_bytes += b
+        self.sink_bytes += b
+
+    def _end_frame(self, tuser):
+        frame = {'tdata' : bytes(self.sink_bytes), 'tuser' : tuser}
+        self.frame_bytes, self.sink_bytes = bytearray(), bytearray()
+        return frame
@@ -0,0 +1,166 @@
+import os
+import sys
+import json
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../pcs'))
+from code_defs import *
+
+# Functional coverage for the mac_pcs testbench
+#
+# Bins are preallocated numpy counters, sampled by the BFM monitors (MacPcsBfm.tx_monitor_bfm,
+#   coverage_monitor_bfm and slip_coverage_bfm):
+#   - frame length, per byte, of each TX frame, reported in SIZE_BINS
+#   - 64b/66b block type of each TX block (from the encoder, before the scrambler), by block type
+#     field, and data blocks. The terminate blocks /T0/ to /T7/ give the terminate position.
+#   - TX gearbox sequence phase (0-32) of the first word of each block, crossed with its block type
+#   - slip state, the RX gearbox slips (mod 66) taken to each block lock
+#
+# Coverage closes when every goal bin has been hit. The goals are the size bins within the frame
+#   lengths sent, the block types the MAC sends (idle, S0, T0-T7 and data), and a start of frame and
+#   each terminate block at every sequence phase a block can start on. Other bins are reported, but
+#   are not goals - e.g. S4 and the ordered sets, which the MAC doesn't send.
+#
+# A frame is an S0 block (with the preamble), then its data, padded to MIN_FRAME_SIZE, and FCS in
+#   data blocks and a terminate block (frame_blocks). So the terminate lane and phase follow from
+#   the frame length and start phase, which EthTxSeqCoverage uses to aim at holes.
+
+MAX_FRAME_LEN = 16384 # longer frames are counted in the last bin
+
+SIZE_BIN_EDGES = [0, 60, 64, 65, 128, 256, 512, 1024, 1519, MAX_FRAME_LEN + 1]
+SIZE_BIN_NAMES = ['0-59', '60-63', '64', '65-127', '128-255', '256-511', '512-1023', '1024-1518', '1519+']
+
+BLOCK_TYPE_NAMES = {BT_IDLE : 'IDLE', BT_O4 : 'O4', BT_S4 : 'S4', BT_O0S4 : 'O0S4', BT_O0O4 : 'O0O4',
+                    BT_S0 : 'S0', BT_O0 : 'O0', **{bt : f'T{i}' for i, bt in enumerate(BT_TERM)}}
+GOAL_BLOCK_TYPES = [BT_IDLE, BT_S0] + BT_TERM
+
+N_PHASES = 33
+N_SLIP_STATES = 66
+
+MIN_FRAME_SIZE = 60 # excluding FCS
+FCS_SIZE = 4
+
+
+def block_phases(external_gearbox):
+    """Sequence phases a block can start on - every other phase with the internal gearbox (one
+    block per two words), every phase but the pause with the external gearbox (one block per phase)"""
+    if external_gearbox:
+        return list(range(N_PHASES - 1))
+    return list(range(0, N_PHASES - 1, 2))
+
+
+def blocks_per_sequence(external_gearbox):
+    return len(block_phases(external_gearbox))
+
+
+def frame_blocks(frame_len):
+    """(blocks from the S0 block to the terminate block, terminate lane) of a frame"""
+    wire_len = max(frame_len, MIN_FRAME_SIZE) + FCS_SIZE
+    return wire_len // 8 + 1, wire_len % 8
+
+
+def length_for_terminate(lane, block_offset, min_frame_len, max_frame_len, n_blocks):
+    """Shortest frame length in range with its terminate block on lane, block_offset blocks (mod
+    n_blocks) after its S0 block, or None if there isn't one"""
+    for frame_len in range(max(min_frame_len, MIN_FRAME_SIZE), max_frame_len + 1):
+        blocks, term_lane = frame_blocks(frame_len)
+        if term_lane == lane and blocks % n_blocks == block_offset % n_blocks:
+            return frame_len
+    return None
+
+
+class FunctionalCoverage:
+    def __init__(self, min_frame_len, max_frame_len, external_gearbox):
+        self.min_frame_len = min_frame_len
+        self.max_frame_len = max_frame_len
+        self.external_gearbox = external_gearbox
+
+        self.frame_lengths = np.zeros(MAX_FRAME_LEN + 1, dtype=np.int64)
+        self.block_types = np.zeros((256, N_PHASES), dtype=np.int64) # control blocks, type x phase
+        self.data_blocks = np.zeros(N_PHASES, dtype=np.int64) # by phase
+        self.slip_states = np.zeros(N_SLIP_STATES, dtype=np.int64)
+        self.last_sof_phase = None
+
+    def sample_frame(self, frame_len):
+        self.frame_lengths[min(frame_len, MAX_FRAME_LEN)] += 1
+
+    def sample_block(self, header, block_type, phase):
+        """A block from its header, first data byte and the sequence phase of its first word"""
+        if header == SYNC_CTL:
+            self.block_types[block_type, phase] += 1
+            if block_type == BT_S0:
+                self.last_sof_phase = phase
+        else:
+            self.data_blocks[phase] += 1
+
+    def sample_slip_state(self, n_slips):
+        self.slip_states[n_slips % N_SLIP_STATES] += 1
+
+    def size_bins(self):
+        return np.add.reduceat(self.frame_lengths, SIZE_BIN_EDGES[:-1])
+
+    def goal_size_bins(self):
+        """Indexes of the size bins that overlap the frame lengths sent"""
+        return [i for i in range(len(SIZE_BIN_NAMES))
+                if SIZE_BIN_EDGES[i] <= self.max_frame_len and SIZE_BIN_EDGES[i + 1] > self.min_frame_len]
+
+    def goals(self):
+        """{goal group : (bins hit, [names of the bins not hit])}"""
+        size_bins = self.size_bins()
+        goal_sizes = self.goal_size_bins()
+        block_types = self.block_types.sum(axis=1)
+        phases = block_phases(self.external_gearbox)
+
+        type_holes = [BLOCK_TYPE_NAMES[bt] for bt in GOAL_BLOCK_TYPES if not block_types[bt]]
+        if not self.data_blocks.any():
+            type_holes.append('DATA')
+
+        return {
+            'frame_size' : (sum(1 for i in goal_sizes if size_bins[i]),
+                            [SIZE_BIN_NAMES[i] for i in goal_sizes if not size_bins[i]]),
+            'block_type' : (len(GOAL_BLOCK_TYPES) + 1 - len(type_holes), type_holes),
+            'sof_phase' : (int(np.count_nonzero(self.block_types[BT_S0, phases])),
+                           [f'S0@{phase}' for phase in phases if not self.block_types[BT_S0, phase]]),
+            'term_phase' : (int(np.count_nonzero(self.block_types[np.ix_(BT_TERM, phases)])),
+                            [f'T{lane}@{phase}' for lane, bt in enumerate(BT_TERM) for phase in phases
+                                if not self.block_types[bt, phase]])
+        }
+
+    def coverage(self):
+        """Fraction of goal bins hit"""
+        goals = self.goals().values()
+        hit = sum(n_hit for n_hit, _ in goals)
+        return hit / (hit + sum(len(holes) for _, holes in goals))
+
+    def closed(self):
+        return all(not holes for _, holes in self.goals().values())
+
+    def holes(self, group=None):
+        goals = self.goals()
+        return [hole for name in ([group] if group else goals) for hole in goals[name][1]]
+
+    def size_bin_lengths(self, name):
+        """Frame lengths in range in size bin name"""
+        i = SIZE_BIN_NAMES.index(name)
+        return range(max(SIZE_BIN_EDGES[i], self.min_frame_len), min(SIZE_BIN_EDGES[i + 1] - 1, self.max_frame_len) + 1)
+
+    def summary(self):
+        block_types = self.block_types.sum(axis=1)
+        return {
+            'coverage' : round(self.coverage(), 4),
+            'closed' : self.closed(),
+            'goals' : {group : {'hit' : n_hit, 'holes' : holes} for group, (n_hit, holes) in self.goals().items()},
+            'frame_size' : dict(zip(SIZE_BIN_NAMES, self.size_bins().tolist())),
+            'block_type' : {**{name : int(block_types[bt]) for bt, name in BLOCK_TYPE_NAMES.items()},
+                            'DATA' : int(self.data_blocks.sum()),
+                            'other' : int(block_types.sum() - sum(block_types[bt] for bt in BLOCK_TYPE_NAMES))},
+            'block_phase' : {**{name : self.block_types[bt].tolist() for bt, name in BLOCK_TYPE_NAMES.items()},
+                             'DATA' : self.data_blocks.tolist()},
+            'slip_state' : self.slip_states.tolist()
+        }
+
+    def to_json(self, filename):
+        with open(filename, 'w') as f:
+            json.dump({**self.summary(),
+                       'frame_lengths' : {str(n) : int(c) for n, c in enumerate(self.frame_lengths) if c}},
+                      f, indent=2)
@@ -0,0 +1,70 @@
+import csv
+import json
+import math
+
+# Loopback latency statistics, the simulation equivalent of example/hdl/eth_perf.sv and
+#   example/scripts/sweep_packet_latency.tcl
+#
+# Latency is from the first TX AXIS beat to the first RX AXIS beat of a frame. A histogram of latency
+#   in cycles is kept per frame length, so memory depends on the number of distinct lengths and
+#   latencies, not the number of frames. Reports have one row per frame length, as the ILA sweep.
+
+REPORT_FIELDS = ['packet_length', 'count', 'min', 'mean', 'p99', 'max', 'min_ns', 'mean_ns', 'p99_ns', 'max_ns']
+
+
+class LatencyStats:
+    def __init__(self, clk_period):
+        self.clk_period = clk_period # ns
+        self.histograms = {} # frame length -> {latency cycles : count}
+
+    def add(self, frame_len, latency_cycles):
+        histogram = self.histograms.setdefault(frame_len, {})
+        histogram[latency_cycles] = histogram.get(latency_cycles, 0) + 1
+
+    @staticmethod
+    def percentile(histogram, p):
+        """Smallest latency with at least p percent of frames at or below it"""
+        target = math.ceil(sum(histogram.values()) * p / 100)
+        total = 0
+        for latency in sorted(histogram):
+            total += histogram[latency]
+            if total >= target:
+                return latency
+
+    def _row(self, packet_length, histogram):
+        count = sum(histogram.values())
+        row = {'packet_length' : packet_length,
+               'count' : count,
+               'min' : min(histogram),
+               'mean' : round(sum(k * n for k, n in histogram.items()) / count, 2),
+               'p99' : self.percentile(histogram, 99),
+               'max' : max(histogram)}
+        for key in ['min', 'mean', 'p99', 'max']:
+            row[f'{key}_ns'] = round(row[key] * self.clk_period, 3)
+        return row
+
+    def summary(self):
+        """Rows of REPORT_FIELDS, latencies in cycles and ns, one per frame length"""
+        return [self._row(frame_len, self.histograms[frame_len]) for frame_len in sorted(self.histograms)]
+
+    def overall(self):
+        """REPORT_FIELDS over all frame lengths, None if there are no frames"""
+        combined = {}
+        for histogram in self.histograms.values():
+            for latency, n in histogram.items():
+                combined[latency] = combined.get(latency, 0) + n
+        return self._row('all', combined) if combined else None
+
+    def to_csv(self, filename):
+        with open(filename, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.summary())
+
+    def to_json(self, filename):
+        with open(filename, 'w') as f:
+            json.dump({'clk_period_ns' : self.clk_period,
+                       'summary' : self.summary(),
+                       'histograms' : {str(frame_len) : {str(k) : n for k, n in sorted(histogram.items())}
+                                        for frame_len, histogram in sorted(self.histograms.items())}},
+                      f, indent=2)
@@ -27,18 +27,30 @@
 
 """
 
+import os
+import sys
 import logging
 import debugpy
+import numpy as np
 
 import cocotb
 from cocotb.triggers import RisingEdge, FallingEdge, Edge
 from cocotb.queue import QueueEmpty, Queue
 from cocotb.clock import Clock
+from cocotb.utils import get_time_from_sim_steps
 
 from cocotbext.axi import (AxiStreamBus, AxiStreamSource, AxiStreamSink, AxiStreamMonitor)
 
 from pyuvm import *
 
+from throughput_stats import ThroughputStats
+from func_coverage import FunctionalCoverage
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../pcs'))
+from loopback import LoopbackChannel, drifting_clock
+from error_channel import ErrorChannel
+from lock_state_model import GOOD_64, SLIP
+
 class MacPcsBfm(metaclass=utility_classes.Singleton):
     def __init__(self):
         self.dut = cocotb.top
@@ -46,6 +58,24 @@ class MacPcsBfm(metaclass=utility_classes.Singleton):
         self.tx_driver_queue = Queue(maxsize=1)
         self.tx_monitor_queue = Queue(maxsize=0)
         self.rx_monitor_queue = Queue(maxsize=0)
+        self.n_tx_frames = 0
+        self.n_rx_frames = 0
+        self.throughput = None
+
+        self.data_width = len(self.dut.xgmii_tx_data)
+        self.data_nbytes = self.data_width // 8
+        self.gearbox_pause_val = 32
+        self.clk_period = round(1 / (10.3125 / self.data_width), 2) # ps precision
+        self.rx_clk_drift = bool(self.config['rx_clk_ppm'] or self.config['rx_clk_jitter'])
+        self.tx_gearbox_sequence = self.dut.o_xver_tx_gearbox_sequence if self.dut.EXTERNAL_GEARBOX.value else \
+                                    self.dut.u_pcs.l_tx_int_gearbox.int_tx_gearbox_seq
+        self.loopback_channel = None
+        self.error_channel = None
+        self.coverage = None
+        self.model_capture = None
+        self.n_lock_drops = 0
+        self.lock_recovery_cycles = [] # per lock drop, from the first slip to GOOD_64
+        self.lock_recovery_rx_frames = 0 # n_rx_frames when lock was last recovered
 
         self.tx_axis_source = AxiStreamSource(AxiStreamBus.from_prefix(self.dut, "s00_axis"), 
                                                 self.dut.i_xver_tx_clk, self.dut.i_rx_reset)
@@ -65,47 +95,47 @@ class MacPcsBfm(metaclass=utility_classes.Singleton):
         self.rx_axis_monitor.log.propagate = enable
        
     async def loopback(self, cycle_delay, bit_delay):
-        async def capture_outputs(self, q, cycle_delay, bit_delay):
-            for _ in range(cycle_delay): await q.put([0, 0, 0, 0])
-            prev_tx_gearbox_seq = 0
-            prev_data_bits = 0
-
-            while True:
-                await RisingEdge(self.dut.i_xver_tx_clk)
-                
-                o_xver_tx_data = self.dut.o_xver_tx_data.value
-                o_xver_tx_header = self.dut.o_xver_tx_header.value
-                xver_tx_data_valid = self.dut.o_xver_tx_gearbox_sequence.value != self.gearbox_pause_val
-
-                xver_tx_header_valid = self.dut.o_xver_tx_gearbox_sequence.value != prev_tx_gearbox_seq and xver_tx_data_valid
-                prev_tx_gearbox_seq = self.dut.o_xver_tx_gearbox_sequence.value
-
-                # As we don't fully model external gearbox, only support bit slips for internal
-                if bit_delay > 0 and self.dut.EXTERNAL_GEARBOX.value == 0:
-                    tx_data_noslip = o_xver_tx_data
-                    o_xver_tx_data = ((o_xver_tx_data << bit_delay) | prev_data_bits) & 0xFFFFFFFF
-                    prev_data_bits = (tx_data_noslip >> (32 - bit_delay)) & ((1 << bit_delay) - 1)
-
-                await q.put([o_xver_tx_data, o_xver_tx_header, xver_tx_data_valid, xver_tx_header_valid])
-
-        async def apply_input(self, q):
-            while True:
-                await RisingEdge(self.dut.i_xver_rx_clk)
-                [o_xver_tx_data, o_xver_tx_header, xver_tx_data_valid, xver_tx_header_valid] = await q.get()
-                
-                self.dut.i_xver_rx_data.value = o_xver_tx_data
-                if self.dut.EXTERNAL_GEARBOX.value:
-                    self.dut.i_xver_rx_header.value = o_xver_tx_header
-                    self.dut.i_xver_rx_data_valid.value = xver_tx_data_valid
-                    self.dut.i_xver_rx_header_valid.value = xver_tx_header_valid
-                else: 
-                    self.dut.i_xver_rx_header.value = 0
-                    self.dut.i_xver_rx_data_valid.value = 0
-                    self.dut.i_xver_rx_header_valid.value = 0
-
-        q = Queue()
-        cocotb.start_soon(capture_outputs(self, q, cycle_delay, bit_delay))
-        cocotb.start_soon(apply_input(self, q))
+        # As we don't fully model external gearbox, only support bit slips for internal
+        # With an RX clock offset, the loopback has to be asynchronous and elastic
+        self.loopback_channel = LoopbackChannel(self.dut, self.gearbox_pause_val, cycle_delay, bit_delay,
+                                    external_gearbox=bool(self.dut.EXTERNAL_GEARBOX.value),
+                                    synchronous=self.config['loopback_synchronous'] and not self.rx_clk_drift,
+                                    elastic=self.rx_clk_drift,
+                                    int_tx_gearbox_sequence=None if self.dut.EXTERNAL_GEARBOX.value else
+                                        self.tx_gearbox_sequence)
+        self.loopback_channel.start()
+
+    def start_error_channel(self):
+        """Inject channel errors into the loopback from now on, and count lock drops. Called once the
+        RX is locked, if any channel error rate is set."""
+        self.error_channel = ErrorChannel(self.data_width, bool(self.dut.EXTERNAL_GEARBOX.value),
+                                            ber=self.config['channel_ber'],
+                                            burst_rate=self.config['channel_burst_rate'],
+                                            burst_length=self.config['channel_burst_length'],
+                                            header_error_rate=self.config['channel_header_error_rate'],
+                                            seed=self.config['seed'])
+        if not self.error_channel.enabled():
+            self.error_channel = None
+            return
+
+        self.loopback_channel.errors = self.error_channel
+        cocotb.start_soon(self.lock_monitor_bfm())
+
+    async def lock_monitor_bfm(self):
+        """Count lock_state slips after lock, and the cycles to get back to GOOD_64. Waits on the
+        slip edge, so costs nothing while locked."""
+        slip = self.dut.u_pcs.u_lock_state.o_slip
+        state = self.dut.u_pcs.u_lock_state.state
+        rx_clk_edge = RisingEdge(self.dut.i_xver_rx_clk)
+        while True:
+            await RisingEdge(slip)
+            self.n_lock_drops += 1
+            cycles = 0
+            while state.value.integer != GOOD_64:
+                await rx_clk_edge
+                cycles += 1
+            self.lock_recovery_cycles.append(cycles)
+            self.lock_recovery_rx_frames = self.n_rx_frames
 
     async def send_tx_packet(self, packet):
         await self.tx_driver_queue.put(packet)
@@ -131,40 +161,168 @@ class MacPcsBfm(metaclass=utility_classes.Singleton):
 
     async def driver_bfm(self):
         while True:
+            # AxiStreamSource takes its own copy of bytes/bytearray packets - pass them straight through.
+            # Corpus packets (memoryviews) have to be copied to bytes first, as the source copies
+            # anything else element by element (see packet_corpus.py).
             packet = await self.tx_driver_queue.get()
-            await self.tx_axis_source.send(packet.tobytes())
-            await self.tx_axis_source.wait()
+            if type(packet) is memoryview:
+                packet = packet.tobytes()
+            await self.tx_axis_source.send(packet)
+            if not self.config['throughput_mode']:
+                await self.tx_axis_source.wait()
+
+
+    async def tx_throughput_monitor_bfm(self):
+        """Sample the TX AXIS handshake each cycle, adding each frame's timing to self.throughput
+        once the next frame starts (which gives its period)"""
+        cycle = 0
+        frame = None # [first beat cycle, tvalid cycles, tvalid and tready cycles, bytes, tlast cycle]
+        prev_frame = None
 
+        while True:
+            await RisingEdge(self.dut.i_xver_tx_clk)
+
+            if self.dut.s00_axis_tvalid.value.integer:
+                if frame is None:
+                    frame = [cycle, 0, 0, 0, None]
+                    if prev_frame is not None:
+                        start, valid, ready, nbytes, end = prev_frame
+                        self.throughput.add(nbytes, cycle - start, valid, ready, cycle - end - 1)
+
+                frame[1] += 1
+                if self.dut.s00_axis_tready.value.integer:
+                    frame[2] += 1
+                    frame[3] += bin(self.dut.s00_axis_tkeep.value.integer).count('1')
+                    if self.dut.s00_axis_tlast.value.integer:
+                        frame[4] = cycle
+                        prev_frame, frame = frame, None
+
+            cycle += 1
+
+    async def coverage_monitor_bfm(self):
+        """Sample the block type and TX gearbox phase of each block, from the encoder output on the
+        first word of the block"""
+        pcs = self.dut.u_pcs
+        header, data = pcs.tx_header, pcs.tx_encoded_data
+        frame_word, pause = pcs.enc_frame_word, pcs.tx_gearbox_pause
+        sequence = self.tx_gearbox_sequence
+        tx_clk_edge = RisingEdge(self.dut.i_xver_tx_clk)
+
+        while True:
+            await tx_clk_edge
+            if frame_word.value.integer or pause.value.integer:
+                continue
+            self.coverage.sample_block(header.value.integer, data.value.integer & 0xff, sequence.value.integer)
+
+    async def slip_coverage_bfm(self):
+        """Sample the lock_state slips taken to each block lock. Polls the state until locked, then
+        waits for the next slip."""
+        slip = self.dut.u_pcs.u_lock_state.o_slip
+        state = self.dut.u_pcs.u_lock_state.state
+        rx_clk_edge = RisingEdge(self.dut.i_xver_rx_clk)
+        while True:
+            n_slips = 0
+            while state.value.integer != GOOD_64:
+                await rx_clk_edge
+                n_slips += state.value.integer == SLIP
+            self.coverage.sample_slip_state(n_slips)
+            await RisingEdge(slip)
+
+    async def model_capture_bfm(self, n_cycles):
+        """Capture the TX XGMII words (on cycles that aren't a pause) and wire words of n_cycles TX
+        cycles from a sequence count 0, with the TX scrambler state then, for Scoreboard.check_model.
+        Internal gearbox only."""
+        pcs = self.dut.u_pcs
+        xgmii_ctl, xgmii_data = self.dut.xgmii_tx_ctl, self.dut.xgmii_tx_data
+        pause, wire = pcs.tx_gearbox_pause, self.dut.o_xver_tx_data
+        tx_clk_edge = RisingEdge(self.dut.i_xver_tx_clk)
+
+        await tx_clk_edge
+        while self.tx_gearbox_sequence.value.integer != 0:
+            await tx_clk_edge
+
+        # The scrambler state is the previous scrambled block, the top 64 bits at a block boundary
+        scrambler_state = None if self.dut.SCRAMBLER_BYPASS.value else \
+                            pcs.l_tx_scrambler.u_scrambler.scrambler_data.value.integer >> 64
+        capture = {'scrambler_state' : scrambler_state, 'ctl' : [], 'data' : [], 'wire' : [], 'frames' : []}
+        self.model_capture = capture
+
+        for _ in range(n_cycles):
+            if not pause.value.integer:
+                capture['ctl'].append(xgmii_ctl.value.integer)
+                capture['data'].append(xgmii_data.value.integer)
+            capture['wire'].append(wire.value.integer)
+            await tx_clk_edge
 
     async def tx_monitor_bfm(self):
         while True:
-            packet = await self.tx_axis_monitor.recv()
+            packet = await self.tx_axis_monitor.recv(compact=False)
+            packet = self.compact_axis_no_tuser(packet)
+            if self.coverage is not None:
+                self.coverage.sample_frame(len(packet.tdata))
+            if self.model_capture is not None:
+                self.model_capture['frames'].append(bytes(packet.tdata))
             self.tx_monitor_queue.put_nowait(packet)
+            self.n_tx_frames += 1
     
     async def rx_monitor_bfm(self):
         while True:
             packet = await self.rx_axis_monitor.recv(compact=False)
             packet = self.compact_axis_no_tuser(packet)
             self.rx_monitor_queue.put_nowait(packet)
+            self.n_rx_frames += 1
 
     async def get_tx_frame(self):
         return await self.tx_monitor_queue.get()
 
     async def get_rx_frame(self):
         return await self.rx_monitor_queue.get()
+
+    async def wait_tx_frames(self, n_frames):
+        """Wait until n_frames frames have been sent in total"""
+        while self.n_tx_frames < n_frames:
+            await RisingEdge(self.dut.i_xver_tx_clk)
+
+    async def wait_tx_phase(self, phase):
+        """Wait for the next TX clock edge with the TX gearbox sequence at phase"""
+        while True:
+            await RisingEdge(self.dut.i_xver_tx_clk)
+            if self.tx_gearbox_sequence.value.integer == phase:
+                return
+
+    async def wait_rx_frames(self, n_frames):
+        """Wait until n_frames frames have been received in total"""
+        while self.n_rx_frames < n_frames:
+            await RisingEdge(self.dut.i_xver_rx_clk)
+
+    def frame_latency(self, tx_frame, rx_frame):
+        """Latency from the first TX AXIS beat to the first RX AXIS beat of a frame, as (ns, cycles).
+        The monitors timestamp the first beat of each frame in sim_time_start."""
+        latency_ns = get_time_from_sim_steps(rx_frame.sim_time_start - tx_frame.sim_time_start, 'ns')
+        return latency_ns, round(latency_ns / self.clk_period)
             
 
     async def start_bfm(self):
-        self.data_width = len(self.dut.xgmii_tx_data)
-        self.data_nbytes = self.data_width // 8
-        self.gearbox_pause_val = 32
-        self.clk_period = round(1 / (10.3125 / self.data_width), 2) # ps precision
-        
         cocotb.start_soon(Clock(self.dut.i_xver_tx_clk, self.clk_period, units="ns").start())
-        cocotb.start_soon(Clock(self.dut.i_xver_rx_clk, self.clk_period, units="ns").start())
+        if self.rx_clk_drift:
+            cocotb.start_soon(drifting_clock(self.dut.i_xver_rx_clk, self.clk_period * 1000, self.config['rx_clk_ppm'],
+                                                self.config['rx_clk_jitter'], self.config['seed']))
+        else:
+            cocotb.start_soon(Clock(self.dut.i_xver_rx_clk, self.clk_period, units="ns").start())
         
 
         await self.reset()
+
+        if self.config['coverage'] or self.config['coverage_stop'] or self.config['coverage_directed']:
+            lengths = self.config['throughput_packet_lengths'] if self.config['throughput_mode'] else \
+                        [self.config['tx_min_packet_length'], self.config['tx_max_packet_length']]
+            self.coverage = FunctionalCoverage(min(lengths), max(lengths), bool(self.dut.EXTERNAL_GEARBOX.value))
+            cocotb.start_soon(self.coverage_monitor_bfm())
+            cocotb.start_soon(self.slip_coverage_bfm())
+
+        if self.config['model_check'] and not self.dut.EXTERNAL_GEARBOX.value:
+            cocotb.start_soon(self.model_capture_bfm(self.config['model_check_cycles']))
+
         cocotb.start_soon(self.loopback(self.config['loopback_cycle_slip'], self.config['loopback_bit_slip']))
 
         # manual slip for idles - debugging w/out scrambler
@@ -190,51 +348,53 @@ class MacPcsBfm(metaclass=utility_classes.Singleton):
                 await RisingEdge(self.dut.i_xver_rx_clk)
 
 
+        if self.config['throughput_mode']:
+            # Keep frames queued behind the one being sent, so frames go back to back. send() waits
+            # while more than the limit are queued (the frame being sent isn't counted), so 1, the
+            # lowest limit, still allows 2 queued frames
+            self.tx_axis_source.queue_occupancy_limit_frames = 1
+            self.throughput = ThroughputStats(self.clk_period)
+            cocotb.start_soon(self.tx_throughput_monitor_bfm())
+
         cocotb.start_soon(self.driver_bfm())
         cocotb.start_soon(self.tx_monitor_bfm())
         cocotb.start_soon(self.rx_monitor_bfm())
 
 
-    # A copy of AxiStreamFrame::compact but does not remvove tuser when tkeep = 0
+    # AxiStreamFrame::compact but does not remove tuser when tkeep = 0, and applies tkeep with a
+    # numpy mask rather than deleting bytes one at a time
     @staticmethod
     def compact_axis_no_tuser(frame):
         if len(frame.tkeep):
-            # remove tkeep=0 bytes
-            for k in range(len(frame.tdata)-1, -1, -1):
-                if not frame.tkeep[k]:
-                    if k < len(frame.tdata):
-                        del frame.tdata[k]
-                    if k < len(frame.tkeep):
-                        del frame.tkeep[k]
-                    if k < len(frame.tid):
-                        del frame.tid[k]
-                    if k < len(frame.tdest):
-                        del frame.tdest[k]
+            keep = np.frombuffer(bytes(frame.tkeep), dtype=np.uint8).astype(bool)
+            n_keep = np.count_nonzero(keep)
+
+            if n_keep < len(keep):
+                if keep[:n_keep].all():
+                    # Only trailing bytes removed (tlast word), truncate in place
+                    del frame.tdata[n_keep:]
+                    del frame.tid[n_keep:]
+                    del frame.tdest[n_keep:]
+                else:
+                    frame.tdata = bytearray(np.frombuffer(frame.tdata, dtype=np.uint8)[keep])
+                    if len(frame.tid):
+                        frame.tid = np.array(frame.tid)[keep].tolist()
+                    if len(frame.tdest):
+                        frame.tdest = np.array(frame.tdest)[keep].tolist()
 
         # remove tkeep
         frame.tkeep = None
 
         # clean up other sideband signals
         # either remove or consolidate if values are identical
-        if len(frame.tid) == 0:
-            frame.tid = None
-        elif all(frame.tid[0] == i for i in frame.tid):
-            frame.tid = frame.tid[0]
-
-        if len(frame.tdest) == 0:
-            frame.tdest = None
-        elif all(frame.tdest[0] == i for i in frame.tdest):
-            frame.tdest = frame.tdest[0]
-
-        if len(frame.tuser) == 0:
-            frame.tuser = None
-        elif all(frame.tuser[0] == i for i in frame.tuser):
-            frame.tuser = frame.tuser[0]
+        frame.tid = MacPcsBfm._consolidate_sideband(frame.tid)
+        frame.tdest = MacPcsBfm._consolidate_sideband(frame.tdest)
+        frame.tuser = MacPcsBfm._consolidate_sideband(frame.tuser)
 
         return frame
 
-        
-
-
-
-    
\ No newline at end of file
+    @staticmethod
+    def _consolidate_sideband(values):
+        if len(values) == 0:
+            return None
+        return values[0] if values.count(values[0]) == len(values) else values
@@ -0,0 +1,127 @@
+import os
+import sys
+import numpy as np
+
+for _dir in ['../gearbox', '../pcs', '../mac']:
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), _dir))
+
+from code_defs import *
+from gearbox_model import blocks_to_words, words_to_blocks, find_block_lock, TX_SEQ_LENGTH, TX_BLOCKS_PER_SEQ
+from scrambler_model import ScramblerModel
+from encoder_model import EncoderModel
+from decoder_model import DecoderModel
+from crc_model import CrcModel
+from mac_model import TxMacModel, RxMacModel
+
+# Stream model of the mac_pcs datapath, without a simulator
+#
+#   TX: frames -> TxMacModel -> EncoderModel -> ScramblerModel -> gearbox -> 32-bit wire words
+#   RX: wire words -> block alignment -> gearbox -> descrambler -> DecoderModel -> RxMacModel -> frames
+#
+# This is not a cycle accurate reference model of the DUT, and has a narrower scope:
+#   - TX: the wire words (o_xver_tx_data of each gearbox cycle, 33 words per 16 blocks) for given
+#     frames, idle gaps and scrambler state are the DUT's, checked in the mac_pcs testbench with
+#     model_check. Frames are sent back to back with gap extra idle words after each, rather than
+#     with the BFM driver timing. The stream starts with startup_idle idle words.
+#   - RX: blocks are aligned with find_block_lock, a search for the valid sync header offset. Block
+#     lock timing and slips (lock_state.sv, pcs/lock_state_model.py) are not modelled, nor RX cycle
+#     timing, so received frames are only the data and CRC check.
+#
+# Throughput is ~0.2 Gb/s of wire words for 1500 byte frames and ~0.07 Gb/s for 64 byte frames
+#   (TX + RX, one core). The CRC, scrambler recurrence and RX MAC are several numpy passes, or
+#   Python work, per frame and block, and line rate (10 Gb/s) is out of reach. Use it to predict
+#   a testbench run, not to replace simulations of line rate traffic.
+
+
+class MacPcsStreamModel:
+    def __init__(self, scrambler_bypass=False, gap=0, startup_idle=10*TX_SEQ_LENGTH, crc_model=None):
+        self.scrambler_bypass = scrambler_bypass
+        self.gap = gap
+        self.startup_idle = startup_idle
+        self.crc_model = CrcModel() if crc_model is None else crc_model
+
+        self.tx_mac = TxMacModel(self.crc_model)
+        self.encoder = EncoderModel()
+        self.scrambler = ScramblerModel()
+        self.descrambler = ScramblerModel(descramble=True)
+        self.decoder = DecoderModel()
+        self.rx_mac = RxMacModel(self.crc_model)
+        self.reset()
+
+    def reset(self):
+        self.scrambler.reset()
+        self.descrambler.reset()
+        self.rx_mac.reset()
+
+        # Leftovers carried between calls - an odd XGMII word, part of a gearbox sequence
+        self.tx_xgmii = self.tx_mac.idle(self.startup_idle)
+        self.tx_blocks = (np.zeros(0, dtype=np.uint8), np.zeros(0, dtype=np.uint64))
+        self.rx_words = np.zeros(0, dtype=np.uint32)
+        self.rx_offset = None
+
+    def transmit(self, frames, flush=False):
+        """Wire words for a list of frames (bytes). Words are only output for whole gearbox sequences,
+        with flush the stream is padded with idles so that all frames are output."""
+        ctl, data = self.tx_mac.next(frames, self.gap)
+
+        if flush:
+            # Complete the sequence, then one more so the last blocks reach the RX
+            n_words = len(self.tx_xgmii[1]) + len(data)
+            n_blocks = len(self.tx_blocks[0]) + n_words // 2
+            n_pad = 2 * (-n_blocks % TX_BLOCKS_PER_SEQ + TX_BLOCKS_PER_SEQ) + n_words % 2
+            idle_ctl, idle_data = self.tx_mac.idle(n_pad)
+            ctl, data = np.concatenate([ctl, idle_ctl]), np.concatenate([data, idle_data])
+
+        return self.transmit_xgmii(ctl, data)
+
+    def transmit_xgmii(self, ctl, data):
+        """Wire words for XGMII (ctl, data) word arrays, one word per gearbox cycle that isn't a
+        pause, the first of a block at sequence count 0. Words are only output for whole sequences."""
+        ctl = np.concatenate([self.tx_xgmii[0], np.asarray(ctl, dtype=np.uint8)])
+        data = np.concatenate([self.tx_xgmii[1], np.asarray(data, dtype=np.uint64)])
+
+        n = len(data) // 2 * 2
+        self.tx_xgmii = (ctl[n:], data[n:])
+        header, data = self.encoder.encode(data[:n], ctl[:n], data_width=32)
+        if not self.scrambler_bypass:
+            data = self.scrambler.next(data)
+
+        header = np.concatenate([self.tx_blocks[0], header])
+        data = np.concatenate([self.tx_blocks[1], data])
+        n = len(data) // TX_BLOCKS_PER_SEQ * TX_BLOCKS_PER_SEQ
+        self.tx_blocks = (header[n:], data[n:])
+
+        return blocks_to_words(header[:n], data[:n])
+
+    def receive(self, words):
+        """Received frames for wire words, as dicts of tdata (including the FCS) and tuser.
+        Words before block lock are discarded."""
+        words = np.concatenate([self.rx_words, np.asarray(words, dtype=np.uint32)])
+
+        if self.rx_offset is None:
+            self.rx_offset = find_block_lock(words)
+            if self.rx_offset is None:
+                self.rx_words = words
+                return []
+
+        header, data, n_words = words_to_blocks(words, self.rx_offset)
+        self.rx_words = words[n_words:]
+
+        if not self.scrambler_bypass:
+            data = self.descrambler.next(data)
+        ctl, data, _ = self.decoder.decode(header, data, data_width=32)
+
+        return self.rx_mac.next(ctl, data)
+
+    def next(self, frames, flush=False):
+        """Transmit frames in loopback, returns the wire words and received frames"""
+        words = self.transmit(frames, flush)
+        return words, self.receive(words)
+
+    def stream(self, frame_batches, flush=True):
+        """Generator - run lists of frames in loopback, yields (wire words, received frames) per batch.
+        With flush, a final batch drains the frames still held in the pipeline."""
+        for frames in frame_batches:
+            yield self.next(frames)
+        if flush:
+            yield self.next([], flush=True)
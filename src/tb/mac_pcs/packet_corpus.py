@@ -0,0 +1,89 @@
+import os
+import json
+import numpy as np
+
+# Pre-generated packet corpus for the mac_pcs testbench
+#
+# A corpus is a seeded set of packets, generated once and then opened read only. It has three files:
+#   - <path>.bin, the packet bytes back to back
+#   - <path>.idx.npy, an (n_packets, 2) int64 index of the offset and length of each packet
+#   - <path>.json, the generator parameters, written last, so a corpus with one is complete
+#
+# The blob and index are memory-mapped. Packet i is a memoryview slice of the blob, with no copy,
+#   and testbenches running from the same corpus share one copy in the page cache. Packets don't
+#   depend on the ones before them, so a failure can be replayed from its packet index.
+#
+# Packets are only zero-copy up to the mac_pcs driver. cocotbext-axi's AxiStreamSource copies
+#   every frame it is sent into a bytearray, and takes only bytes or bytearray as a block (any
+#   other type is copied element by element, ~9 us for 1500 bytes). So the driver copies each packet
+#   to bytes first, and sending copies it again - ~0.6 us per packet for the two copies, small next
+#   to simulating the frame, but not zero.
+#
+# Lengths are uniform in [min_length, max_length], and the data is uniform bytes, both from numpy's
+#   default_rng(seed). The data is generated and written in chunks, so a corpus can be larger than
+#   memory. Each generator writes its own temporary files and renames them into place, so workers
+#   that generate the same corpus at once don't interfere.
+
+GENERATE_CHUNK_BYTES = 1 << 24
+
+
+class PacketCorpus:
+    def __init__(self, path):
+        self.path = path
+        with open(path + '.json', 'r') as f:
+            self.params = json.load(f)
+        self.index = np.load(path + '.idx.npy', mmap_mode='r')
+        self.blob = np.memmap(path + '.bin', dtype=np.uint8, mode='r')
+        self.data = memoryview(self.blob)
+
+    def __len__(self):
+        return len(self.index)
+
+    def packet(self, i):
+        """Packet i, as a read only memoryview into the blob"""
+        offset, length = self.index[i].tolist()
+        return self.data[offset:offset + length]
+
+    def lengths(self):
+        return self.index[:, 1]
+
+    @staticmethod
+    def generate(path, n_packets, min_length, max_length, seed):
+        """Write a corpus of n_packets packets to path"""
+        rng = np.random.default_rng(seed)
+        lengths = rng.integers(min_length, max_length + 1, n_packets, dtype=np.int64)
+        offsets = np.zeros(n_packets, dtype=np.int64)
+        np.cumsum(lengths[:-1], out=offsets[1:])
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+
+        with open(tmp + '.bin', 'wb') as f:
+            n_bytes = int(lengths.sum())
+            for start in range(0, n_bytes, GENERATE_CHUNK_BYTES):
+                f.write(rng.integers(0, 256, min(GENERATE_CHUNK_BYTES, n_bytes - start), dtype=np.uint8).tobytes())
+        with open(tmp + '.idx.npy', 'wb') as f:
+            np.save(f, np.stack([offsets, lengths], axis=1))
+        with open(tmp + '.json', 'w') as f:
+            json.dump(PacketCorpus.generator_params(n_packets, min_length, max_length, seed), f, indent=2)
+
+        for ext in ['.bin', '.idx.npy', '.json']:
+            os.replace(tmp + ext, path + ext)
+
+    @staticmethod
+    def generator_params(n_packets, min_length, max_length, seed):
+        return {'n_packets' : n_packets, 'min_length' : min_length, 'max_length' : max_length, 'seed' : seed}
+
+    @classmethod
+    def open(cls, path, n_packets, min_length, max_length, seed):
+        """The corpus at path, generated first unless it exists with the same parameters"""
+        params = cls.generator_params(n_packets, min_length, max_length, seed)
+        try:
+            with open(path + '.json', 'r') as f:
+                exists = json.load(f) == params
+        except FileNotFoundError:
+            exists = False
+
+        if not exists:
+            cls.generate(path, n_packets, min_length, max_length, seed)
+        return cls(path)
@@ -0,0 +1,135 @@
+"""sweep.py
+
+    Parallel parameter sweep of the mac_pcs loopback test.
+
+    Runs the test_mac_pcs matrix of loopback_bit_slip x EXTERNAL_GEARBOX x SCRAMBLER_BYPASS over a
+    process pool, one sim_build per case, and streams the results into one summary. The external
+    gearbox is only run with no bit slip, as the BFM only models bit slips for the internal gearbox.
+
+    For the internal gearbox, each case waits for the block lock time from the lock state model
+    (pcs/lock_state_model.py) instead of the worst case startup_pause.
+
+    Usage: python sweep.py [--bit-slips 0-65] [--jobs N] [--config key=value ...]
+                           [--output sim_build/sweep_summary.json]
+
+    The case list is checked by test_sweep.py. Running cases needs a simulator, so a short run to
+    try a change, e.g. --bit-slips 0-1 (6 cases), is manual only.
+
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import yaml
+
+TB_DIR = os.path.dirname(os.path.abspath(__file__))
+LOCK_MARGIN = 1.25
+
+sys.path.append(os.path.join(TB_DIR, '../pcs'))
+from lock_state_model import lock_sweep
+
+
+def sweep_cases(bit_slips=range(66), external_gearbox=(0, 1), scrambler_bypass=(0, 1), config=None):
+    """(parameters, config) of each case. For the internal gearbox, startup_pause is set from the
+    block lock model time for the case, rather than the worst case in mac_pcs_config.yaml. The
+    loopback is synchronous unless config sets loopback_synchronous."""
+    with open(os.path.join(TB_DIR, 'mac_pcs_config.yaml'), 'r') as f:
+        cycle_slip = yaml.safe_load(f)['loopback_cycle_slip']
+    config = {'loopback_synchronous': True, **({} if config is None else config)}
+    cycle_slip = config.get('loopback_cycle_slip', cycle_slip)
+
+    lock_cycles = {bypass : lock_sweep([cycle_slip], bit_slips, scrambler_bypass=bool(bypass))[0]
+                    for bypass in scrambler_bypass}
+
+    cases = []
+    for gearbox, bypass, (i, bit_slip) in itertools.product(external_gearbox, scrambler_bypass, enumerate(bit_slips)):
+        if gearbox and bit_slip != 0:
+            continue
+        case_config = {"loopback_bit_slip": bit_slip}
+        if not gearbox and lock_cycles[bypass][i] >= 0 and 'startup_pause' not in config:
+            case_config['startup_pause'] = int(lock_cycles[bypass][i] * LOCK_MARGIN)
+        cases.append(({"EXTERNAL_GEARBOX": str(gearbox), "SCRAMBLER_BYPASS": str(bypass)},
+                        {**config, **case_config}))
+    return cases
+
+
+def run_case(parameters, config):
+    """Worker - run one case in its own sim_build, with the simulator output to a log file there"""
+    os.chdir(TB_DIR)
+    from test_mac_pcs import run_mac_pcs
+
+    name = ",".join((f"{key}={str(value)}" for key, value in {**parameters, **config}.items()))
+    sim_build = os.path.join("./sim_build/sweep", name)
+    os.makedirs(sim_build, exist_ok=True)
+    log_file = os.path.join(sim_build, "sim.log")
+
+    start = time.time()
+    saved_fds = [os.dup(1), os.dup(2)]
+    with open(log_file, 'w') as log:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+        try:
+            run_mac_pcs(parameters, config, sim_build=sim_build)
+            error = None
+        except (Exception, SystemExit) as e:
+            error = f'{type(e).__name__}: {e}'
+        finally:
+            # Put stdout and stderr back, for a case run in this process
+            sys.stdout.flush()
+            sys.stderr.flush()
+            for fd, saved_fd in zip([1, 2], saved_fds):
+                os.dup2(saved_fd, fd)
+                os.close(saved_fd)
+
+    return {'case' : name, 'passed' : error is None, 'error' : error,
+            'duration' : round(time.time() - start, 1), 'log' : log_file}
+
+
+def parse_range(s):
+    first, _, last = s.partition('-')
+    return range(int(first), int(last or first) + 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parallel mac_pcs parameter sweep')
+    parser.add_argument('--bit-slips', type=parse_range, default=range(66), help='loopback_bit_slip range, e.g. 0-65')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='worker processes (default: all cores)')
+    parser.add_argument('--config', action='append', default=[], metavar='KEY=VALUE',
+                        help='override a mac_pcs_config.yaml value for every case, e.g. tx_seq_length=20')
+    parser.add_argument('--output', default=os.path.join(TB_DIR, 'sim_build', 'sweep_summary.json'))
+    args = parser.parse_args()
+
+    config = {key : yaml.safe_load(value) for key, value in (item.split('=', 1) for item in args.config)}
+    cases = sweep_cases(args.bit_slips, config=config)
+    print(f'Running {len(cases)} cases on {args.jobs} workers')
+
+    results = []
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [pool.submit(run_case, parameters, config) for parameters, config in cases]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            status = 'PASS' if result['passed'] else f'FAIL ({result["error"]}, see {result["log"]})'
+            print(f'[{len(results)}/{len(cases)}] {result["case"]} {result["duration"]}s {status}', flush=True)
+
+    results.sort(key=lambda result: result['case'])
+    n_failed = sum(not result['passed'] for result in results)
+    print(f'{len(results) - n_failed} passed, {n_failed} failed in {time.time() - start:.0f}s')
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    return 1 if n_failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
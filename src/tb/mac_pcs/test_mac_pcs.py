@@ -25,7 +25,8 @@
     Pyuvm testbench for mac_pcs module.
 
     This testbench implements a single test with random packets, tested in loopback.
-    Received packets are checked for correctness and for CRC match flag (TUSER) set.
+    Received packets are checked for correctness, for the received FCS against the CRC model
+    and for CRC match flag (TUSER) set.
 
 """
 
@@ -35,49 +36,223 @@ import yaml
 import pytest
 import numpy as np
 import os
+import sys
 import glob
-from shutil import copyfile
+import json
+from collections import deque
 
 from cocotb.triggers import RisingEdge, FallingEdge
 from cocotb.queue import QueueEmpty, Queue
 from cocotb.clock import Clock
-from cocotb_test.simulator import run
 
 from pyuvm import *
 import pyuvm
 
 from mac_pcs_bfm import MacPcsBfm
+from latency_stats import LatencyStats
+from func_coverage import N_PHASES, block_phases, length_for_terminate
+from packet_corpus import PacketCorpus
+from mac_pcs_stream_model import MacPcsStreamModel
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../mac'))
+from crc_model import CrcModel
+from mac_model import TxMacModel
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from sim_run import run_cached
+
+MIN_FRAME_SIZE = 60 # excluding FCS
+SCOREBOARD_MAX_PENDING = 64 # TX frames held for loss tolerant matching
+
+TB_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def predict_wire_words(capture, scrambler_bypass):
+    """MacPcsStreamModel wire words for a MacPcsBfm.model_capture - the TX frames transmitted with
+    the idle words the DUT put between them, from the DUT's scrambler state"""
+    ctl = np.array(capture['ctl'], dtype=np.uint8)
+    data = np.array(capture['data'], dtype=np.uint64)
+    starts = np.flatnonzero((ctl == 0x1) & (data == np.uint64(0x555555fb)))
+    frames = capture['frames'][:len(starts)]
+    starts = starts[:len(frames)]
+
+    model = MacPcsStreamModel(scrambler_bypass, startup_idle=0)
+    if not scrambler_bypass:
+        model.scrambler.reset(capture['scrambler_state'])
+
+    # Idles to the first frame, then each frame with the idles to the next start (or the end of
+    # the capture) as its gap
+    first = starts[0] if len(starts) else len(data)
+    words = [model.transmit_xgmii(ctl[:first], data[:first])]
+    for i, frame in enumerate(frames):
+        end = starts[i + 1] if i + 1 < len(starts) else len(data)
+        gap = end - starts[i] - TxMacModel.n_words(len(frame))
+        if gap < 0 and i + 1 < len(starts):
+            raise ValueError(f'Frame {i} ({len(frame)} bytes) started {starts[i]} and the next at {end}, '
+                             f'shorter than the model\'s {TxMacModel.n_words(len(frame))} words')
+        model.gap = max(gap, 0)
+        words.append(model.transmit([frame]))
+
+    return np.concatenate(words)
 
 class EthTxSeqItem(uvm_sequence_item):
-    def __init__(self, name, packet_size):
+    def __init__(self, name, packet_size, packet=None):
         super().__init__(name)
         self.packet_size = packet_size
-        self.packet = np.random.randint(0, 255, packet_size, dtype=np.uint8)
+        # Packets are bytearrays, or memoryviews into a PacketCorpus, passed by reference from here
+        # to the AXIS source
+        if packet is None:
+            packet = bytearray(np.random.randint(0, 255, packet_size, dtype=np.uint8))
+        self.packet = packet
 
     def __eq__(self, other):
         return self.packet == other.packet
 
     def __str__(self):
-        return f'{self.get_name()} : Size = {len(self.packet)}, Data = {self.packet}'
+        return f'{self.get_name()} : Size = {len(self.packet)}, Data = {self.packet.hex()}'
 
 class EthTxSeqRandom(uvm_sequence):
+    """length frames of random length, or fewer if coverage is given and closes"""
+    def __init__(self, name, length, min_packet_length=16, max_packet_length=255, coverage=None):
+        super().__init__(name)
+        self.length = length
+        self.min_packet_length = min_packet_length
+        self.max_packet_length = max_packet_length
+        self.coverage = coverage
+
+    async def body(self):
+        for i in range(self.length):
+            if self.coverage is not None and self.coverage.closed():
+                break
+            seq_item = EthTxSeqItem(f'p{i}', np.random.randint(self.min_packet_length, self.max_packet_length + 1, 1))
+            await self.start_item(seq_item)
+            await self.finish_item(seq_item)
 
-    def __init__(self, name, length):
+class EthTxSeqCoverage(uvm_sequence):
+    """Up to length frames aimed at the coverage holes, each sent alone at a chosen TX gearbox phase.
+    The S0 phase each send phase gives is learnt as frames go out, then frame lengths are picked to
+    put the terminate block on an unhit lane and phase (func_coverage.frame_blocks). Unexplored send
+    phases, with random lengths, once no hole can be aimed at. Stops when coverage closes."""
+    def __init__(self, name, length, min_packet_length=16, max_packet_length=255, settle_cycles=16):
         super().__init__(name)
         self.length = length
+        self.min_packet_length = min_packet_length
+        self.max_packet_length = max_packet_length
+        self.settle_cycles = settle_cycles # idle cycles after each frame, covers the MAC pipeline and IPG
+        self.sof_phases = {} # send phase -> S0 block phase
+
+    def plan(self, coverage):
+        """(send phase, frame length) of the next frame"""
+        phases = block_phases(coverage.external_gearbox)
+        unexplored = [phase for phase in range(N_PHASES) if phase not in self.sof_phases]
+        any_phase = np.random.choice(unexplored) if unexplored else np.random.randint(N_PHASES)
+        random_length = np.random.randint(self.min_packet_length, self.max_packet_length + 1)
+        term_holes = [(int(hole[1]), int(hole.split('@')[1])) for hole in coverage.holes('term_phase')]
+
+        def term_length(sof_phase):
+            """Length of a frame starting at sof_phase that fills a terminate hole, or None"""
+            for lane, term_phase in term_holes:
+                frame_len = length_for_terminate(lane, phases.index(term_phase) - phases.index(sof_phase),
+                                                 self.min_packet_length, self.max_packet_length, len(phases))
+                if frame_len is not None:
+                    return frame_len
+            return None
+
+        size_holes = coverage.holes('frame_size')
+        if size_holes:
+            return any_phase, np.random.choice(coverage.size_bin_lengths(size_holes[0]))
+
+        sof_holes = [int(hole.split('@')[1]) for hole in coverage.holes('sof_phase')]
+        for send_phase, sof_phase in self.sof_phases.items():
+            if sof_phase in sof_holes:
+                frame_len = term_length(sof_phase)
+                return send_phase, random_length if frame_len is None else frame_len
+
+        for send_phase, sof_phase in self.sof_phases.items():
+            frame_len = term_length(sof_phase)
+            if frame_len is not None:
+                return send_phase, frame_len
+
+        return any_phase, random_length
 
     async def body(self):
+        bfm = MacPcsBfm()
+        coverage = bfm.coverage
         for i in range(self.length):
-            seq_item = EthTxSeqItem(f'p{i}', np.random.randint(16, 256, 1))
+            if coverage.closed():
+                break
+            send_phase, frame_len = self.plan(coverage)
+
+            await bfm.pause(self.settle_cycles)
+            await bfm.wait_tx_phase(send_phase)
+            coverage.last_sof_phase = None
+            n_tx_frames = bfm.n_tx_frames
+            seq_item = EthTxSeqItem(f'c{i}', int(frame_len))
+            await self.start_item(seq_item)
+            await self.finish_item(seq_item)
+
+            await bfm.wait_tx_frames(n_tx_frames + 1)
+            await bfm.pause(self.settle_cycles)
+            if coverage.last_sof_phase is not None:
+                self.sof_phases[send_phase] = coverage.last_sof_phase
+
+class EthTxSeqCorpus(uvm_sequence):
+    """length packets of a PacketCorpus from index start, named by index"""
+    def __init__(self, name, corpus, start, length):
+        super().__init__(name)
+        self.corpus = corpus
+        self.start = start
+        self.length = length
+
+    async def body(self):
+        for i in range(self.start, min(self.start + self.length, len(self.corpus))):
+            packet = self.corpus.packet(i)
+            seq_item = EthTxSeqItem(f'k{i}', len(packet), packet)
             await self.start_item(seq_item)
             await self.finish_item(seq_item)
 
+class EthTxSeqThroughput(uvm_sequence):
+    """n_frames frames of each packet length, sent back to back in throughput mode"""
+    def __init__(self, name, packet_lengths, n_frames):
+        super().__init__(name)
+        self.packet_lengths = packet_lengths
+        self.n_frames = n_frames
+
+    async def body(self):
+        for length in self.packet_lengths:
+            for i in range(self.n_frames):
+                seq_item = EthTxSeqItem(f't{length}_{i}', length)
+                await self.start_item(seq_item)
+                await self.finish_item(seq_item)
+
 class EthTxAllSeq(uvm_sequence):
     async def body(self):
         self.config = ConfigDB().get(None, "", 'run_config')
         seqr = ConfigDB().get(None, "", "SEQR")
-        random = EthTxSeqRandom("random", self.config['tx_seq_length'])
-        await random.start(seqr)
+        if self.config['throughput_mode']:
+            throughput = EthTxSeqThroughput("throughput", self.config['throughput_packet_lengths'],
+                                            self.config['throughput_frames'])
+            await throughput.start(seqr)
+
+            # Let the queued frames go out
+            bfm = MacPcsBfm()
+            await bfm.tx_axis_source.wait()
+            await bfm.pause(self.config['throughput_drain'])
+        elif self.config['coverage_directed']:
+            directed = EthTxSeqCoverage("coverage", self.config['tx_seq_length'],
+                                        self.config['tx_min_packet_length'], self.config['tx_max_packet_length'])
+            await directed.start(seqr)
+        elif self.config['corpus']:
+            corpus = PacketCorpus.open(os.path.join(TB_DIR, 'corpus', self.config['corpus']), self.config['corpus_packets'],
+                                       self.config['tx_min_packet_length'], self.config['tx_max_packet_length'],
+                                       self.config['seed'])
+            packets = EthTxSeqCorpus("corpus", corpus, self.config['corpus_start'], self.config['tx_seq_length'])
+            await packets.start(seqr)
+        else:
+            bfm = MacPcsBfm()
+            random = EthTxSeqRandom("random", self.config['tx_seq_length'],
+                                    self.config['tx_min_packet_length'], self.config['tx_max_packet_length'],
+                                    bfm.coverage if self.config['coverage_stop'] else None)
+            await random.start(seqr)
 
 class TxDriver(uvm_driver):
     def build_phase(self):
@@ -90,6 +265,7 @@ class TxDriver(uvm_driver):
     async def launch_tb(self):
         await self.bfm.start_bfm()
         await self.bfm.pause(self.config['startup_pause'])
+        self.bfm.start_error_channel()
 
     async def run_phase(self):
         await self.launch_tb()
@@ -116,6 +292,7 @@ class Monitor(uvm_component):
 
 class Scoreboard(uvm_component):
     def build_phase(self):
+        self.config = ConfigDB().get(self, "", 'run_config')
         self.tx_frame_fifo = uvm_tlm_analysis_fifo("tx_frame_fifo", self)
         self.rx_frame_fifo = uvm_tlm_analysis_fifo("rx_frame_fifo", self)
         self.tx_frame_port = uvm_get_port("tx_frame_port", self)
@@ -127,50 +304,280 @@ class Scoreboard(uvm_component):
         self.tx_frame_port.connect(self.tx_frame_fifo.get_export)
         self.rx_frame_port.connect(self.rx_frame_fifo.get_export)
 
-    def check_phase(self):
-
-        had_frame = False
-
-        while self.rx_frame_port.can_get():
-            _, rx_frame = self.rx_frame_port.try_get()
-            tx_success, tx_frame = self.tx_frame_port.try_get()
-            
-            had_frame = True
-
-            if not tx_success:
-                self.logger.critical(f'tx_frame {tx_frame} error')
-                assert tx_success
-            else:
-
-                if len(tx_frame.tdata) < 64:
-                    data_eq = rx_frame.tdata[0:len(tx_frame.tdata)] == tx_frame.tdata and \
-                                all([x == 0 for x in rx_frame.tdata[len(tx_frame.tdata):-4]])
-                else:
-                    data_eq = rx_frame.tdata[:-4] == tx_frame.tdata
+    def start_of_simulation_phase(self):
+        self.crc_model = CrcModel()
 
-                try:
-                    iter(rx_frame.tuser)
-                    rx_crc_valid = rx_frame.tuser[-1] == 1
-                except TypeError:
-                    rx_crc_valid = False    
-                    
+        # Running statistics, constant memory however many frames are run
+        self.n_frames = 0
+        self.n_bytes = 0
+        self.min_frame_len = None
+        self.max_frame_len = None
 
-                if not data_eq:
-                    self.logger.critical(f"FAILED (Data Not Equal): {rx_frame}, {tx_frame}")
-                    for i, (tx,rx) in enumerate(zip(tx_frame.tdata, rx_frame.tdata)):
-                        if tx != rx:
-                            print(f'Index {i}, tx = 0x{tx:02x}, rx = 0x{rx:02x}')
+        self.bfm = MacPcsBfm()
+        self.latency = LatencyStats(self.bfm.clk_period)
 
-                elif not rx_crc_valid:
-                    self.logger.critical(f"FAILED (CRC Valid Flag Not Set): {rx_frame}, {tx_frame}")
-                else:
-                    self.logger.info(f"PASSED: {rx_frame}, {tx_frame}")
+        # Loss tolerant checking
+        self.tx_pending = deque()
+        self.n_lost = 0
+        self.n_corrupted = 0
+        self.n_crc_errors = 0 # corrupted frames with the CRC valid flag (TUSER) clear
+        self.n_errored = 0 # TX frames received with the right data, but a bad FCS or CRC valid flag
 
-                assert data_eq and rx_crc_valid
+    async def run_phase(self):
+        # Check each frame as it is received, the TX frame is always monitored first. Matched
+        # frames are dropped, and the test fails on the first error - unless scoreboard_allow_loss.
+        while True:
+            rx_frame = await self.rx_frame_port.get()
 
-        if not had_frame: self.logger.critical(f"Didn't recieve any frames")
-        assert had_frame
+            if self.config['scoreboard_allow_loss']:
+                tx_frame = self.match_frame(rx_frame)
+                if tx_frame is None:
+                    continue
+            else:
+                tx_success, tx_frame = self.tx_frame_port.try_get()
+
+                if not tx_success:
+                    self.logger.critical(f'FAILED (No TX frame for RX frame): {rx_frame}')
+                    assert tx_success
+
+                self.check_frame(tx_frame, rx_frame)
+
+            self.update_stats(tx_frame)
+
+            _, latency_cycles = self.bfm.frame_latency(tx_frame, rx_frame)
+            self.latency.add(len(tx_frame.tdata), latency_cycles)
+
+    @staticmethod
+    def frame_data_eq(tx_frame, rx_frame):
+        # Compare through memoryviews, without copying the frames
+        tx_len, rx_len = len(tx_frame.tdata), len(rx_frame.tdata)
+        rx_data = memoryview(rx_frame.tdata)
+        if tx_len < 64:
+            return rx_data[0:tx_len] == tx_frame.tdata and \
+                    rx_frame.tdata.count(0, tx_len, rx_len - 4) == rx_len - 4 - tx_len
+        else:
+            return rx_data[:-4] == tx_frame.tdata
+
+    @staticmethod
+    def rx_crc_valid(rx_frame):
+        try:
+            iter(rx_frame.tuser)
+            return rx_frame.tuser[-1] == 1
+        except TypeError:
+            return False
+
+    def frame_fcs(self, tx_frame, rx_frame):
+        """(received FCS is correct, CRC valid flag set, expected FCS)"""
+        tx_len = len(tx_frame.tdata)
+        rx_crc_valid = self.rx_crc_valid(rx_frame)
+
+        if tx_len < MIN_FRAME_SIZE:
+            expected_fcs = self.crc_model.fcs(bytes(tx_frame.tdata) + bytes(MIN_FRAME_SIZE - tx_len))
+        else:
+            expected_fcs = self.crc_model.fcs(tx_frame.tdata)
+        fcs_eq = memoryview(rx_frame.tdata)[-4:] == expected_fcs
+
+        return fcs_eq, rx_crc_valid, expected_fcs
+
+    def frame_ref(self):
+        """The frame being checked, by index, and corpus packet index if sent from a corpus"""
+        if self.config['corpus'] and not (self.config['throughput_mode'] or self.config['coverage_directed']):
+            return f"frame {self.n_frames}, corpus packet {self.config['corpus_start'] + self.n_frames}"
+        return f"frame {self.n_frames}"
+
+    def check_frame(self, tx_frame, rx_frame):
+        data_eq = self.frame_data_eq(tx_frame, rx_frame)
+        fcs_eq, rx_crc_valid, expected_fcs = self.frame_fcs(tx_frame, rx_frame)
+
+        if not (data_eq and fcs_eq and rx_crc_valid):
+            self.logger.critical(f"FAILED {self.frame_ref()}")
+
+        if not data_eq:
+            self.logger.critical(f"FAILED (Data Not Equal): {rx_frame}, {tx_frame}")
+            for i, (tx,rx) in enumerate(zip(tx_frame.tdata, rx_frame.tdata)):
+                if tx != rx:
+                    print(f'Index {i}, tx = 0x{tx:02x}, rx = 0x{rx:02x}')
+
+        elif not fcs_eq:
+            self.logger.critical(f"FAILED (FCS Not Equal, expected {expected_fcs.hex()}): {rx_frame}, {tx_frame}")
+        elif not rx_crc_valid:
+            self.logger.critical(f"FAILED (CRC Valid Flag Not Set): {rx_frame}, {tx_frame}")
+        else:
+            self.logger.debug("PASSED: %s, %s", rx_frame, tx_frame)
+
+        assert data_eq and fcs_eq and rx_crc_valid
+
+    def match_frame(self, rx_frame):
+        """Loss tolerant check. The RX frame is matched to the first pending TX frame with the same
+        data, and the TX frames before it were lost. Returns the TX frame, or None if the RX frame
+        matches no TX frame or has a bad FCS or CRC valid flag (corrupted). A TX frame received
+        with a bad FCS or CRC valid flag is errored."""
+        while True:
+            tx_success, tx_frame = self.tx_frame_port.try_get()
+            if not tx_success:
+                break
+            self.tx_pending.append(tx_frame)
+
+        for i, tx_frame in enumerate(self.tx_pending):
+            if self.frame_data_eq(tx_frame, rx_frame):
+                for _ in range(i + 1):
+                    self.tx_pending.popleft()
+                self.n_lost += i
+                fcs_eq, rx_crc_valid, _ = self.frame_fcs(tx_frame, rx_frame)
+                if fcs_eq and rx_crc_valid:
+                    self.logger.debug("PASSED: %s, %s", rx_frame, tx_frame)
+                    return tx_frame
+                self.n_errored += 1
+                break
+
+        self.logger.warning(f"Corrupted frame: {rx_frame}")
+        self.n_corrupted += 1
+        if not self.rx_crc_valid(rx_frame):
+            self.n_crc_errors += 1
+
+        # Bound the TX frames held, the oldest are lost
+        while len(self.tx_pending) > SCOREBOARD_MAX_PENDING:
+            self.tx_pending.popleft()
+            self.n_lost += 1
+
+        return None
+
+    def update_stats(self, tx_frame):
+        frame_len = len(tx_frame.tdata)
+        self.n_frames += 1
+        self.n_bytes += frame_len
+        self.min_frame_len = frame_len if self.min_frame_len is None else min(self.min_frame_len, frame_len)
+        self.max_frame_len = frame_len if self.max_frame_len is None else max(self.max_frame_len, frame_len)
 
+    def check_phase(self):
+        if not self.n_frames: self.logger.critical(f"Didn't recieve any frames")
+        assert self.n_frames
+        if self.bfm.model_capture is not None:
+            self.check_model()
+        if self.config['coverage_directed']:
+            if not self.bfm.coverage.closed(): self.logger.critical(f"Coverage not closed in {self.n_frames} frames")
+            assert self.bfm.coverage.closed()
+
+        # With an external gearbox, the elastic loopback only inserts and deletes pause words, so
+        # without channel errors nothing may be lost
+        channel = self.bfm.loopback_channel
+        if channel is not None and channel.elastic and self.bfm.dut.EXTERNAL_GEARBOX.value and \
+                self.bfm.error_channel is None:
+            lossless = channel.n_dropped == 0 and self.n_lost == 0 and self.n_corrupted == 0
+            if not lossless: self.logger.critical(f"FAILED (Elastic loopback not lossless): {channel.n_dropped} words dropped, "
+                                                  f"{self.n_lost} frames lost, {self.n_corrupted} corrupted")
+            assert lossless
+
+        if self.bfm.error_channel is not None:
+            self.check_errors()
+
+    def check_model(self):
+        """Check MacPcsStreamModel against the DUT - the model's wire words for the captured TX
+        frames, with the same idle words between them and scrambler state, against o_xver_tx_data"""
+        capture = self.bfm.model_capture
+        model_words = predict_wire_words(capture, bool(self.bfm.dut.SCRAMBLER_BYPASS.value))
+        dut_words = np.array(capture['wire'], dtype=np.uint32)
+        n = min(len(model_words), len(dut_words))
+
+        mismatch = np.flatnonzero(model_words[:n] != dut_words[:n])
+        if len(mismatch):
+            i = mismatch[0]
+            self.logger.critical(f"FAILED (Model Wire Word Not Equal): word {i} of {n}, "
+                                 f"dut 0x{dut_words[i]:08x}, model 0x{model_words[i]:08x}")
+        else:
+            self.logger.info(f"Model check: {n} wire words, {len(capture['frames'])} frames equal")
+        assert not len(mismatch) and capture['frames']
+
+    def check_errors(self):
+        """Channel error runs - errors were injected, and the link recovered from every lock drop
+        and received frames after"""
+        n_bit_errors = self.bfm.error_channel.n_bit_errors
+        n_recovered = len(self.bfm.lock_recovery_cycles)
+        if not n_bit_errors: self.logger.critical("FAILED (No channel bit errors injected)")
+        if n_recovered != self.bfm.n_lock_drops:
+            self.logger.critical(f"FAILED (Lock not recovered): {n_recovered} of {self.bfm.n_lock_drops} lock drops")
+        rx_after = not self.bfm.n_lock_drops or self.bfm.n_rx_frames > self.bfm.lock_recovery_rx_frames
+        if not rx_after: self.logger.critical("FAILED (No frames received after lock recovery)")
+        assert n_bit_errors and n_recovered == self.bfm.n_lock_drops and rx_after
+
+    def report_phase(self):
+        if self.n_frames:
+            self.logger.info(f"PASSED {self.n_frames} frames, {self.n_bytes} bytes, "
+                             f"length min {self.min_frame_len} / mean {self.n_bytes / self.n_frames:.1f} / "
+                             f"max {self.max_frame_len}")
+            latency = self.latency.overall()
+            self.logger.info(f"Latency (cycles) min {latency['min']} / mean {latency['mean']} / "
+                             f"p99 {latency['p99']} / max {latency['max']}")
+
+            if self.config['latency_report']:
+                self.latency.to_csv(f"{self.config['latency_report']}.csv")
+                self.latency.to_json(f"{self.config['latency_report']}.json")
+
+        if self.bfm.throughput is not None:
+            for row in self.bfm.throughput.summary():
+                self.logger.info(f"Throughput {row['packet_length']} bytes: {row['goodput_gbps']} Gb/s "
+                                 f"({row['line_rate_pct']}% of line rate, {row['ideal_pct']}% of ideal), "
+                                 f"tready duty {row['tready_duty']}, IFG {row['ifg_min']}-{row['ifg_max']} cycles")
+
+            if self.config['throughput_report']:
+                self.bfm.throughput.to_csv(f"{self.config['throughput_report']}.csv")
+                self.bfm.throughput.to_json(f"{self.config['throughput_report']}.json")
+
+        if self.config['scoreboard_allow_loss']:
+            self.logger.info(f"{self.n_lost} frames lost, {self.n_corrupted} corrupted")
+            if self.n_frames:
+                latency = self.latency.overall()
+                self.logger.info(f"Latency variation {latency['max'] - latency['min']} cycles")
+
+        if self.bfm.error_channel is not None:
+            self.report_errors()
+
+        coverage = self.bfm.coverage
+        if coverage is not None:
+            holes = coverage.holes()
+            self.logger.info(f"Functional coverage {100 * coverage.coverage():.1f}%" +
+                             (f", holes: {' '.join(holes)}" if holes else ", closed"))
+            if self.config['coverage_report']:
+                coverage.to_json(f"{self.config['coverage_report']}.json")
+
+        channel = self.bfm.loopback_channel
+        if channel is not None and channel.elastic:
+            self.logger.info(f"Loopback elastic buffer: {channel.n_inserted} words inserted, "
+                             f"{channel.n_deleted} pause words deleted, {channel.n_dropped} words dropped")
+
+        in_flight = self.tx_frame_fifo.used() + len(self.tx_pending)
+        if in_flight:
+            self.logger.info(f"{in_flight} frames still in flight at the end of the test")
+
+
+    def report_errors(self):
+        """Injected channel errors against their effect, frames lost or failing the CRC check and
+        lock drops"""
+        errors = self.bfm.error_channel.summary()
+        recovery = self.bfm.lock_recovery_cycles
+        n_failed = self.n_lost + self.n_errored
+        n_sent = self.n_frames + n_failed
+        report = {**errors,
+                  'frames' : n_sent,
+                  'frames_lost' : self.n_lost,
+                  'frames_errored' : self.n_errored,
+                  'frames_corrupted' : self.n_corrupted,
+                  'crc_errors' : self.n_crc_errors,
+                  'undetected_errors' : self.n_corrupted - self.n_crc_errors,
+                  'fer' : n_failed / n_sent if n_sent else 0,
+                  'lock_drops' : self.bfm.n_lock_drops,
+                  'lock_recovery_cycles' : recovery}
+
+        self.logger.info(f"Channel: {errors['bit_errors']} bit errors ({errors['header_errors']} sync header) in "
+                         f"{errors['errored_blocks']} of {errors['blocks']} blocks, BER {errors['measured_ber']:.2e}")
+        self.logger.info(f"Channel: {report['crc_errors']} CRC failures, {report['undetected_errors']} undetected, "
+                         f"{self.n_lost} lost and {self.n_errored} errored of {n_sent} frames, FER {report['fer']:.2e}")
+        self.logger.info(f"Channel: {self.bfm.n_lock_drops} lock drops" +
+                         (f", recovery min {min(recovery)} / max {max(recovery)} cycles" if recovery else ""))
+
+        if self.config['error_report']:
+            with open(f"{self.config['error_report']}.json", 'w') as f:
+                json.dump(report, f, indent=2)
 
 
 class EthEnv(uvm_env):
@@ -233,16 +640,33 @@ async def run_MacPcsTest(pytestconfig):
         ({"EXTERNAL_GEARBOX": "0", "SCRAMBLER_BYPASS": "0"}, {"loopback_bit_slip": 2}),
         ({"EXTERNAL_GEARBOX": "0", "SCRAMBLER_BYPASS": "0"}, {"loopback_bit_slip": 3}),
         ({"EXTERNAL_GEARBOX": "1", "SCRAMBLER_BYPASS": "0"}, {"loopback_bit_slip": 0}),
+        ({"EXTERNAL_GEARBOX": "0", "SCRAMBLER_BYPASS": "0"}, {"loopback_bit_slip": 0, "throughput_mode": True, "loopback_synchronous": True}),
+        ({"EXTERNAL_GEARBOX": "0", "SCRAMBLER_BYPASS": "0"}, {"loopback_bit_slip": 0, "coverage": True, "coverage_directed": True, "tx_seq_length": 400, "loopback_synchronous": True}),
+        ({"EXTERNAL_GEARBOX": "1", "SCRAMBLER_BYPASS": "0"}, {"loopback_bit_slip": 0, "coverage": True, "coverage_directed": True, "tx_seq_length": 400, "loopback_synchronous": True}),
+        ({"EXTERNAL_GEARBOX": "0", "SCRAMBLER_BYPASS": "0"}, {"loopback_bit_slip": 3, "corpus": "seed0", "corpus_start": 500}),
+        ({"EXTERNAL_GEARBOX": "0", "SCRAMBLER_BYPASS": "0"}, {"loopback_bit_slip": 0, "model_check": True}),
+        ({"EXTERNAL_GEARBOX": "1", "SCRAMBLER_BYPASS": "0"}, {"loopback_bit_slip": 0, "rx_clk_ppm": 100}),
+        ({"EXTERNAL_GEARBOX": "1", "SCRAMBLER_BYPASS": "0"}, {"loopback_bit_slip": 0, "rx_clk_ppm": -100}),
+        ({"EXTERNAL_GEARBOX": "0", "SCRAMBLER_BYPASS": "0"}, {"loopback_bit_slip": 3, "channel_ber": 1e-5, "channel_burst_rate": 1e-4, "channel_header_error_rate": 1e-3, "scoreboard_allow_loss": True}),
+        ({"EXTERNAL_GEARBOX": "1", "SCRAMBLER_BYPASS": "0"}, {"loopback_bit_slip": 0, "channel_ber": 1e-5, "channel_burst_rate": 1e-4, "channel_header_error_rate": 1e-3, "scoreboard_allow_loss": True}),
         ])
 def test_mac_pcs(parameters, config):
+    run_mac_pcs(parameters, config)
+
+def run_mac_pcs(parameters, config, sim_build=None, module="test_mac_pcs"):
+    """Build and run the mac_pcs test with HDL parameters and config overrides.
+    Each parameter/config combination gets its own sim_build (under the working directory) unless
+    one is given. module selects the cocotb test module, for testbenches built on this one.
+    The simulator is picked with SIM, icarus or verilator (see sim_run.py)."""
 
     test_variables = {**parameters,  **config}
 
-    sim_build = "./sim_build/" + ",".join((f"{key}={str(value)}" for key, value in test_variables.items()))
+    if sim_build is None:
+        sim_build = "./sim_build/" + ",".join((f"{key}={str(value)}" for key, value in test_variables.items()))
 
     os.makedirs(sim_build, exist_ok=True)
 
-    with open('mac_pcs_config.yaml', 'r') as f:
+    with open(os.path.join(TB_DIR, 'mac_pcs_config.yaml'), 'r') as f:
         base_config = yaml.safe_load(f)
 
     base_config.update(config)
@@ -250,26 +674,29 @@ def test_mac_pcs(parameters, config):
     with open(os.path.join(sim_build, "mac_pcs_config.yaml"), 'w') as f:
         yaml.dump(base_config, f)
 
-    copyfile("../../lib/slicing_crc/hdl/crc_tables.mem", os.path.join(sim_build, "crc_tables.mem"))
+    crc_tables = os.path.join(TB_DIR, "../../lib/slicing_crc/hdl/crc_tables.mem")
+
+    # Cross check the tables the HDL will use against the CRC model
+    CrcModel.from_mem_file(crc_tables)
 
     source_tree = [
-        glob.glob('../../hdl/mac_pcs.sv'),
-        glob.glob('../../hdl/mac/*.sv'),
-        glob.glob('../../hdl/pcs/*.sv'),
-        glob.glob('../../lib/slicing_crc/hdl/*.sv')
+        glob.glob(os.path.join(TB_DIR, '../../hdl/mac_pcs.sv')),
+        glob.glob(os.path.join(TB_DIR, '../../hdl/mac/*.sv')),
+        glob.glob(os.path.join(TB_DIR, '../../hdl/pcs/*.sv')),
+        glob.glob(os.path.join(TB_DIR, '../../lib/slicing_crc/hdl/*.sv'))
     ]
 
     sources = [item for sublist in source_tree for item in sublist]
 
-    run(
+    run_cached(
         verilog_sources=sources,
         toplevel="mac_pcs",
 
-        module="test_mac_pcs",
-        simulator="icarus",
-        verilog_compile_args=["-g2012"],
-        includes=["../../hdl/include/"],
+        module=module,
+        includes=[os.path.join(TB_DIR, "../../hdl/include/")],
+        python_search=[TB_DIR],
         parameters=parameters,
         extra_env=parameters,
-        sim_build=sim_build
-    )
\ No newline at end of file
+        sim_build=sim_build,
+        data_files=[crc_tables]
+    )
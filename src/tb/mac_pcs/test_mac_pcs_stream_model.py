@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from mac_pcs_stream_model import MacPcsStreamModel
+
+# Checks of MacPcsStreamModel without a simulator - test_mac_pcs.py model_check compares its TX
+#   wire words with the DUT
+
+MIN_FRAME_SIZE = 60 # excluding FCS
+
+
+@pytest.mark.parametrize("scrambler_bypass", [False, True])
+@pytest.mark.parametrize("gap", [0, 5])
+def test_mac_pcs_stream_model_loopback(scrambler_bypass, gap):
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 256, rng.integers(1, 1519), dtype=np.uint8).tobytes() for _ in range(300)]
+
+    model = MacPcsStreamModel(scrambler_bypass, gap)
+    received = []
+    batches = [frames[i : i + 37] for i in range(0, len(frames), 37)]
+    for words, rx_frames in model.stream(batches):
+        assert words.dtype == np.uint32 and len(words) % 33 == 0
+        received += rx_frames
+
+    assert len(received) == len(frames)
+    for frame, rx_frame in zip(frames, received):
+        padded = frame + bytes(max(0, MIN_FRAME_SIZE - len(frame)))
+        assert rx_frame['tdata'][:-4] == padded
+        assert rx_frame['tuser']
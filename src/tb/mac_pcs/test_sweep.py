@@ -0,0 +1,69 @@
+import os
+import sys
+
+import pytest
+import yaml
+
+import test_mac_pcs
+from sweep import sweep_cases, parse_range, run_case, TB_DIR, LOCK_MARGIN
+
+sys.path.append(os.path.join(TB_DIR, '../pcs'))
+from lock_state_model import lock_sweep
+
+# Checks of sweep.py without a simulator. Running the cases needs one, so a short run,
+#   python sweep.py --bit-slips 0-1, is manual only.
+
+
+def load_config():
+    with open(os.path.join(TB_DIR, 'mac_pcs_config.yaml'), 'r') as f:
+        return yaml.safe_load(f)
+
+
+def test_sweep_cases():
+    cases = sweep_cases()
+    assert len(cases) == 134 # 66 bit slips x 2 scrambler modes, and no bit slip x 2 with the external gearbox
+
+    external = [config for parameters, config in cases if parameters['EXTERNAL_GEARBOX'] == '1']
+    assert sorted(config['loopback_bit_slip'] for config in external) == [0, 0]
+    assert all('startup_pause' not in config for config in external)
+
+    config = load_config()
+    for bypass in ['0', '1']:
+        lock_cycle = lock_sweep([config['loopback_cycle_slip']], range(66), scrambler_bypass=bypass == '1')[0]
+        internal = [config for parameters, config in cases
+                    if parameters == {'EXTERNAL_GEARBOX': '0', 'SCRAMBLER_BYPASS': bypass}]
+        assert [config['loopback_bit_slip'] for config in internal] == list(range(66))
+        for case_config in internal:
+            pause = case_config['startup_pause']
+            assert pause == int(lock_cycle[case_config['loopback_bit_slip']] * LOCK_MARGIN)
+            assert 0 < pause <= config['startup_pause']
+
+
+def test_sweep_cases_config():
+    cases = sweep_cases(parse_range('0-1'), config={'startup_pause': 100, 'tx_seq_length': 20})
+    assert len(cases) == 6
+    assert all(config['startup_pause'] == 100 and config['tx_seq_length'] == 20 for _, config in cases)
+
+
+def test_parse_range():
+    assert parse_range('0-65') == range(66)
+    assert parse_range('3') == range(3, 4)
+
+
+@pytest.mark.parametrize("fail", [False, True])
+def test_run_case_restores_output(fail, monkeypatch, capfd):
+    # A case run in this process logs to its sim_build, then stdout and stderr are put back
+    def run_mac_pcs(parameters, config, sim_build):
+        os.write(1, b'simulator output\n')
+        if fail:
+            raise RuntimeError('failed')
+
+    monkeypatch.setattr(test_mac_pcs, 'run_mac_pcs', run_mac_pcs)
+    monkeypatch.chdir(TB_DIR)
+    result = run_case({'EXTERNAL_GEARBOX': '0'}, {'test_run_case': int(fail)})
+    os.write(1, b'after\n')
+
+    assert result['passed'] != fail
+    with open(os.path.join(TB_DIR, result['log']), 'r') as f:
+        assert f.read() == 'simulator output\n'
+    assert capfd.readouterr().out == 'after\n'
@@ -0,0 +1,73 @@
+import csv
+import json
+
+# TX throughput statistics for the mac_pcs throughput mode
+#
+# Frames are sampled on the TX AXIS interface (MacPcsBfm.tx_throughput_monitor_bfm). Each frame's
+#   period is the cycles from its first beat to the first beat of the next frame, so the last frame
+#   sent has no period and is not counted. Per frame length:
+#   - goodput, frame bytes over the frame periods, vs the 10.3125 Gb/s line rate and the ideal rate
+#     for the length (10 Gb/s after 64b66b, less preamble, FCS, minimum IPG and padding)
+#   - tready duty cycle, the fraction of cycles with tvalid that also had tready
+#   - inter-frame gap, in cycles from a frame's tlast beat to the next frame's first beat
+
+LINE_RATE = 10.3125 # Gb/s
+MAC_RATE = 10.0 # Gb/s, after 64b66b
+MIN_FRAME_SIZE = 60 # excluding FCS
+FRAME_OVERHEAD = 8 + 4 + 12 # preamble, FCS, minimum IPG
+
+REPORT_FIELDS = ['packet_length', 'frames', 'goodput_gbps', 'ideal_gbps', 'line_rate_pct', 'ideal_pct',
+                 'tready_duty', 'stall_cycles', 'ifg_min', 'ifg_mean', 'ifg_max']
+
+
+def ideal_goodput(frame_len):
+    """Best case goodput (Gb/s) of back to back frames of frame_len bytes, excluding FCS"""
+    return MAC_RATE * frame_len / (max(frame_len, MIN_FRAME_SIZE) + FRAME_OVERHEAD)
+
+
+class ThroughputStats:
+    def __init__(self, clk_period):
+        self.clk_period = clk_period # ns
+        self.lengths = {} # frame length -> dict of totals and an IFG histogram
+
+    def add(self, frame_len, period, valid_cycles, ready_cycles, gap):
+        stats = self.lengths.setdefault(frame_len, {'frames' : 0, 'cycles' : 0, 'valid' : 0, 'ready' : 0, 'gaps' : {}})
+        stats['frames'] += 1
+        stats['cycles'] += period
+        stats['valid'] += valid_cycles
+        stats['ready'] += ready_cycles
+        stats['gaps'][gap] = stats['gaps'].get(gap, 0) + 1
+
+    def summary(self):
+        """Rows of REPORT_FIELDS, one per frame length"""
+        rows = []
+        for frame_len in sorted(self.lengths):
+            stats = self.lengths[frame_len]
+            gaps = stats['gaps']
+            goodput = frame_len * 8 * stats['frames'] / (stats['cycles'] * self.clk_period)
+            rows.append({'packet_length' : frame_len,
+                         'frames' : stats['frames'],
+                         'goodput_gbps' : round(goodput, 3),
+                         'ideal_gbps' : round(ideal_goodput(frame_len), 3),
+                         'line_rate_pct' : round(100 * goodput / LINE_RATE, 1),
+                         'ideal_pct' : round(100 * goodput / ideal_goodput(frame_len), 1),
+                         'tready_duty' : round(stats['ready'] / stats['valid'], 4),
+                         'stall_cycles' : stats['valid'] - stats['ready'],
+                         'ifg_min' : min(gaps),
+                         'ifg_mean' : round(sum(k * n for k, n in gaps.items()) / stats['frames'], 2),
+                         'ifg_max' : max(gaps)})
+        return rows
+
+    def to_csv(self, filename):
+        with open(filename, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.summary())
+
+    def to_json(self, filename):
+        with open(filename, 'w') as f:
+            json.dump({'clk_period_ns' : self.clk_period,
+                       'summary' : self.summary(),
+                       'ifg_histograms' : {str(frame_len) : {str(k) : n for k, n in sorted(stats['gaps'].items())}
+                                            for frame_len, stats in sorted(self.lengths.items())}},
+                      f, indent=2)
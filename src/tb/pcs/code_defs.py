@@ -0,0 +1,102 @@
+import numpy as np
+
+# 10G Ethernet code definitions, mirrors hdl/include/code_defs_pkg.svh
+
+# Sync headers
+SYNC_DATA = 0b10
+SYNC_CTL = 0b01
+
+# Block types
+BT_IDLE = 0x1e
+BT_O4   = 0x2d
+BT_S4   = 0x33
+BT_O0S4 = 0x66
+BT_O0O4 = 0x55
+BT_S0   = 0x78
+BT_O0   = 0x4b
+BT_T0   = 0x87
+BT_T1   = 0x99
+BT_T2   = 0xaa
+BT_T3   = 0xb4
+BT_T4   = 0xcc
+BT_T5   = 0xd2
+BT_T6   = 0xe1
+BT_T7   = 0xff
+BT_TERM = [BT_T0, BT_T1, BT_T2, BT_T3, BT_T4, BT_T5, BT_T6, BT_T7]
+
+# Control codes
+CC_IDLE = 0x00
+CC_LPI = 0x06
+CC_ERROR = 0x1e
+CC_RES0 = 0x2d
+CC_RES1 = 0x33
+CC_RES2 = 0x4b
+CC_RES3 = 0x55
+CC_RES4 = 0x66
+CC_RES5 = 0x78
+
+# O-codes
+OC_SEQ = 0x0
+OC_SIG = 0xf
+
+# RS codes
+RS_IDLE = 0x07
+RS_LPI = 0x06
+RS_START = 0xfb
+RS_TERM = 0xfd
+RS_ERROR = 0xfe
+RS_OSEQ = 0x9c
+RS_RES0 = 0x1c
+RS_RES1 = 0x3c
+RS_RES2 = 0x7c
+RS_RES3 = 0xbc
+RS_RES4 = 0xdc
+RS_RES5 = 0xf7
+RS_OSIG = 0x5c
+
+# MAC codes
+MAC_PRE = 0x55
+MAC_SFD = 0xd5
+
+CONTROL_TO_RS = {
+    CC_IDLE : RS_IDLE,
+    CC_LPI : RS_LPI,
+    CC_ERROR : RS_ERROR,
+    CC_RES0 : RS_RES0,
+    CC_RES1 : RS_RES1,
+    CC_RES2 : RS_RES2,
+    CC_RES3 : RS_RES3,
+    CC_RES4 : RS_RES4,
+    CC_RES5 : RS_RES5
+}
+
+def control_to_rs_code(icode):
+    return CONTROL_TO_RS.get(icode, RS_IDLE)
+
+def rs_to_cc_ocode(rs_code):
+    return OC_SEQ if rs_code == RS_OSEQ else OC_SIG
+
+def cc_to_rs_ocode(cc_ocode):
+    return RS_OSEQ if cc_ocode == OC_SEQ else RS_OSIG
+
+
+# XGMII width conversion - 32-bit words are in transmit order, the first word is the lower half
+#   of the 64-bit word (as the PCSTestVector 32 and 64-bit vectors)
+
+def xgmii_to_64(ctl, data):
+    """Combine 32-bit XGMII (ctl, data) arrays into 64-bit, an odd trailing word is dropped"""
+    ctl = np.asarray(ctl, dtype=np.uint8)
+    data = np.asarray(data, dtype=np.uint64)
+    n = len(data) // 2 * 2
+    return ((ctl[0:n:2] & 0xf) | (ctl[1:n:2] << 4)).astype(np.uint8), \
+            (data[0:n:2] & np.uint64(0xffffffff)) | (data[1:n:2] << np.uint64(32))
+
+def xgmii_to_32(ctl, data):
+    """Split 64-bit XGMII (ctl, data) arrays into 32-bit"""
+    ctl = np.asarray(ctl, dtype=np.uint8)
+    data = np.asarray(data, dtype=np.uint64)
+    ctl32 = np.empty(2 * len(ctl), dtype=np.uint8)
+    data32 = np.empty(2 * len(data), dtype=np.uint64)
+    ctl32[0::2], ctl32[1::2] = ctl & 0xf, ctl >> 4
+    data32[0::2], data32[1::2] = data & np.uint64(0xffffffff), data >> np.uint64(32)
+    return ctl32, data32
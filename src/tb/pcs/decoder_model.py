@@ -0,0 +1,131 @@
+import numpy as np
+
+from code_defs import *
+
+# 64b66b to XGMII decoder reference model, mirrors decoder.sv
+#
+# Control blocks are decoded with a table indexed on the block type, giving for each type:
+#   odata = (rs_lanes & rs_mask) | (idata & keep) | ((idata >> 8) & shift_mask) | const
+#           | ocode(idata[35:32]) in the lo ocode lane | ocode(idata[39:36]) in the hi ocode lane
+# where rs_lanes are the control codes converted to RS codes in every lane.
+
+_CC_TO_RS = np.full(128, RS_IDLE, dtype=np.uint64)
+for _cc, _rs in CONTROL_TO_RS.items():
+    _CC_TO_RS[_cc] = _rs
+
+MASK_64 = (1 << 64) - 1
+_HI_24 = 0xffffff << 40
+ERROR_WORD = int(''.join([f'{RS_ERROR:02x}'] * 8), 16)
+
+def _lanes_mask(lanes):
+    # control_code_to_rs_lane lane select, lanes[7-i] selects xgmii lane i
+    return sum(0xff << (8 * i) for i in range(8) if (lanes >> (7 - i)) & 1)
+
+def _lane(lane):
+    return 0xff << (8 * lane)
+
+def _make_table():
+    # rs_mask, keep, shift_mask, const, ocode lo lane, ocode hi lane, ctl, valid
+    table = {bt : (0, 0, 0, ERROR_WORD, None, None, 0xff, 0) for bt in range(256)}
+
+    def control_lanes(lanes):
+        # Lanes not taking a control code are RS_ERROR
+        return _lanes_mask(lanes), ERROR_WORD & ~_lanes_mask(lanes)
+
+    rs_mask, const = control_lanes(0xff)
+    table[BT_IDLE] = (rs_mask, 0, 0, const, None, None, 0xff, 1)
+
+    rs_mask, const = control_lanes(0xf0)
+    table[BT_O4] = (rs_mask, _HI_24, 0, 0, None, 4, 0x1f, 1)
+    table[BT_S4] = (rs_mask, _HI_24, 0, RS_START << 32, None, None, 0x1f, 1)
+
+    table[BT_O0S4] = (0, _HI_24 | 0xffffff00, 0, RS_START << 32, 0, None, 0x11, 1)
+    table[BT_O0O4] = (0, _HI_24 | 0xffffff00, 0, 0, 4, 0, 0x11, 1)
+    table[BT_S0] = (0, MASK_64 ^ 0xff, 0, RS_START, None, None, 0x01, 1)
+
+    rs_mask, const = control_lanes(0x0f)
+    table[BT_O0] = (rs_mask, 0xffffff00, 0, 0, 0, None, 0xf1, 1)
+
+    # T0 - T7
+    for lane, bt in enumerate(BT_TERM):
+        rs_mask, const = control_lanes(0xff >> (lane + 1))
+        shift_mask = (1 << (8 * lane)) - 1
+        ctl = (0xff << lane) & 0xff
+        table[bt] = (rs_mask, 0, shift_mask, (const & ~shift_mask & ~_lane(lane)) | (RS_TERM << (8 * lane)),
+                        None, None, ctl, 1)
+
+    return table
+
+DECODE_TABLE = _make_table()
+
+# As arrays for gathering on block type
+def _table_column(i, f=lambda x: x, dtype=np.uint64):
+    return np.array([f(DECODE_TABLE[bt][i]) for bt in range(256)], dtype=dtype)
+
+_RS_MASK, _KEEP, _SHIFT_MASK, _CONST = (_table_column(i) for i in range(4))
+_OCODE_LO_SHIFT = _table_column(4, lambda lane: 8 * (lane or 0))
+_OCODE_LO_MASK = _table_column(4, lambda lane: 0 if lane is None else _lane(lane))
+_OCODE_HI_SHIFT = _table_column(5, lambda lane: 8 * (lane or 0))
+_OCODE_HI_MASK = _table_column(5, lambda lane: 0 if lane is None else _lane(lane))
+_CTL = _table_column(6, dtype=np.uint8)
+_VALID = _table_column(7, dtype=bool)
+
+
+def _cc_to_rs_ocode(nibble):
+    return np.where(nibble == OC_SEQ, np.uint64(RS_OSEQ), np.uint64(RS_OSIG))
+
+
+class DecoderModel:
+
+    def decode(self, header, data, data_width=64):
+        """Decode 64b66b (header, data) block arrays, returns XGMII (ctl, data, valid) arrays.
+
+        valid is the decoder frame_valid - cleared for blocks with an unknown block type.
+        With data_width 32 the XGMII output is split into words, valid per block.
+        """
+        header = np.asarray(header, dtype=np.uint8)
+        data = np.asarray(data, dtype=np.uint64)
+
+        # Data blocks pass straight through, only control blocks need decoding
+        odata = data.copy()
+        octl = np.zeros(len(data), dtype=np.uint8)
+        valid = np.ones(len(data), dtype=bool)
+        ctl_idxs = np.flatnonzero(header != SYNC_DATA)
+
+        if len(ctl_idxs):
+            odata[ctl_idxs], octl[ctl_idxs], valid[ctl_idxs] = self._decode_control(data[ctl_idxs])
+
+        if data_width == 32:
+            octl, odata = xgmii_to_32(octl, odata)
+
+        return octl, odata, valid
+
+    def stream(self, batches, data_width=32):
+        """Generator - decode batches of (header, data) block arrays, yields batches of XGMII (ctl, data)"""
+        for header, data in batches:
+            ctl, data, _ = self.decode(header, data, data_width)
+            yield ctl, data
+
+    @staticmethod
+    def _decode_control(data):
+        bt = (data & np.uint64(0xff)).astype(np.uint8)
+
+        rs_lanes = np.zeros(len(data), dtype=np.uint64)
+        for lane in range(8):
+            cc = ((data >> np.uint64(8 + 7 * lane)) & np.uint64(0x7f)).astype(np.uint8)
+            rs_lanes |= _CC_TO_RS[cc] << np.uint64(8 * lane)
+
+        ocode_lo = _cc_to_rs_ocode((data >> np.uint64(32)) & np.uint64(0xf))
+        ocode_hi = _cc_to_rs_ocode((data >> np.uint64(36)) & np.uint64(0xf))
+
+        odata = (rs_lanes & _RS_MASK[bt]) | (data & _KEEP[bt]) | ((data >> np.uint64(8)) & _SHIFT_MASK[bt]) | _CONST[bt] \
+                | ((ocode_lo << _OCODE_LO_SHIFT[bt]) & _OCODE_LO_MASK[bt]) \
+                | ((ocode_hi << _OCODE_HI_SHIFT[bt]) & _OCODE_HI_MASK[bt])
+
+        return odata, _CTL[bt], _VALID[bt]
+
+    def decode_frames(self, blocks, data_width=64):
+        """Decode a list of (header, data) tuples, returns a list of XGMII (ctl, data) tuples as PCSTestVector"""
+        header, data = zip(*blocks) if len(blocks) else ((), ())
+        octl, odata, _ = self.decode(np.array(header, dtype=np.uint8), np.array(data, dtype=np.uint64), data_width)
+        return list(zip(octl.tolist(), odata.tolist()))
@@ -0,0 +1,127 @@
+import numpy as np
+
+from code_defs import *
+
+# XGMII to 64b66b encoder reference model, mirrors encoder.sv (Ref 802.3 49.2.4.4)
+#
+# Each XGMII word is reduced to a key of its lane classes (data or which RS code). The encoder
+# priority chain only depends on the key, so it is evaluated once per distinct key and cached
+# as an output rule:
+#   odata = (idata & keep) | ((idata & shift_mask) << 8) | const
+
+# Lane classes, 3 bits per lane in the key
+LC_DATA, LC_IDLE, LC_START, LC_TERM, LC_OSEQ, LC_OSIG, LC_OTHER = range(7)
+
+_RS_LANE_CLASS = np.full(256, LC_OTHER, dtype=np.uint32)
+_RS_LANE_CLASS[RS_IDLE] = LC_IDLE
+_RS_LANE_CLASS[RS_START] = LC_START
+_RS_LANE_CLASS[RS_TERM] = LC_TERM
+_RS_LANE_CLASS[RS_OSEQ] = LC_OSEQ
+_RS_LANE_CLASS[RS_OSIG] = LC_OSIG
+
+_LC_OCODE = {LC_OSEQ : OC_SEQ, LC_OSIG : OC_SIG}
+
+MASK_64 = (1 << 64) - 1
+_HI_24 = 0xffffff << 40
+
+ERROR_BLOCK = (int(''.join([f'{RS_ERROR:02x}'] * 7), 16) << 8) | BT_IDLE
+
+
+def lane_keys(data, ctl):
+    """Lane class key of each 64-bit XGMII word"""
+    keys = np.zeros(len(data), dtype=np.uint32)
+    for lane in range(8):
+        rs_code = ((data >> np.uint64(8 * lane)) & np.uint64(0xff)).astype(np.uint8)
+        lane_class = np.where((ctl >> lane) & 1 == 1, _RS_LANE_CLASS[rs_code], LC_DATA)
+        keys |= lane_class.astype(np.uint32) << np.uint32(3 * lane)
+    return keys
+
+
+class EncoderModel:
+    def __init__(self, ocode_support=False):
+        self.ocode_support = ocode_support
+        self.rules = {} # lane key -> (keep, shift_mask, const, header)
+
+    def get_rule(self, key):
+        if key not in self.rules:
+            self.rules[key] = self._make_rule([(key >> (3 * lane)) & 0x7 for lane in range(8)])
+        return self.rules[key]
+
+    def _make_rule(self, lanes):
+        # Follows the encode_frame priority chain, a data lane never matches an RS code
+        is_ocode = lambda lane: lanes[lane] in _LC_OCODE
+        all_lanes = lambda lane_idxs, lc: all(lanes[i] == lc for i in lane_idxs)
+
+        if all_lanes(range(8), LC_DATA):
+            return (MASK_64, 0, 0, SYNC_DATA)
+
+        # All Control (IDLE) = CCCCCCCC
+        if all_lanes(range(8), LC_IDLE):
+            return (0, 0, BT_IDLE, SYNC_CTL)
+        # O4 = CCCCODDD
+        if self.ocode_support and is_ocode(4) and all_lanes(range(3), LC_DATA):
+            return (_HI_24, 0, (_LC_OCODE[lanes[4]] << 36) | BT_O4, SYNC_CTL)
+        # S4 = CCCCSDDD
+        if all_lanes(range(4), LC_IDLE) and lanes[4] == LC_START and all_lanes(range(5, 8), LC_DATA):
+            return (_HI_24, 0, BT_S4, SYNC_CTL)
+        # O0S4 = ODDDSDDD
+        if self.ocode_support and is_ocode(0) and lanes[4] == LC_START:
+            return (_HI_24, 0xffffff, (_LC_OCODE[lanes[0]] << 32) | BT_O0S4, SYNC_CTL)
+        # O0O4 = ODDDODDD
+        if self.ocode_support and is_ocode(0) and is_ocode(4):
+            return (_HI_24, 0xffffff, (_LC_OCODE[lanes[4]] << 36) | (_LC_OCODE[lanes[0]] << 32) | BT_O0O4, SYNC_CTL)
+        # S0 = SDDDDDDD
+        if lanes[0] == LC_START:
+            return (MASK_64 ^ 0xff, 0, BT_S0, SYNC_CTL)
+        # O0 = ODDDCCCC
+        if self.ocode_support and is_ocode(4):
+            return ((0xfffffff << 36) | 0xffffff00, 0, (_LC_OCODE[lanes[4]] << 32) | BT_O0, SYNC_CTL)
+        # Tn = D..DTC..C
+        for lane in range(8):
+            if lanes[lane] == LC_TERM:
+                return (0, (1 << (8 * lane)) - 1, BT_TERM[lane], SYNC_CTL)
+
+        return (0, 0, ERROR_BLOCK, SYNC_CTL)
+
+    def encode(self, data, ctl, data_width=64):
+        """Encode XGMII data and ctl arrays, returns (header, data) arrays of 64b66b blocks"""
+        if data_width == 32:
+            ctl, data = xgmii_to_64(ctl, data)
+
+        data = np.asarray(data, dtype=np.uint64)
+        ctl = np.asarray(ctl, dtype=np.uint8)
+
+        # All data words pass straight through, only words with control lanes need a rule
+        header = np.full(len(data), SYNC_DATA, dtype=np.uint8)
+        odata = data.copy()
+        ctl_idxs = np.flatnonzero(ctl)
+
+        if len(ctl_idxs):
+            ctl_data = data[ctl_idxs]
+            keys, key_idxs = np.unique(lane_keys(ctl_data, ctl[ctl_idxs]), return_inverse=True)
+            rules = np.array([self.get_rule(int(key)) for key in keys], dtype=np.uint64).reshape(-1, 4)
+            keep, shift_mask, const, ctl_header = (rules[key_idxs.reshape(-1), i] for i in range(4))
+
+            odata[ctl_idxs] = (ctl_data & keep) | ((ctl_data & shift_mask) << np.uint64(8)) | const
+            header[ctl_idxs] = ctl_header
+
+        return header, odata
+
+    def stream(self, batches, data_width=32):
+        """Generator - encode batches of XGMII (ctl, data) arrays, yields batches of (header, data) blocks.
+        With data_width 32, an odd trailing word is carried into the next batch."""
+        carry_ctl, carry_data = np.zeros(0, dtype=np.uint8), np.zeros(0, dtype=np.uint64)
+        for ctl, data in batches:
+            if data_width == 32:
+                ctl = np.concatenate([carry_ctl, np.asarray(ctl, dtype=np.uint8)])
+                data = np.concatenate([carry_data, np.asarray(data, dtype=np.uint64)])
+                n = len(data) // 2 * 2
+                carry_ctl, carry_data = ctl[n:], data[n:]
+                ctl, data = ctl[:n], data[:n]
+            yield self.encode(data, ctl, data_width)
+
+    def encode_frames(self, frames, data_width=64):
+        """Encode a list of XGMII (ctl, data) tuples as PCSTestVector"""
+        ctl, data = zip(*frames) if len(frames) else ((), ())
+        header, odata = self.encode(np.array(data, dtype=np.uint64), np.array(ctl, dtype=np.uint8), data_width)
+        return list(zip(header.tolist(), odata.tolist()))
@@ -0,0 +1,187 @@
+import numpy as np
+
+# Bit error channel for the loopback (loopback.py), random bit errors, bursts and sync header errors
+#
+# Errors are generated in batches of 66b blocks with numpy, as bit positions in the serial stream:
+#   - random bit errors at a bit error rate, ber
+#   - bursts of burst_length bits at burst_rate per block, the first and last bit in error and those
+#     between each in error with probability 1/2
+#   - sync header errors at header_error_rate per block, one of the two header bits flipped (an
+#     invalid header, as counted by lock_state)
+#   Bits in error more than once are flipped back. Bursts are cut at the end of a batch.
+#
+# The positions are then mapped to units, the words the loopback captures, and an XOR mask for the
+#   data and header of each errored unit:
+#   - internal gearbox, the units are the TX gearbox output words. Each sequence of 33 words carries
+#     16 blocks, headers included, and unit 0 is the first word of a sequence.
+#   - external gearbox, the units are the valid (not paused) words, 64 / data_width per block. The
+#     header of a block is on its first word, which is unit 0 of the first block.
+#   The loopback calls apply once per unit, so a clean unit costs a count and a compare.
+#
+# Errored blocks are those with at least one bit in error. The counts are of errors applied so far.
+
+BLOCK_BITS = 66
+HEADER_BITS = 2
+
+
+class ErrorChannel:
+    def __init__(self, data_width=32, external_gearbox=True, ber=0, burst_rate=0, burst_length=8,
+                    header_error_rate=0, seed=None, batch_blocks=4096):
+        self.data_width = data_width
+        self.external_gearbox = external_gearbox
+        self.ber = ber
+        self.burst_rate = burst_rate
+        self.burst_length = burst_length
+        self.header_error_rate = header_error_rate
+        self.rng = np.random.default_rng(seed)
+
+        # Batches are a whole number of internal gearbox sequences, so start on a word
+        self.batch_blocks = batch_blocks
+        assert (batch_blocks * BLOCK_BITS) % data_width == 0
+        self.batch_start = 0 # block
+
+        self.started = False
+        self.start_unit = 0
+        self.unit = -1 # last unit applied
+
+        # Errored units of the current batch, as lists for indexing one at a time
+        self.units = []
+        self.data_masks = []
+        self.header_masks = []
+        self.unit_bits = []
+        self.unit_header_bits = []
+        self.unit_blocks = []
+        self.index = 0
+        self.next_unit = -1
+
+        self.n_bit_errors = 0
+        self.n_header_errors = 0
+        self.n_errored_units = 0
+        self.n_errored_blocks = 0
+
+    def enabled(self):
+        return bool(self.ber or self.burst_rate or self.header_error_rate)
+
+    def error_positions(self, n_blocks):
+        """Sorted bit positions in error in the next n_blocks blocks, from the start of the first"""
+        n_bits = n_blocks * BLOCK_BITS
+        positions = []
+
+        if self.ber:
+            positions.append(self.rng.integers(0, n_bits, self.rng.binomial(n_bits, self.ber)))
+
+        if self.burst_rate:
+            starts = self.rng.integers(0, n_bits, self.rng.binomial(n_blocks, self.burst_rate))
+            bits = starts[:, np.newaxis] + np.arange(self.burst_length)
+            flip = self.rng.random(bits.shape) < 0.5
+            flip[:, [0, -1]] = True
+            positions.append(bits[flip & (bits < n_bits)])
+
+        if self.header_error_rate:
+            blocks = self.rng.integers(0, n_blocks, self.rng.binomial(n_blocks, self.header_error_rate))
+            positions.append(blocks * BLOCK_BITS + self.rng.integers(0, HEADER_BITS, len(blocks)))
+
+        if not positions:
+            return np.zeros(0, dtype=np.int64)
+
+        # A bit flipped an even number of times is not in error
+        positions, counts = np.unique(np.concatenate(positions), return_counts=True)
+        return positions[counts % 2 == 1]
+
+    def next_batch(self):
+        """Error positions of the next batch of blocks as errored units and their masks"""
+        positions = self.error_positions(self.batch_blocks)
+        block = positions // BLOCK_BITS
+        offset = positions % BLOCK_BITS
+        header_bit = offset < HEADER_BITS
+
+        if self.external_gearbox:
+            words_per_block = 64 // self.data_width
+            data_offset = np.maximum(offset - HEADER_BITS, 0)
+            unit = (self.batch_start + block) * words_per_block + data_offset // self.data_width
+            data_mask = np.where(header_bit, 0, np.left_shift(1, data_offset % self.data_width))
+            header_mask = np.where(header_bit, np.left_shift(1, offset), 0)
+        else:
+            stream_bit = self.batch_start * BLOCK_BITS + positions
+            unit = stream_bit // self.data_width
+            data_mask = np.left_shift(1, stream_bit % self.data_width)
+            header_mask = np.zeros_like(data_mask)
+
+        self.batch_start += self.batch_blocks
+        self.index = 0
+
+        if not len(positions):
+            self.units = []
+            return
+
+        # Reduce to one entry per unit, positions are sorted so units are too
+        first = np.flatnonzero(np.r_[True, unit[1:] != unit[:-1]])
+        new_block = np.r_[True, block[1:] != block[:-1]]
+        self.units = unit[first].tolist()
+        self.data_masks = np.bitwise_or.reduceat(data_mask, first).tolist()
+        self.header_masks = np.bitwise_or.reduceat(header_mask, first).tolist()
+        self.unit_bits = np.diff(np.r_[first, len(unit)]).tolist()
+        self.unit_header_bits = np.add.reduceat(header_bit.astype(np.int64), first).tolist()
+        self.unit_blocks = np.add.reduceat(new_block.astype(np.int64), first).tolist()
+
+    def advance(self):
+        """Move to the next errored unit after the last applied, generating batches as needed"""
+        if not self.enabled():
+            self.next_unit = -1
+            return
+        while True:
+            while self.index < len(self.units):
+                if self.units[self.index] > self.unit:
+                    self.next_unit = self.units[self.index]
+                    return
+                self.index += 1
+            self.next_batch()
+
+    def start(self, unit):
+        """Align the stream, the next unit applied is unit"""
+        self.started = True
+        self.start_unit = unit
+        self.unit = unit - 1
+        self.advance()
+
+    def apply(self, header, data):
+        """Errors for the next unit, header and data XOR their masks if it is errored"""
+        self.unit += 1
+        if self.unit != self.next_unit:
+            return header, data
+
+        i = self.index
+        if self.data_masks[i]:
+            data = int(data) ^ self.data_masks[i]
+        if self.header_masks[i]:
+            header = int(header) ^ self.header_masks[i]
+
+        self.n_bit_errors += self.unit_bits[i]
+        self.n_header_errors += self.unit_header_bits[i]
+        self.n_errored_units += 1
+        self.n_errored_blocks += self.unit_blocks[i]
+
+        self.index += 1
+        self.advance()
+        return header, data
+
+    def n_units(self):
+        return self.unit + 1 - self.start_unit if self.started else 0
+
+    def n_blocks(self):
+        """Blocks sent through the channel since it started"""
+        if self.external_gearbox:
+            return self.n_units() * self.data_width // 64
+        return self.n_units() * self.data_width // BLOCK_BITS
+
+    def summary(self):
+        n_bits = self.n_blocks() * BLOCK_BITS
+        return {'ber' : self.ber,
+                'burst_rate' : self.burst_rate,
+                'burst_length' : self.burst_length,
+                'header_error_rate' : self.header_error_rate,
+                'blocks' : self.n_blocks(),
+                'bit_errors' : self.n_bit_errors,
+                'header_errors' : self.n_header_errors,
+                'errored_blocks' : self.n_errored_blocks,
+                'measured_ber' : self.n_bit_errors / n_bits if n_bits else 0}
@@ -0,0 +1,196 @@
+import os
+import sys
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../gearbox'))
+
+from code_defs import *
+from gearbox_model import RX_LOAD_MASKS, blocks_to_words
+from scrambler_model import ScramblerModel
+from encoder_model import EncoderModel
+from stream import bit_slip
+
+# Block lock reference model, the internal rx_gearbox and lock_state.sv as connected in pcs.sv
+#
+# Many lanes are run together, one per loopback delay, each a copy of the RX gearbox (as
+#   RxGearboxModel 'packed') and the lock state machine. As the HDL:
+#   - rx_gearbox has REGISTER_OUTPUT, so lock_state sees the header a cycle after the gearbox
+#   - o_slip (state == SLIP) drives the gearbox slip directly
+#   - state transitions do not wait for i_valid (only the header counters do), so headers on
+#     cycles without a valid header are also tested
+#
+# The time to lock is the first cycle lock_state is in GOOD_64.
+
+LOCK_INIT, RESET_CNT, TEST_SH, VALID_SH, INVALID_SH, GOOD_64, SLIP = range(7)
+
+RX_SEQ_LENGTH = 33
+
+_U64 = np.uint64
+_LO_64 = (1 << 64) - 1
+
+# The gearbox state is held as a phase, count * 2 + half_slip, with tables per phase
+
+def _rx_phase_table():
+    # RX_LOAD_MASKS per phase as rows of a uint64 table, with the 67-bit masks split into the low 64
+    # and high 3 bits: keep lo, keep hi, lo shift, lo mask, hi shift, hi mask, right shift, right mask,
+    # then the header shift (half slip) and header valid as RxGearboxModel.next
+    table = []
+    for count, (load_mask, lshift, lmask, rshift, rmask) in enumerate(RX_LOAD_MASKS):
+        for half_slip in range(2):
+            header_valid = count % 2 == 1 if not half_slip else (count % 2 == 1 or count == 32) and count != 31
+            table.append([~load_mask & _LO_64, ~(load_mask >> 64) & 0x7,
+                            min(lshift, 63), lmask & _LO_64, # lo mask is empty for a shift of 64
+                            min(64 - lshift, 63), lmask >> 64, # hi mask is empty for a shift of 0
+                            rshift, rmask, half_slip, header_valid])
+    return np.array(table, dtype=np.uint64).T.copy()
+
+_RX_PHASE_TABLE = _rx_phase_table()
+
+# Next phase, indexed on slip * 66 + phase - a slip holds the count and toggles half slip
+_NEXT_PHASE = np.array([((phase // 2 + 1) % RX_SEQ_LENGTH) * 2 + phase % 2 for phase in range(2 * RX_SEQ_LENGTH)] +
+                        [phase ^ 1 for phase in range(2 * RX_SEQ_LENGTH)], dtype=np.int64)
+
+# sh_invalid_cnt class: 0 = zero, 1 = 1 to 15, 2 = 16, 3 = over 16
+_INVALID_CLASS = np.array([0] + [1] * 15 + [2, 3], dtype=np.int64)
+_SH_VALID = np.array([0, 1, 1, 0], dtype=np.int64)
+
+def _next_state_table():
+    # Next state, indexed on state * 16 + (sh_cnt == 64) * 8 + invalid class * 2 + sh_valid, as lock_state.sv
+    table = np.zeros((7, 2, 4, 2), dtype=np.int64)
+    for state in range(7):
+        for cnt_64 in range(2):
+            for invalid_class in range(4):
+                for sh_valid in range(2):
+                    no_invalid, lt_16, eq_16 = invalid_class == 0, invalid_class < 2, invalid_class == 2
+                    if state in [LOCK_INIT, GOOD_64, SLIP]:
+                        next_state = RESET_CNT
+                    elif state == RESET_CNT:
+                        next_state = TEST_SH
+                    elif state == TEST_SH:
+                        next_state = VALID_SH if sh_valid else INVALID_SH
+                    elif state == VALID_SH and cnt_64:
+                        next_state = GOOD_64 if no_invalid else RESET_CNT
+                    elif state == INVALID_SH and cnt_64 and lt_16:
+                        next_state = RESET_CNT
+                    elif state == INVALID_SH and eq_16:
+                        next_state = SLIP
+                    else:
+                        next_state = INVALID_SH if not cnt_64 and not sh_valid else VALID_SH
+                    table[state, cnt_64, invalid_class, sh_valid] = next_state
+    return table.reshape(-1)
+
+_NEXT_STATE = _next_state_table()
+
+# Per state: counters kept (not RESET_CNT), header counted, invalid header counted, slip
+_KEEP_COUNT = np.array([state != RESET_CNT for state in range(7)], dtype=np.int64)
+_COUNT_SH = np.array([state in [VALID_SH, INVALID_SH] for state in range(7)], dtype=np.int64)
+_COUNT_INVALID_SH = np.array([state == INVALID_SH for state in range(7)], dtype=np.int64)
+_SLIP = np.array([state == SLIP for state in range(7)], dtype=np.int64)
+
+
+class LockStateModel:
+    def __init__(self, n_lanes):
+        self.n_lanes = n_lanes
+        self.cycle = 0
+
+        # Gearbox
+        self.phase = np.zeros(n_lanes, dtype=np.int64) # count * 2 + half_slip
+        self.obuf_lo = np.zeros(n_lanes, dtype=np.uint64) # buffer bits 0-63
+        self.obuf_hi = np.zeros(n_lanes, dtype=np.uint64) # buffer bits 64-66
+
+        # Gearbox registered output
+        self.header = np.zeros(n_lanes, dtype=np.int64)
+        self.header_valid = np.zeros(n_lanes, dtype=np.int64)
+
+        # Lock state machine
+        self.state = np.full(n_lanes, LOCK_INIT, dtype=np.int64)
+        self.sh_cnt = np.zeros(n_lanes, dtype=np.int64)
+        self.sh_invalid_cnt = np.zeros(n_lanes, dtype=np.int64)
+
+        self.n_slips = np.zeros(n_lanes, dtype=np.int64)
+        self.lock_cycle = np.full(n_lanes, -1, dtype=np.int64)
+
+    @property
+    def count(self):
+        return self.phase // 2
+
+    @property
+    def half_slip(self):
+        return self.phase % 2
+
+    def next(self, idata):
+        """Run one cycle with an array of 32-bit input words, one per lane"""
+        idata = np.asarray(idata, dtype=np.uint64)
+        state = self.state
+        slip = _SLIP[state]
+
+        # Gearbox buffer load, as RxGearboxModel._next_packed
+        keep_lo, keep_hi, lshift_lo, lmask_lo, lshift_hi, lmask_hi, rshift, rmask, header_shift, header_valid = \
+            _RX_PHASE_TABLE[:, self.phase]
+        lo = (self.obuf_lo & keep_lo) | ((idata << lshift_lo) & lmask_lo) | ((idata >> rshift) & rmask)
+        hi = (self.obuf_hi & keep_hi) | ((idata >> lshift_hi) & lmask_hi)
+        self.obuf_lo, self.obuf_hi = lo, (hi & _U64(0x3)) | ((lo & _U64(1)) << _U64(2))
+        self.phase = _NEXT_PHASE[slip * (2 * RX_SEQ_LENGTH) + self.phase]
+
+        # Lock state machine on the registered gearbox output
+        self.state = _NEXT_STATE[state * 16 + (self.sh_cnt == 64) * 8 + _INVALID_CLASS[np.minimum(self.sh_invalid_cnt, 17)] * 2
+                                    + _SH_VALID[self.header]]
+        keep_count = _KEEP_COUNT[state]
+        self.sh_cnt = (self.sh_cnt + (_COUNT_SH[state] & self.header_valid)) * keep_count
+        self.sh_invalid_cnt = (self.sh_invalid_cnt + (_COUNT_INVALID_SH[state] & self.header_valid)) * keep_count
+        self.lock_cycle[(self.lock_cycle < 0) & (self.state == GOOD_64)] = self.cycle + 1
+
+        self.header = ((lo >> header_shift) & _U64(0x3)).astype(np.int64)
+        self.header_valid = header_valid.astype(np.int64)
+        self.n_slips += slip
+        self.cycle += 1
+
+    def run(self, lane_words, max_cycles=None):
+        """Run with an n_lanes x N array of input words until every lane has locked, or max_cycles.
+        Returns the lock cycle of each lane, -1 if not locked."""
+        n_cycles = lane_words.shape[1] if max_cycles is None else min(max_cycles, lane_words.shape[1])
+        cycle_words = np.ascontiguousarray(np.asarray(lane_words, dtype=np.uint64)[:, :n_cycles].T)
+        for cycle in range(n_cycles):
+            self.next(cycle_words[cycle])
+            if cycle % 64 == 0 and np.all(self.lock_cycle >= 0):
+                break
+        return self.lock_cycle
+
+
+def idle_stream(n_words, scrambler_bypass=False):
+    """TX gearbox output words for a link sending idles from reset"""
+    n_blocks = -(-n_words * 32 // 66 // 16) * 16 + 16
+    ctl = np.full(n_blocks, 0xff, dtype=np.uint8)
+    data = np.full(n_blocks, int.from_bytes(bytes([RS_IDLE] * 8), 'little'), dtype=np.uint64)
+    header, data = EncoderModel().encode(data, ctl)
+    if not scrambler_bypass:
+        data = ScramblerModel().next(data)
+    return blocks_to_words(header, data)[:n_words]
+
+
+def lock_sweep(cycle_slips=range(1), bit_slips=range(66), n_cycles=20000, scrambler_bypass=False):
+    """Cycles to block lock for every loopback cycle and bit slip (as MacPcsBfm.loopback), from reset
+    with idles. Returns a len(cycle_slips) x len(bit_slips) array, -1 where there was no lock."""
+    delays = [32 * cycle_slip + bit_slip for cycle_slip in cycle_slips for bit_slip in bit_slips]
+    words = idle_stream(n_cycles, scrambler_bypass)
+    lane_words = np.stack([next(bit_slip(delay)([words])) for delay in delays])
+
+    lock_cycle = LockStateModel(len(delays)).run(lane_words)
+    return lock_cycle.reshape(len(cycle_slips), len(bit_slips))
+
+
+def startup_pause(margin=1.25, **kwargs):
+    """A startup_pause for the mac_pcs test that covers the worst case lock time of the sweep"""
+    lock_cycle = lock_sweep(**kwargs)
+    if np.any(lock_cycle < 0):
+        raise ValueError('No block lock for some slips, increase n_cycles')
+    return int(np.ceil(lock_cycle.max() * margin))
+
+
+if __name__ == '__main__':
+    lock_cycle = lock_sweep(cycle_slips=range(RX_SEQ_LENGTH))
+    worst = np.unravel_index(np.argmax(lock_cycle), lock_cycle.shape)
+    print(f'Cycles to lock, over {lock_cycle.size} cycle/bit slips:')
+    print(f'  min {lock_cycle.min()}, mean {lock_cycle.mean():.0f}, max {lock_cycle.max()}')
+    print(f'  worst case cycle slip {worst[0]}, bit slip {worst[1]}')
+    print(f'startup_pause: {int(np.ceil(lock_cycle.max() * 1.25))}')
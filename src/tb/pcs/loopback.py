@@ -0,0 +1,201 @@
+import random
+
+import cocotb
+from cocotb.triggers import RisingEdge, Event, Timer
+
+# Serial loopback for the PCS and MAC/PCS testbenches - o_xver_tx_* to i_xver_rx_* of the DUT
+#
+# Captured TX words are passed to the RX through a fixed size ring buffer, preloaded with
+#   cycle_delay idle entries. Handles are looked up once, at construction. Two modes:
+#   - asynchronous: a coroutine on each transceiver clock, capture reads the TX outputs and apply
+#     drives the RX inputs. For TX and RX clocks that differ.
+#   - synchronous: one coroutine on the TX clock does both, for TX and RX clocks of the same period
+#     and phase. Half the scheduler wakeups, with the same result - either way the RX word at edge
+#     k is the TX word of edge k - cycle_delay.
+#
+# With an external gearbox, the header and valid signals are looped back as well; otherwise they are
+#   held at zero and the data can be slipped by bit_delay bits (a delay of 32 bits or more is whole
+#   cycles).
+#
+# For TX and RX clocks of different rates (drifting_clock), the asynchronous mode can be elastic,
+#   as a receive elastic buffer: apply never waits, and the fill is kept between empty and a high
+#   watermark of cycle_delay + slack / 2 words:
+#   - RX faster, on underflow a word is inserted. With an external gearbox it is a pause (data and
+#     header valid low), which is lossless; otherwise the last word is repeated, which is not.
+#   - TX faster, above the high watermark TX gearbox pause words are deleted (lossless, external
+#     gearbox only). If the buffer is full, the oldest word is dropped, which is not lossless.
+#   Counts of each are kept in n_inserted, n_deleted and n_dropped.
+#
+# An ErrorChannel (error_channel.py) can be set in errors to inject bit errors into the captured TX
+#   words, before any bit slip. With the internal gearbox, the TX gearbox sequence (from inside the
+#   DUT, int_tx_gearbox_sequence) is read once to align the channel to the 66b blocks.
+
+
+class LoopbackChannel:
+    def __init__(self, dut, gearbox_pause_val, cycle_delay=1, bit_delay=0, external_gearbox=True,
+                    synchronous=False, elastic=False, slack=8, int_tx_gearbox_sequence=None):
+        self.tx_clk = dut.i_xver_tx_clk
+        self.rx_clk = dut.i_xver_rx_clk
+        self.tx_data = dut.o_xver_tx_data
+        self.tx_header = dut.o_xver_tx_header
+        self.tx_gearbox_sequence = dut.o_xver_tx_gearbox_sequence
+        self.rx_data = dut.i_xver_rx_data
+        self.rx_header = dut.i_xver_rx_header
+        self.rx_data_valid = dut.i_xver_rx_data_valid
+        self.rx_header_valid = dut.i_xver_rx_header_valid
+
+        self.gearbox_pause_val = gearbox_pause_val
+        self.external_gearbox = external_gearbox
+        self.synchronous = synchronous
+        self.elastic = elastic
+        self.cycle_delay = cycle_delay + bit_delay // 32
+        self.bit_delay = bit_delay % 32 if not external_gearbox else 0
+        self.data_width = len(self.tx_data)
+        self.data_mask = (1 << self.data_width) - 1
+
+        # Ring buffer, one list per signal
+        self.size = self.cycle_delay + slack
+        self.data = [0] * self.size
+        self.header = [0] * self.size
+        self.data_valid = [0] * self.size
+        self.header_valid = [0] * self.size
+        self.wr_ptr = self.cycle_delay % self.size
+        self.rd_ptr = 0
+        self.count = self.cycle_delay
+        self.not_empty = Event()
+        self.high_watermark = self.cycle_delay + slack // 2
+
+        self.n_inserted = 0
+        self.n_deleted = 0
+        self.n_dropped = 0
+
+        self.prev_gearbox_sequence = 0
+        self.prev_data_bits = 0
+
+        self.errors = None
+        self.int_tx_gearbox_sequence = int_tx_gearbox_sequence
+
+    def start(self):
+        if not self.external_gearbox:
+            self.rx_header.value = 0
+            self.rx_data_valid.value = 0
+            self.rx_header_valid.value = 0
+
+        if self.synchronous:
+            cocotb.start_soon(self.run_synchronous())
+        else:
+            cocotb.start_soon(self.capture())
+            cocotb.start_soon(self.apply())
+
+    def capture_word(self):
+        """Read the TX outputs into the ring buffer"""
+        data = self.tx_data.value
+        header = self.tx_header.value if self.external_gearbox else 0
+        gearbox_sequence = self.tx_gearbox_sequence.value
+        data_valid = gearbox_sequence != self.gearbox_pause_val
+        header_valid = gearbox_sequence != self.prev_gearbox_sequence and data_valid
+        self.prev_gearbox_sequence = gearbox_sequence
+
+        if self.errors is not None:
+            header, data = self.inject_errors(header, data, data_valid, header_valid)
+
+        if self.bit_delay:
+            data_noslip = int(data)
+            data = ((data_noslip << self.bit_delay) | self.prev_data_bits) & self.data_mask
+            self.prev_data_bits = data_noslip >> (self.data_width - self.bit_delay)
+
+        if self.elastic and self.external_gearbox and not data_valid and self.count >= self.high_watermark:
+            self.n_deleted += 1
+            return
+
+        if self.count == self.size:
+            if not self.elastic:
+                raise RuntimeError('Loopback buffer overflow, the RX clock is not keeping up with the TX clock')
+            self.rd_ptr = (self.rd_ptr + 1) % self.size
+            self.count -= 1
+            self.n_dropped += 1
+
+        wr_ptr = self.wr_ptr
+        self.data[wr_ptr] = data
+        self.header[wr_ptr] = header
+        self.data_valid[wr_ptr] = data_valid
+        self.header_valid[wr_ptr] = header_valid
+        self.wr_ptr = (wr_ptr + 1) % self.size
+        self.count += 1
+
+    def inject_errors(self, header, data, data_valid, header_valid):
+        """Header and data through the error channel, starting at a block boundary"""
+        errors = self.errors
+        if self.external_gearbox:
+            if not data_valid:
+                return header, data
+            if not errors.started:
+                if not header_valid:
+                    return header, data
+                errors.start(0)
+        elif not errors.started:
+            errors.start(self.int_tx_gearbox_sequence.value.integer)
+
+        return errors.apply(header, data)
+
+    def apply_word(self):
+        """Drive the RX inputs from the ring buffer, which must not be empty unless elastic"""
+        if not self.count:
+            self.n_inserted += 1
+            if self.external_gearbox:
+                self.rx_data_valid.value = 0
+                self.rx_header_valid.value = 0
+            return
+
+        rd_ptr = self.rd_ptr
+        self.rx_data.value = self.data[rd_ptr]
+        if self.external_gearbox:
+            self.rx_header.value = self.header[rd_ptr]
+            self.rx_data_valid.value = self.data_valid[rd_ptr]
+            self.rx_header_valid.value = self.header_valid[rd_ptr]
+        self.rd_ptr = (rd_ptr + 1) % self.size
+        self.count -= 1
+
+    async def run_synchronous(self):
+        tx_clk_edge = RisingEdge(self.tx_clk)
+        while True:
+            await tx_clk_edge
+            self.capture_word()
+            self.apply_word()
+
+    async def capture(self):
+        tx_clk_edge = RisingEdge(self.tx_clk)
+        while True:
+            await tx_clk_edge
+            self.capture_word()
+            if self.count == 1:
+                self.not_empty.set()
+
+    async def apply(self):
+        rx_clk_edge = RisingEdge(self.rx_clk)
+        while True:
+            await rx_clk_edge
+            while not self.count and not self.elastic:
+                self.not_empty.clear()
+                await self.not_empty.wait()
+            self.apply_word()
+
+
+async def drifting_clock(signal, period, ppm=0, jitter=0, seed=None):
+    """Clock of period (ps) offset by ppm (positive is faster) with uniform jitter of up to +/- jitter
+    (ps) on each edge. Edges are rounded to the simulator step (1 ps) from ideal times, so offsets of
+    less than a step per cycle still accumulate correctly. Starts high, as cocotb.clock.Clock."""
+    rng = random.Random(seed)
+    half_period = period / (1 + ppm * 1e-6) / 2
+    ideal_time = 0
+    time = 0
+    level = 1
+    signal.value = level
+
+    while True:
+        ideal_time += half_period
+        edge_time = max(time + 1, round(ideal_time + (rng.uniform(-jitter, jitter) if jitter else 0)))
+        await Timer(edge_time - time, units='ps')
+        time = edge_time
+        level ^= 1
+        signal.value = level
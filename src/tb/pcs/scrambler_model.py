@@ -0,0 +1,135 @@
+import numpy as np
+
+# 64b/66b scrambler reference model, polynomial 1 + x^39 + x^58 as per IEEE 802.3-2008, 49.2.6
+# Blocks are 64-bit integers with the first transmitted bit in the lsb, as scrambler.sv.
+#
+# With p the previous scrambled block, each output bit depends on p or on earlier bits of the
+# same block, which unrolls to:
+#   y = d ^ (p >> 25) ^ (p >> 6)
+#   s = y ^ (y << 39) ^ (y << 58)
+# Descrambling is feed forward so is vectorised directly. Scrambling is a linear recurrence
+# s[k] = L(d[k]) ^ M(s[k-1]) - the stream is split into segments which are scrambled in
+# parallel from a zero state, then the true state is carried across segment boundaries with
+# a precomputed jump matrix M^segment_length.
+
+MASK_64 = (1 << 64) - 1
+SCRAMBLER_INIT = MASK_64 # scrambler.sv resets the state to all ones
+
+_U64 = np.uint64
+
+def _spread(y):
+    return y ^ (y << _U64(39)) ^ (y << _U64(58))
+
+def _state_step(p):
+    # M - contribution of the previous block to the next scrambled block
+    return _spread((p >> _U64(25)) ^ (p >> _U64(6)))
+
+
+class _JumpMatrix:
+    """GF(2) 64x64 matrix applied to 64-bit blocks with byte lookup tables"""
+
+    def __init__(self, columns):
+        # columns[i] is the image of bit i
+        columns = np.asarray(columns, dtype=np.uint64)
+        tables = np.zeros((8, 256), dtype=np.uint64)
+        idxs = np.arange(256)
+        for byte in range(8):
+            for bit in range(8):
+                tables[byte, (idxs >> bit) & 1 == 1] ^= columns[8 * byte + bit]
+        self.tables = tables.tolist()
+
+    @classmethod
+    def from_step(cls, n):
+        """Matrix for n steps of the state recurrence M"""
+        columns = np.array([1 << i for i in range(64)], dtype=np.uint64)
+        for _ in range(n):
+            columns = _state_step(columns)
+        return cls(columns)
+
+    def __call__(self, x):
+        x = int(x)
+        ret = 0
+        for byte in range(8):
+            ret ^= self.tables[byte][(x >> (8 * byte)) & 0xff]
+        return ret
+
+
+class ScramblerModel:
+    MIN_SEGMENT_LENGTH = 64
+
+    _jumps = {}
+
+    def __init__(self, descramble=False, state=SCRAMBLER_INIT):
+        self.descramble = descramble
+        self.state = int(state) & MASK_64 # previous scrambled block
+
+    @classmethod
+    def _get_jump(cls, seg_len):
+        if seg_len not in cls._jumps:
+            cls._jumps[seg_len] = _JumpMatrix.from_step(seg_len)
+        return cls._jumps[seg_len]
+
+    def reset(self, state=SCRAMBLER_INIT):
+        self.state = int(state) & MASK_64
+
+    def next(self, blocks):
+        """Scramble (or descramble) an array of 64-bit blocks, returns a uint64 array"""
+        scalar = np.ndim(blocks) == 0
+        blocks = np.atleast_1d(np.asarray(blocks, dtype=np.uint64))
+
+        if len(blocks) == 0:
+            return blocks.copy()
+
+        if self.descramble:
+            ret = self._descramble(blocks)
+            self.state = int(blocks[-1])
+        else:
+            ret = self._scramble(blocks)
+            self.state = int(ret[-1])
+
+        return int(ret[0]) if scalar else ret
+
+    def stream(self, batches):
+        """Generator - scramble (or descramble) the data of each batch of (header, data) block arrays"""
+        for header, data in batches:
+            yield header, self.next(data)
+
+    def _descramble(self, blocks):
+        prev = np.empty_like(blocks)
+        prev[0] = self.state
+        prev[1:] = blocks[:-1]
+        return blocks ^ (blocks << _U64(39)) ^ (prev >> _U64(25)) ^ (blocks << _U64(58)) ^ (prev >> _U64(6))
+
+    def _scramble(self, blocks):
+        n = len(blocks)
+        # Balance the vectorised steps within segments against the serial steps across them
+        seg_len = max(self.MIN_SEGMENT_LENGTH, 1 << (int(np.sqrt(n)).bit_length() - 1))
+        n_segs = -(-n // seg_len)
+
+        # Segments as columns, zero padded
+        din = np.zeros(n_segs * seg_len, dtype=np.uint64)
+        din[:n] = blocks
+        din = np.ascontiguousarray(_spread(din).reshape(n_segs, seg_len).T)
+
+        # Scramble every segment from a zero state to find each segment's contribution
+        # to the state it hands on
+        s = np.zeros(n_segs, dtype=np.uint64)
+        for k in range(seg_len):
+            s = din[k] ^ _state_step(s)
+
+        # Carry the true state across the segment boundaries
+        jump = self._get_jump(seg_len)
+        seg_state = np.empty(n_segs, dtype=np.uint64)
+        state = self.state
+        for seg in range(n_segs):
+            seg_state[seg] = state
+            state = int(s[seg]) ^ jump(state)
+
+        # Scramble every segment again from its true initial state
+        ret = np.empty_like(din)
+        s = seg_state
+        for k in range(seg_len):
+            s = din[k] ^ _state_step(s)
+            ret[k] = s
+
+        return ret.T.reshape(-1)[:n]
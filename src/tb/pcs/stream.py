@@ -0,0 +1,107 @@
+import os
+import sys
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../gearbox'))
+
+from gearbox_model import TxGearboxModel, RxGearboxModel, MASK_32
+from scrambler_model import ScramblerModel, SCRAMBLER_INIT
+from encoder_model import EncoderModel
+from decoder_model import DecoderModel
+
+# Streaming pipeline of the PCS reference models
+#
+# Each stage is a generator of batches from an iterator of batches, so stages chain with bounded
+#   memory (one batch per stage in flight). Stages compose with |, and batches can be piped in:
+#
+#   pipeline = encode() | scramble() | tx_gearbox() | bit_slip(3) | rx_gearbox() | rx_blocks()
+#   for header, data in xgmii_batches | pipeline:
+#       ...
+#
+# Batch types:
+#   XGMII  - (ctl, data) arrays, 32 or 64-bit words as data_width
+#   blocks - (header, data) arrays of 64b66b blocks
+#   words  - uint32 arrays of serial words, one per gearbox cycle
+#   rx gearbox output - dicts of per cycle arrays, see RxGearboxModel.stream
+#
+# Stages hold their model's state, so a stage (or pipeline) is used for one stream.
+
+
+class Stage:
+    def __init__(self, fn):
+        self.fn = fn
+
+    def __call__(self, batches):
+        return self.fn(iter(batches))
+
+    def __or__(self, other):
+        return Stage(lambda batches: other(self(batches)))
+
+    def __ror__(self, batches):
+        return self(batches)
+
+
+def encode(data_width=32, ocode_support=False):
+    """XGMII -> blocks"""
+    model = EncoderModel(ocode_support)
+    return Stage(lambda batches: model.stream(batches, data_width))
+
+def decode(data_width=32):
+    """blocks -> XGMII"""
+    model = DecoderModel()
+    return Stage(lambda batches: model.stream(batches, data_width))
+
+def scramble(state=SCRAMBLER_INIT):
+    """blocks -> blocks"""
+    return Stage(ScramblerModel(state=state).stream)
+
+def descramble(state=SCRAMBLER_INIT):
+    """blocks -> blocks"""
+    return Stage(ScramblerModel(descramble=True, state=state).stream)
+
+def tx_gearbox(model=None, debug=False):
+    """blocks -> words"""
+    model = TxGearboxModel('packed') if model is None else model
+    return Stage(lambda batches: model.stream(batches, debug))
+
+def rx_gearbox(model=None, debug=False):
+    """words (or (words, slip) tuples) -> rx gearbox output"""
+    model = RxGearboxModel('packed') if model is None else model
+    return Stage(lambda batches: model.stream(batches, debug))
+
+def bit_slip(n_bits):
+    """words -> words, delayed by n_bits as the mac_pcs loopback bit_delay, initially zero"""
+    def _bit_slip(batches):
+        n_words, n_bits_word = divmod(n_bits, 32)
+        prev = np.zeros(n_words + 1, dtype=np.uint64)
+        for words in batches:
+            words = np.concatenate([prev, np.asarray(words, dtype=np.uint64)])
+            prev = words[len(words) - n_words - 1:]
+            # Word i takes its low bits from the top of word i - 1
+            words = words[1:len(words) - n_words] << np.uint64(n_bits_word) | \
+                    (words[:len(words) - n_words - 1] >> np.uint64(32 - n_bits_word) if n_bits_word else np.uint64(0))
+            yield (words & np.uint64(MASK_32)).astype(np.uint32)
+
+    return Stage(_bit_slip)
+
+def rx_blocks():
+    """rx gearbox output -> blocks, pairing the low (with header) and high data words of each block"""
+    def _rx_blocks(batches):
+        carry = None # Low word (header, data) waiting for its high word
+        for out in batches:
+            valid = np.asarray(out['data_valid'], dtype=bool)
+            header = np.asarray(out['header'], dtype=np.uint8)[valid]
+            data = np.asarray(out['data'], dtype=np.uint64)[valid]
+            low = (np.asarray(out['header_valid'], dtype=bool) & (np.asarray(out['frame_word']) == 0))[valid]
+
+            if carry is not None:
+                header = np.concatenate([[carry[0]], header]).astype(np.uint8)
+                data = np.concatenate([[carry[1]], data]).astype(np.uint64)
+                low = np.concatenate([[True], low])
+
+            idxs = np.flatnonzero(low[:-1] & ~low[1:])
+            carry = (header[-1], data[-1]) if len(low) and low[-1] else None
+
+            yield header[idxs], data[idxs] | (data[idxs + 1] << np.uint64(32))
+
+    return Stage(_rx_blocks)
@@ -7,6 +7,14 @@ from cocotb.result import TestFailure
 from cocotb.queue import Queue
 
 from pcs_test_vector import PCSTestVector
+from scrambler_model import ScramblerModel
+from encoder_model import EncoderModel
+from decoder_model import DecoderModel
+from lock_state_model import LockStateModel, GOOD_64
+from loopback import LoopbackChannel
+from code_defs import *
+
+import numpy as np
 
 import debugpy
 
@@ -47,38 +55,9 @@ class PCS_TB:
         self.dut.i_tx_reset.value = 0
         self.dut.i_rx_reset.value = 0
 
-    async def loopback(self, delay=1):
-        
-        async def capture_outputs(self, q, delay):
-            for _ in range(delay): await q.put([0, 0, 0, 0])
-            prev_tx_gearbox_seq = 0
-            while True:
-                await RisingEdge(self.dut.i_xver_tx_clk)
-                
-                o_xver_tx_data = self.dut.o_xver_tx_data.value
-                o_xver_tx_header = self.dut.o_xver_tx_header.value
-                xver_tx_data_valid = self.dut.o_xver_tx_gearbox_sequence.value != self.gearbox_pause_val
-
-                xver_tx_header_valid = self.dut.o_xver_tx_gearbox_sequence.value != prev_tx_gearbox_seq and xver_tx_data_valid
-                prev_tx_gearbox_seq = self.dut.o_xver_tx_gearbox_sequence.value
-
-                await q.put([o_xver_tx_data, o_xver_tx_header, xver_tx_data_valid, xver_tx_header_valid])
-
-        async def apply_input(self, q):
-            while True:
-                await RisingEdge(self.dut.i_xver_rx_clk)
-                [o_xver_tx_data, o_xver_tx_header, xver_tx_data_valid, xver_tx_header_valid] = await q.get()
-                
-                self.dut.i_xver_rx_data.value = o_xver_tx_data
-                self.dut.i_xver_rx_header.value = o_xver_tx_header
-                self.dut.i_xver_rx_data_valid.value = xver_tx_data_valid
-                self.dut.i_xver_rx_header_valid.value = xver_tx_header_valid
-
-                
-
-        q = Queue()
-        cocotb.start_soon(capture_outputs(self, q, delay))
-        cocotb.start_soon(apply_input(self, q))
+    async def loopback(self, delay=1, synchronous=True):
+        # The TX and RX clocks are the same, so the single coroutine loopback can be used
+        LoopbackChannel(self.dut, self.gearbox_pause_val, cycle_delay=delay, synchronous=synchronous).start()
 
 
 
@@ -195,3 +174,198 @@ async def tx_rx_loopback_test(dut):
             tb.dut.i_xgmii_tx_ctl.value = ctl        
 
     await rx_monitor
+
+
+#
+#   Test transmit scrambling of a long random data stream against the scrambler model
+#
+@cocotb.test()
+async def scramble_random_stream_test(dut):
+
+    tb = PCS_TB(dut)
+    n_words = 4000
+
+    rng = np.random.default_rng(0)
+    tx_words = rng.integers(0, 1 << 32, n_words, dtype=np.uint64)
+
+    await tb.reset()
+
+    # drive data words only, so every encoded block is the input data unchanged
+    tx_scrambled_words = []
+    word_index = 0
+    while word_index < n_words:
+        await RisingEdge(tb.dut.i_xver_tx_clk)
+        if tb.dut.o_xgmii_tx_ready.value:
+            tx_scrambled_words.append(tb.dut.tx_scrambled_data.value.integer)
+            tb.dut.i_xgmii_tx_data.value = int(tx_words[word_index])
+            tb.dut.i_xgmii_tx_ctl.value = 0
+            word_index += 1
+
+    tx_scrambled_words = np.array(tx_scrambled_words, dtype=np.uint64)
+    tx_word_pairs = tx_words[:-1] | (tx_words[1:] << np.uint64(32))
+
+    # the scrambler is bit serial, so any pairing of the 32-bit words into 64-bit blocks
+    #   can be checked as long as the input words are paired the same way
+    words = tx_scrambled_words[:len(tx_scrambled_words) // 2 * 2]
+    scrambled_blocks = words[0::2] | (words[1::2] << np.uint64(32))
+
+    # find the first data block in the scrambled stream
+    descrambled = ScramblerModel(descramble=True, state=scrambled_blocks[0]).next(scrambled_blocks[1:32])
+    for block_index, block in enumerate(descrambled, start=1):
+        matches = np.nonzero(tx_word_pairs == block)[0]
+        if len(matches):
+            word_index = matches[0]
+            break
+    else:
+        raise TestFailure('Could not find input data in the scrambled output')
+
+    tx_blocks = tx_word_pairs[word_index::2]
+    dut_blocks = scrambled_blocks[block_index:]
+    n_blocks = min(len(tx_blocks), len(dut_blocks))
+    print(f'Checking {n_blocks} scrambled blocks')
+
+    model = ScramblerModel(state=scrambled_blocks[block_index - 1])
+    model_blocks = model.next(tx_blocks[:n_blocks])
+    mismatches = np.nonzero(model_blocks != dut_blocks[:n_blocks])[0]
+
+    assert len(mismatches) == 0, \
+        f'{len(mismatches)} scrambled blocks incorrect, first at block {mismatches[0]}: ' + \
+        f'{int(dut_blocks[mismatches[0]]):016x} != {int(model_blocks[mismatches[0]]):016x}'
+
+
+def gen_xgmii_blocks(rng, n_blocks):
+    """Random 64-bit XGMII (ctl, data) blocks - packets with S0/S4 starts and every terminate
+    lane, idles and the occasional error block"""
+    idle = int(''.join([f'{RS_IDLE:02x}'] * 8), 16)
+    ctl, data = [], []
+    while len(data) < n_blocks:
+        if rng.random() < 0.5:
+            ctl.append(0x01)
+            data.append((int(rng.integers(0, 1 << 56)) << 8) | RS_START)
+        else:
+            ctl.append(0x1f)
+            data.append((int(rng.integers(0, 1 << 24)) << 40) | (RS_START << 32) | (idle & 0xffffffff))
+
+        for _ in range(int(rng.integers(0, 8))):
+            ctl.append(0x00)
+            data.append(int(rng.integers(0, 1 << 64, dtype=np.uint64)))
+
+        term_lane = int(rng.integers(0, 8))
+        term_mask = (1 << (8 * term_lane)) - 1
+        ctl.append((0xff << term_lane) & 0xff)
+        data.append((int(rng.integers(0, 1 << 64, dtype=np.uint64)) & term_mask) | (RS_TERM << (8 * term_lane)) |
+                        (idle & ~((1 << (8 * term_lane + 8)) - 1) & ((1 << 64) - 1)))
+
+        for _ in range(int(rng.integers(1, 4))):
+            ctl.append(0xff)
+            data.append(idle)
+
+        if rng.random() < 0.05:
+            ctl.append(0xff)
+            data.append(int(rng.integers(0, 1 << 64, dtype=np.uint64)))
+
+    return np.array(ctl[:n_blocks], dtype=np.uint8), np.array(data[:n_blocks], dtype=np.uint64)
+
+
+#
+#   Test tx -> rx chain in loopback with a long random stream against the encoder/decoder models
+#
+@cocotb.test()
+async def encode_decode_random_stream_test(dut):
+
+    tb = PCS_TB(dut, loopback=True)
+    n_blocks = 2000
+
+    rng = np.random.default_rng(0)
+    tx_ctl, tx_data = xgmii_to_32(*gen_xgmii_blocks(rng, n_blocks))
+
+    await tb.reset()
+
+    rx_words = []
+    async def monitor_rx_data():
+        while True:
+            await RisingEdge(tb.dut.i_xver_rx_clk)
+            if tb.dut.o_xgmii_rx_valid.value:
+                rx_words.append((tb.dut.o_xgmii_rx_ctl.value.integer << 32) | tb.dut.o_xgmii_rx_data.value.integer)
+
+    # transmit idles to allow gearbox to sync
+    for _ in range(200):
+        await RisingEdge(tb.dut.i_xver_tx_clk)
+
+    cocotb.start_soon(monitor_rx_data())
+
+    word_index = 0
+    while word_index < len(tx_data):
+        await RisingEdge(tb.dut.i_xver_tx_clk)
+        if tb.dut.o_xgmii_tx_ready.value:
+            tb.dut.i_xgmii_tx_data.value = int(tx_data[word_index])
+            tb.dut.i_xgmii_tx_ctl.value = int(tx_ctl[word_index])
+            word_index += 1
+
+    for _ in range(100):
+        await RisingEdge(tb.dut.i_xver_tx_clk)
+
+    rx_words = np.array(rx_words, dtype=np.uint64)
+
+    # the encoder pairs words into blocks from whichever word it sees first, so model both
+    #   pairings - the odd one starts with the idle word driven before the stream
+    encoder = EncoderModel()
+    decoder = DecoderModel()
+    idle_ctl, idle_data = tx_ctl[-1:], tx_data[-1:]
+    for model_ctl, model_data in [(tx_ctl, tx_data), (np.concatenate([idle_ctl, tx_ctl]), np.concatenate([idle_data, tx_data]))]:
+        header, blocks = encoder.encode(model_data, model_ctl, data_width=32)
+        rx_model_ctl, rx_model_data, _ = decoder.decode(header, blocks, data_width=32)
+        model_words = (rx_model_ctl.astype(np.uint64) << np.uint64(32)) | rx_model_data
+
+        # skip the start of the stream and find it in the rx output
+        window = model_words[16:32]
+        for rx_index in np.nonzero(rx_words == window[0])[0]:
+            if np.array_equal(rx_words[rx_index:rx_index + len(window)], window):
+                break
+        else:
+            continue
+
+        n_words = min(len(model_words) - 16, len(rx_words) - rx_index)
+        mismatches = np.nonzero(rx_words[rx_index:rx_index + n_words] != model_words[16:16 + n_words])[0]
+        print(f'Checking {n_words} rx words')
+        assert len(mismatches) == 0, \
+            f'{len(mismatches)} rx words incorrect, first at word {mismatches[0]}: ' + \
+            f'{int(rx_words[rx_index + mismatches[0]]):09x} != {int(model_words[16 + mismatches[0]]):09x}'
+        assert n_words > len(model_words) // 2, 'rx stream too short'
+        return
+
+    raise TestFailure('Could not find tx stream in the rx output')
+
+
+#
+#   Test time to block lock from reset against the lock state model, driven with the same rx words
+#
+@cocotb.test()
+async def block_lock_time_test(dut):
+
+    tb = PCS_TB(dut, loopback=True)
+
+    if dut.EXTERNAL_GEARBOX.value != 0:
+        dut._log.info('Skipping, block lock is only modelled with the internal gearbox')
+        return
+
+    await tb.reset()
+
+    rx_words = []
+    lock_cycle = None
+    for cycle in range(10000):
+        await RisingEdge(tb.dut.i_xver_rx_clk)
+        rx_data = tb.dut.i_xver_rx_data.value
+        rx_words.append(rx_data.integer if rx_data.is_resolvable else 0)
+        if tb.dut.u_lock_state.state.value == GOOD_64:
+            lock_cycle = cycle
+            break
+
+    assert lock_cycle is not None, 'No block lock'
+
+    model = LockStateModel(1)
+    model.run(np.array([rx_words], dtype=np.uint64))
+    print(f'Block lock after {lock_cycle} cycles, model {model.lock_cycle[0]} cycles with {model.n_slips[0]} slips')
+
+    # Allow for the sampling of the rx words against the reset
+    assert abs(int(model.lock_cycle[0]) - lock_cycle) <= 2, 'Lock time does not match the model'
@@ -0,0 +1,85 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../mac'))
+
+from stream import Stage, encode, decode, scramble, descramble, tx_gearbox, rx_gearbox, bit_slip, rx_blocks
+from lock_state_model import LockStateModel, SLIP
+from mac_model import TxMacModel
+
+# Checks of the streaming PCS pipeline, without a simulator
+
+LEAD_IDLE = 4000 # XGMII words of idle before the frames, for the RX to lock
+SETTLE = 64 # XGMII words compared before the first frame
+
+
+def xgmii_stream(seed, n_frames=40):
+    """XGMII (ctl, data) of idles, then frames, then idles, a whole number of gearbox sequences"""
+    rng = np.random.default_rng(seed)
+    tx_mac = TxMacModel()
+    frames = [rng.integers(0, 256, rng.integers(1, 300), dtype=np.uint8).tobytes() for _ in range(n_frames)]
+    parts = [tx_mac.idle(LEAD_IDLE), tx_mac.next(frames, gap=3), tx_mac.idle(500)]
+    ctl, data = (np.concatenate(part) for part in zip(*parts))
+    n = len(data) // 32 * 32
+    return ctl[:n], data[:n]
+
+
+def batched(arrays, batch_size):
+    return [tuple(array[i:i + batch_size] for array in arrays) for i in range(0, len(arrays[0]), batch_size)]
+
+
+def lock_slips(words):
+    """Gearbox slip of each cycle, from the lock state machine run on the words"""
+    model = LockStateModel(1)
+    slips = np.zeros(len(words), dtype=bool)
+    for cycle, word in enumerate(words.tolist()):
+        slips[cycle] = model.state[0] == SLIP
+        model.next([word])
+    assert model.lock_cycle[0] >= 0
+    return slips, int(model.lock_cycle[0])
+
+
+def with_slips(slips):
+    """words -> (words, slip) tuples"""
+    def _with_slips(batches):
+        cycle = 0
+        for words in batches:
+            yield words, slips[cycle:cycle + len(words)]
+            cycle += len(words)
+
+    return Stage(_with_slips)
+
+
+def first_start(ctl, data):
+    return int(np.flatnonzero((ctl == 0x1) & (data == np.uint64(0x555555fb)))[0])
+
+
+@pytest.mark.parametrize("batch_size", [3, 7, 66, 1000])
+@pytest.mark.parametrize("n_bits", [0, 1, 31, 32, 33, 65, 66, 100])
+def test_loopback_round_trip(batch_size, n_bits):
+    ctl, data = xgmii_stream(batch_size * 100 + n_bits)
+
+    wire = encode() | scramble() | tx_gearbox() | bit_slip(n_bits)
+    words = np.concatenate(list(batched((ctl, data), batch_size) | wire))
+    assert len(words) == len(data) // 32 * 33
+
+    # As one long bit stream, first word in the low bits, the delay is a shift
+    ref_words = next([(ctl, data)] | encode() | scramble() | tx_gearbox())
+    stream = int.from_bytes(ref_words.astype('<u4').tobytes(), 'little') << n_bits
+    assert np.array_equal(words, np.frombuffer(stream.to_bytes(4 * len(words) + 32, 'little'), dtype='<u4')[:len(words)])
+
+    slips, lock_cycle = lock_slips(words)
+    assert lock_cycle < LEAD_IDLE - SETTLE
+
+    pipeline = wire | with_slips(slips) | rx_gearbox() | rx_blocks() | descramble() | decode()
+    out_ctl, out_data = (np.concatenate(part) for part in zip(*(batched((ctl, data), batch_size) | pipeline)))
+
+    # Blocks before lock are garbage, from just before the first frame the output is the input,
+    # less the last few words still in the pipeline
+    offset = first_start(ctl, data) - first_start(out_ctl, out_data)
+    start = first_start(out_ctl, out_data) - SETTLE
+    assert 0 <= len(data) - (offset + len(out_data)) < 8
+    assert np.array_equal(out_ctl[start:], ctl[offset + start : offset + len(out_ctl)])
+    assert np.array_equal(out_data[start:], data[offset + start : offset + len(out_data)])
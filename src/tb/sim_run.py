@@ -0,0 +1,146 @@
+"""sim_run.py
+
+    Compile once, run many - a build cache for cocotb_test.simulator.run.
+
+    The compiled image is cached under a key hashed from the content of the HDL sources and the
+    include dirs, the parameters and the compile options. Runs that differ only in Python-side
+    config (seed, loopback slips etc.) share one compile: the cached image is copied into the run's
+    sim_build, and cocotb_test skips compiling as it is up to date.
+
+    Set SIM_CACHE=0 to always compile, or SIM_CACHE_DIR to share a cache between test directories.
+
+    The simulator is picked with SIM (icarus by default, or verilator), and the compile options
+    each needs are added here (only here, the Makefiles don't repeat them), so the runners are the
+    same for either. With Verilator, the cached executable is run directly, with the run's
+    sim_build as the working directory for its config and memory files. SIM_THREADS builds a
+    multi-threaded Verilator model.
+
+    Verilator has not been shown to work with the cocotb verilog-axi testbenches, so SIM=verilator
+    is an error unless SIM_ALLOW_VERILATOR=1 is also set, to try it.
+
+"""
+
+import os
+import glob
+import shutil
+import hashlib
+import tempfile
+
+from cocotb_test.simulator import run, Verilator
+
+DEFAULT_SIMULATOR = 'icarus'
+
+# Simulators with a cacheable image, the image file name for a toplevel
+CACHED_IMAGES = {
+    'icarus' : lambda toplevel: f'{toplevel}.vvp',
+    'verilator' : lambda toplevel: toplevel
+}
+
+# Verilog compile arguments for each simulator, before any the runner gives
+SIM_COMPILE_ARGS = {
+    'icarus' : ['-g2012'],
+    'verilator' : ['-Wno-fatal', '-O3']
+}
+
+INCLUDE_EXTENSIONS = ['.v', '.sv', '.vh', '.svh', '.mem']
+
+
+def _hash_file(h, filename):
+    h.update(os.path.abspath(filename).encode())
+    with open(filename, 'rb') as f:
+        h.update(hashlib.sha256(f.read()).digest())
+
+
+def build_key(simulator, toplevel, verilog_sources, includes=None, parameters=None, defines=None,
+                compile_args=None, verilog_compile_args=None, waves=None, timescale=None, **kwargs):
+    """Content hash of everything that goes into the compiled image"""
+    h = hashlib.sha256()
+    h.update(repr((simulator, toplevel, sorted((parameters or {}).items(), key=str), defines,
+                    compile_args, verilog_compile_args, waves, timescale)).encode())
+
+    for source in verilog_sources:
+        _hash_file(h, source)
+
+    for include in includes or []:
+        h.update(os.path.abspath(include).encode())
+        for filename in sorted(glob.glob(os.path.join(include, '*'))):
+            if os.path.splitext(filename)[1] in INCLUDE_EXTENSIONS:
+                _hash_file(h, filename)
+
+    return h.hexdigest()[:16]
+
+
+class CachedVerilator(Verilator):
+    """Verilator, running an executable already built in sim_build instead of building it"""
+    # cocotb_test Simulator attributes the command is built from, not a public interface
+    REQUIRED_ATTRIBUTES = ['sim_dir', 'toplevel_module', 'plus_args']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        missing = [name for name in self.REQUIRED_ATTRIBUTES if not hasattr(self, name)]
+        if missing:
+            raise RuntimeError(f"cocotb_test's Verilator has no {', '.join(missing)}, CachedVerilator needs updating "
+                                "for this cocotb_test version (or run with SIM_CACHE=0)")
+
+    def build_command(self):
+        return [[os.path.join(self.sim_dir, self.toplevel_module)] + self.plus_args]
+
+
+def compile_args(simulator):
+    """Verilog compile arguments for simulator, with SIM_THREADS threads for Verilator"""
+    args = list(SIM_COMPILE_ARGS.get(simulator, []))
+    threads = int(os.getenv('SIM_THREADS', 1))
+    if simulator == 'verilator' and threads > 1:
+        args += ['--threads', str(threads)]
+    return args
+
+
+def run_cached(simulator=None, sim_build='sim_build', cache_dir=None, data_files=None, **kwargs):
+    """cocotb_test.simulator.run, reusing a cached compile when one matches. simulator defaults to
+    SIM, then DEFAULT_SIMULATOR. data_files (e.g. $readmemh files) are copied into sim_build, the
+    working directory of the simulation with any simulator."""
+    simulator = os.getenv('SIM', simulator or DEFAULT_SIMULATOR)
+    if simulator == 'verilator' and os.getenv('SIM_ALLOW_VERILATOR', '0') != '1':
+        raise ValueError('Verilator has not been shown to work with the cocotb verilog-axi testbenches, '
+                         'set SIM_ALLOW_VERILATOR=1 to try it')
+    kwargs['verilog_compile_args'] = compile_args(simulator) + list(kwargs.get('verilog_compile_args') or [])
+
+    os.makedirs(sim_build, exist_ok=True)
+    for filename in data_files or []:
+        shutil.copyfile(filename, os.path.join(sim_build, os.path.basename(filename)))
+
+    if simulator not in CACHED_IMAGES or os.getenv('SIM_CACHE', '1') == '0' or \
+            kwargs.get('force_compile') or kwargs.get('compile_only'):
+        return run(simulator=simulator, sim_build=sim_build, **kwargs)
+
+    if kwargs.get('waves') is None:
+        kwargs['waves'] = bool(int(os.getenv('WAVES', 0)))
+
+    cache_dir = cache_dir or os.getenv('SIM_CACHE_DIR', os.path.join('sim_build', 'cache'))
+    image = CACHED_IMAGES[simulator](kwargs['toplevel'])
+    cached_build = os.path.join(cache_dir, build_key(simulator, **kwargs))
+
+    if not os.path.exists(os.path.join(cached_build, image)):
+        # Compile to a private directory and move into place, so concurrent runs don't collide
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_build = tempfile.mkdtemp(dir=cache_dir, prefix='tmp_')
+        try:
+            run(simulator=simulator, sim_build=tmp_build, compile_only=True, **kwargs)
+            os.rename(tmp_build, cached_build)
+        except OSError:
+            if not os.path.exists(os.path.join(cached_build, image)):
+                raise
+        finally:
+            shutil.rmtree(tmp_build, ignore_errors=True)
+
+    if simulator == 'verilator':
+        # Runs in the cache, a temporary results file is moved to sim_build
+        results = CachedVerilator(sim_build=cached_build, work_dir=sim_build, **kwargs).run()
+        if os.getenv('COCOTB_RESULTS_FILE'):
+            return results
+        return shutil.move(results, os.path.join(sim_build, os.path.basename(results)))
+
+    # A fresh copy is newer than the sources, so is not recompiled
+    shutil.copyfile(os.path.join(cached_build, image), os.path.join(sim_build, image))
+
+    return run(simulator=simulator, sim_build=sim_build, **kwargs)